@@ -6,7 +6,8 @@ import numpy as np
 import cv2
 import time
 import httpx
-from service.face_query_service import query_face_service as face_query_service
+from service.face_query_service import query_face_image_service
+from service.query_pipeline import QueryImage
 from service.add_embedding_simple_service import simple_add_embedding_service
 from service.anti_spoofing_service import spoof_detection_service
 from service.checkin_service import checkin_service as svc_checkin
@@ -20,7 +21,6 @@ import numpy as np
 import cv2
 import time
 import httpx
-from service.face_query_service import query_face_service as face_query_service
 from service.add_embedding_simple_service import simple_add_embedding_service
 from service.anti_spoofing_service import spoof_detection_service
 from service.checkin_service import checkin_service as svc_checkin
@@ -92,14 +92,14 @@ async def query_face(
     3. Nếu không tìm thấy, tự động thêm mới
     4. Trả về kết quả tương ứng
     """
+    # Đọc + decode ảnh một lần, các bước dưới dùng chung (ảnh 224 cho spoof, 256 cho emotion, 112 cho ArcFace)
+    query = await QueryImage.from_upload(image)
+
     # Bước 1: Kiểm tra chống giả mạo
-    await image.seek(0)
-    spoof_check = await spoof_detection_service.check_spoof(image)
+    spoof_check = await spoof_detection_service.check_spoof_image(query)
 
     # Bước 2: Thực hiện query face bình thường
-    # ensure file pointer is at beginning because spoof_detection_service may have read the file
-    await image.seek(0)
-    result = await face_query_service(image)
+    result = await query_face_image_service(query)
 
     # Bước 3: Kiểm tra kết quả
     if result and not result.get("error"):
@@ -217,10 +217,9 @@ async def query_face(
 async def query_and_checkin(
     image: UploadFile = File(..., description="File ảnh chứa khuôn mặt cần nhận diện", media_type="image/*")
 ):
-    await image.seek(0)
-    spoof_check = await spoof_detection_service.check_spoof(image)
-    await image.seek(0)
-    result = await face_query_service(image)
+    query = await QueryImage.from_upload(image)
+    spoof_check = await spoof_detection_service.check_spoof_image(query)
+    result = await query_face_image_service(query)
     if result and not result.get('error'):
         # only proceed if we have a class_id
         class_id = result.get('class_id')
@@ -260,10 +259,9 @@ async def query_and_checkin(
 async def query_and_checkout(
     image: UploadFile = File(..., description="File ảnh chứa khuôn mặt cần nhận diện", media_type="image/*")
 ):
-    await image.seek(0)
-    spoof_check = await spoof_detection_service.check_spoof(image)
-    await image.seek(0)
-    result = await face_query_service(image)
+    query = await QueryImage.from_upload(image)
+    spoof_check = await spoof_detection_service.check_spoof_image(query)
+    result = await query_face_image_service(query)
     if result and not result.get('error'):
         class_id = result.get('class_id')
         if class_id:
@@ -0,0 +1,43 @@
+from typing import List
+from fastapi import APIRouter, File, UploadFile, Query
+from fastapi.responses import JSONResponse
+
+from service.face_query_batch_service import query_face_batch_service
+
+face_query_batch_router = APIRouter()
+
+@face_query_batch_router.post(
+    '/query_batch',
+    summary="Nhận diện khuôn mặt - nhiều ảnh một request",
+    description="""
+    **Nhận diện nhiều ảnh khuôn mặt trong một request**
+
+    Dùng cho camera gửi liên tiếp nhiều frame:
+    - Decode các ảnh song song
+    - Trích xuất đặc trưng từng khuôn mặt
+    - Tìm kiếm tất cả embedding bằng một lần search FAISS
+    - Mỗi người (class_id) chỉ truy vấn MySQL một lần cho cả batch
+
+    **Kết quả trả về:**
+    - Danh sách kết quả theo đúng thứ tự file upload
+    - Mỗi phần tử gồm filename và các kết quả có score > 0.42 (hoặc error nếu ảnh lỗi)
+
+    **Lưu ý:**
+    - Tối đa 32 ảnh mỗi request
+    - Ảnh lỗi không làm hỏng cả batch
+    """,
+    response_description="Kết quả nhận diện cho từng ảnh",
+    tags=["👤 Nhận Diện Khuôn Mặt"]
+)
+async def query_face_batch(
+    files: List[UploadFile] = File(
+        ...,
+        description="Các file ảnh chứa khuôn mặt cần nhận diện (JPG, PNG, WEBP)"
+    ),
+    topk: int = Query(1, ge=1, le=20, description="Số kết quả tối đa cho mỗi ảnh")
+):
+    result = await query_face_batch_service(files, topk=topk)
+    status_code = result.get("status_code", 200)
+    if "status_code" in result:
+        result = {k: v for k, v in result.items() if k != "status_code"}
+    return JSONResponse(content=result, status_code=status_code)
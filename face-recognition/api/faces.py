@@ -1,6 +1,8 @@
+from typing import List
 from fastapi import APIRouter, File, UploadFile, Form
 from fastapi.responses import JSONResponse
-from service.add_face_service import add_face_service
+from config import FACES_BATCH_MAX_IMAGES
+from service.add_face_service import add_face_service, add_faces_service
 from service.list_faces_service import list_faces_service
 from service.delete_faces_service import delete_faces_for_user
 
@@ -27,6 +29,23 @@ def add_face(user_id: int = Form(...), image: UploadFile = File(...)):
 
 
 
+@faces_router.post('/faces/batch', summary='Thêm nhiều khuôn mặt cho một người (nhiều ảnh + user_id) (multipart/form-data)')
+def add_faces(user_id: int = Form(...), images: List[UploadFile] = File(...)):
+    # Embedding của tất cả ảnh được trích xuất bằng một lần forward theo batch
+    if len(images) > FACES_BATCH_MAX_IMAGES:
+        return JSONResponse(content={'success': False, 'message': f'Tối đa {FACES_BATCH_MAX_IMAGES} ảnh mỗi request'},
+                            status_code=400)
+    try:
+        files = [(image.filename, image.file.read()) for image in images]
+    except Exception as e:
+        return JSONResponse(content={'success': False, 'message': f'Không đọc được file ảnh: {e}'}, status_code=400)
+
+    result = add_faces_service(user_id, files)
+    status_code = result.get('status_code', 200)
+    body = {k: v for k, v in result.items() if k != 'status_code'}
+    return JSONResponse(content=body, status_code=status_code)
+
+
 @faces_router.get('/faces/{user_id}', summary='Lấy danh sách khuôn mặt của nhân viên (yêu cầu đăng nhập)')
 def list_faces(user_id: int, include_image_base64: bool = False):
     # no authentication required for listing faces
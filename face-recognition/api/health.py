@@ -106,6 +106,9 @@ def health_check():
     - faiss_info: Tổng số vectors, loại index, trạng thái sẵn sàng
     - request_stats: Số lượng request đã xử lý, tỷ lệ thành công
     - system_resources: Tình trạng tài nguyên hệ thống
+    - inference_batching: Độ sâu hàng đợi, phân bố batch size và thời gian chờ của micro-batching (ArcFace, age/gender)
+    - inference_cache: Số phần tử, hit/miss và số phần tử bị loại (LRU/TTL) của cache kết quả model theo hash ảnh
+    - models: Trạng thái load/warm-up của từng model (ArcFace, age/gender, EmoNet, anti-spoofing)
     
     **Ứng dụng:**
     - Monitoring hiệu suất chi tiết
@@ -133,10 +136,19 @@ def detailed_health_check():
         'note': 'FAISS status check simplified'
     }
     
+    # Độ sâu hàng đợi và batch size của các scheduler micro-batching (ArcFace, age/gender...)
+    from service.inference_scheduler import get_scheduler_stats
+    # Hit/miss của cache kết quả model theo hash nội dung ảnh
+    from service.inference_cache import get_cache_stats
+    from service.model_loader import get_model_states
+    
     detailed_status = {
         **health_status,
         'performance_metrics': performance_stats,
-        'faiss_info': faiss_info
+        'faiss_info': faiss_info,
+        'inference_batching': get_scheduler_stats(),
+        'inference_cache': get_cache_stats(),
+        'models': get_model_states()
     }
     
     status_code = 200 if health_status['status'] == 'healthy' else 503
@@ -148,16 +160,19 @@ def detailed_health_check():
 
 @health_router.get('/health/readiness')
 def readiness_check():
-    """Readiness check cho Kubernetes/Docker"""
+    """
+    Readiness check cho Kubernetes/Docker: 200 khi các model required (ArcFace) đã load + warm-up xong.
+    models: trạng thái từng model (pending/loading/ready/failed), thời gian load/warm-up, lỗi nếu có;
+    model không required (age/gender, EmoNet, anti-spoofing) chỉ làm chậm/giảm chức năng endpoint dùng nó.
+    """
     health_status = get_server_health()
+    from service.model_loader import get_model_states, models_ready
     
-    # Kiểm tra các components cần thiết
-    required_components = ['shared_instances', 'faiss_index', 'model_extractor']
-    is_ready = all(health_status['components'].get(comp, False) for comp in required_components)
+    is_ready = health_status['status'] == 'healthy' and models_ready()
     
     readiness_status = {
         'ready': is_ready,
-        'components': health_status['components'],
+        'models': get_model_states(),
         'timestamp': health_status['timestamp']
     }
     
@@ -27,6 +27,8 @@ status_router = APIRouter()
     - embedding_dimension: Số chiều của vector embedding
     - memory_usage: Bộ nhớ index đang sử dụng
     - last_updated: Thời gian cập nhật gần nhất
+    - generation: Generation snapshot của gallery đang phục vụ
+    - reload: Trạng thái tự load lại khi replica khác ghi generation mới (reload_count, last_reload_at, last_error)
     
     **Ứng dụng:**
     - Kiểm tra tình trạng index trước khi query
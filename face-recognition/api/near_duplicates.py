@@ -0,0 +1,58 @@
+from fastapi import APIRouter, Query, Depends
+from fastapi.responses import JSONResponse
+
+from config import DUPLICATE_SCORE_THRESHOLD, CROSS_CLASS_SCORE_THRESHOLD
+from service.near_duplicates_service import near_duplicates_service, prune_near_duplicates_service
+# 🔐 Import MySQL Authentication
+from auth.mysql_auth import get_current_user_mysql
+
+near_duplicates_router = APIRouter()
+
+@near_duplicates_router.get(
+    '/near_duplicates',
+    summary="Tìm ảnh khuôn mặt gần trùng trong gallery (Cần MySQL Login)",
+    description="""
+    **🔒 API BẢO MẬT - Kiểm tra ảnh trùng trên toàn bộ gallery FAISS**
+
+    Chạy self-kNN chính xác trên toàn gallery (chia khối để giới hạn bộ nhớ) và trả về:
+    - Cặp ảnh gần trùng trong **cùng một người** (đăng ký lại, upload trùng)
+    - Cặp ảnh rất giống nhau nhưng **khác người** (có thể gán nhầm class_id)
+    - Danh sách image_id nên xóa và dung lượng tiết kiệm được
+
+    Xóa bằng `POST /near_duplicates/prune`.
+    """,
+    response_description="Báo cáo ảnh trùng",
+    tags=["📊 Thông Tin Database"]
+)
+def near_duplicates(
+    duplicate_threshold: float = Query(DUPLICATE_SCORE_THRESHOLD, ge=0.0, le=1.0, description="Ngưỡng score ảnh trùng cùng người"),
+    cross_class_threshold: float = Query(CROSS_CLASS_SCORE_THRESHOLD, ge=0.0, le=1.0, description="Ngưỡng score nghi gán nhầm người"),
+    max_pairs: int = Query(200, ge=0, le=5000, description="Số cặp tối đa trả về mỗi loại"),
+    current_user: str = Depends(get_current_user_mysql)
+):
+    result = near_duplicates_service(duplicate_threshold, cross_class_threshold, max_pairs)
+    status_code = result.pop("status_code", 200)
+    return JSONResponse(content=result, status_code=status_code)
+
+
+@near_duplicates_router.post(
+    '/near_duplicates/prune',
+    summary="Xóa ảnh trùng trong cùng người (Cần MySQL Login)",
+    description="""
+    **🔒 API BẢO MẬT - Xóa ảnh gần trùng khỏi FAISS trong một thao tác**
+
+    - Mỗi cụm ảnh trùng của cùng một người giữ lại ảnh được thêm sớm nhất (image_id nhỏ nhất)
+    - Không bao giờ xóa hết ảnh của một người
+    - ⚠️ Chỉ xóa khỏi FAISS, dữ liệu MySQL giữ nguyên
+    """,
+    response_description="Các image_id đã xóa",
+    tags=["🗑️ Xóa Dữ Liệu (Protected)"]
+)
+def prune_near_duplicates(
+    duplicate_threshold: float = Query(DUPLICATE_SCORE_THRESHOLD, ge=0.5, le=1.0, description="Ngưỡng score ảnh trùng cùng người"),
+    current_user: str = Depends(get_current_user_mysql)
+):
+    print(f"User {current_user} xoa anh trung (threshold={duplicate_threshold})")
+    result = prune_near_duplicates_service(duplicate_threshold)
+    status_code = result.pop("status_code", 200)
+    return JSONResponse(content=result, status_code=status_code)
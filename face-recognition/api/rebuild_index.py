@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from service.rebuild_gallery_service import start_rebuild_service, rebuild_status_service
+# 🔐 Import MySQL Authentication
+from auth.mysql_auth import get_current_user_mysql
+
+rebuild_router = APIRouter()
+
+@rebuild_router.post(
+    '/rebuild_index',
+    summary="Build lại FAISS gallery từ ảnh trong MySQL (Cần MySQL Login)",
+    description="""
+    **🔒 API BẢO MẬT - Embed lại toàn bộ ảnh khuôn mặt trong bảng khuonmat**
+
+    Dùng khi đổi model (MODEL_PATH) hoặc FAISS index bị hỏng. Khác với `/reset_index`, API này
+    **không xóa** dữ liệu MySQL:
+    - Đọc ảnh từ bảng khuonmat theo từng khối
+    - Decode song song và embed theo batch
+    - Ghi generation index mới và thay vào khi xong (query vẫn chạy trên index cũ trong lúc rebuild)
+
+    Job chạy nền; theo dõi tiến độ bằng `GET /rebuild_index/status`.
+    """,
+    response_description="Trạng thái job rebuild",
+    tags=["🔄 Reset Database"]
+)
+def rebuild_index(current_user: str = Depends(get_current_user_mysql)):
+    print(f"User {current_user} bat dau rebuild FAISS gallery")
+    result = start_rebuild_service()
+    status_code = result.pop("status_code", 200)
+    return JSONResponse(content=result, status_code=status_code)
+
+
+@rebuild_router.get(
+    '/rebuild_index/status',
+    summary="Tiến độ rebuild FAISS gallery",
+    description="Trạng thái, số ảnh đã xử lý / lỗi, throughput (ảnh/giây) và thời gian còn lại ước tính.",
+    tags=["🔄 Reset Database"]
+)
+def rebuild_index_status():
+    return JSONResponse(content=rebuild_status_service())
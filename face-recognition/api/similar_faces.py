@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Query, Depends
+from fastapi.responses import JSONResponse
+
+from config import SIMILAR_FACES_MIN_SCORE
+from service.similar_faces_service import similar_faces_service
+# 🔐 Import MySQL Authentication
+from auth.mysql_auth import get_current_user_mysql
+
+similar_faces_router = APIRouter()
+
+@similar_faces_router.get(
+    '/similar_faces',
+    summary="Ai khác trông giống ảnh này (Cần MySQL Login)",
+    description="""
+    **🔒 API BẢO MẬT - Tìm những người khác có khuôn mặt giống một ảnh trong hệ thống**
+
+    API này:
+    - Lấy embedding đã lưu của image_id
+    - Range search trên FAISS: chỉ lấy các ảnh có score > min_score
+    - Trả về ảnh giống nhất của từng người khác (bỏ qua chính người sở hữu ảnh)
+
+    **Ứng dụng:**
+    - Phát hiện các cặp người dễ bị nhận nhầm
+    - Kiểm tra ảnh bị gán sai class_id
+    - Quyết định có cần thêm ảnh cho một người hay không
+    """,
+    response_description="Danh sách người khác giống ảnh, sắp theo score giảm dần",
+    tags=["📊 Tìm Kiếm & Thống Kê"]
+)
+def similar_faces(
+    image_id: int = Query(..., description="image_id của ảnh cần so sánh"),
+    min_score: float = Query(SIMILAR_FACES_MIN_SCORE, ge=-1.0, le=1.0, description="Chỉ lấy kết quả có score > min_score"),
+    max_results: int = Query(20, ge=1, le=200, description="Số người tối đa trả về"),
+    current_user: str = Depends(get_current_user_mysql)
+):
+    result = similar_faces_service(image_id, min_score=min_score, max_results=max_results)
+    status_code = result.get("status_code", 200)
+    if "status_code" in result:
+        result = {k: v for k, v in result.items() if k != "status_code"}
+    return JSONResponse(content=result, status_code=status_code)
@@ -7,6 +7,7 @@ from api.delete_class import delete_class_router
 from api.add_embedding import add_router
 from api.delete_image import delete_image_router
 from api.vector_info import vector_info_router
+from api.near_duplicates import near_duplicates_router
 from api.change_password import change_password_router
 from api.change_pin import change_pin_router
 from api.reset_password import reset_password_router
@@ -14,9 +15,11 @@ from api.get_image_ids_by_class import get_image_ids_by_class_router
 from api.pin_verify import pin_router
 from api.index_status import status_router
 from api.reset_index import reset_router
+from api.rebuild_index import rebuild_router
 from api.users import users_router
 from api.add_users import add_users_router
 from api.face_query_top5 import face_query_top5_router
+from api.face_query_batch import face_query_batch_router
 from api.edit_embedding import edit_embedding_router
 from api.checkout import router as checkout_router
 from api.edit_nguoi import edit_nguoi_router
@@ -25,6 +28,7 @@ from api.change_shift import change_shift_router
 from api.resign_user import resign_user_router
 from api.list_nguoi import list_nguoi_router
 from api.search_embeddings import embedding_search_router
+from api.similar_faces import similar_faces_router
 from api.update_avatar import update_avatar_router
 from api.faces import faces_router
 from api.add_emotion import add_emotion_router
@@ -50,6 +54,7 @@ except ImportError:
 from auth.mysql_auth_api import router as mysql_auth_router
 from api.taikhoan_api import taikhoan_router
 from api.add_user_and_account import add_user_and_account_router
+from service.model_loader import start_loading
 
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 
@@ -125,6 +130,7 @@ app.include_router(taikhoan_router, tags=["🔐 MySQL Accounts"])
 app.include_router(face_query_router, tags=["👤 Nhận Diện Khuôn Mặt"])
 app.include_router(anti_spoofing_router, tags=["🛡️ Chống Giả Mạo"])
 app.include_router(face_query_top5_router, tags=["👥 Top 5 Tương Tự"])
+app.include_router(face_query_batch_router, tags=["👤 Nhận Diện Khuôn Mặt"])
 app.include_router(simple_add_router, tags=["➕ Thêm Người Đơn Giản"])
 app.include_router(add_router, tags=["➕ Quản Lý Người"])
 app.include_router(edit_embedding_router, tags=["✏️ Chỉnh Sửa"])
@@ -135,6 +141,7 @@ app.include_router(resign_user_router, tags=["✏️ Chỉnh Sửa Thông Tin Ng
 app.include_router(delete_class_router, tags=["❌ Xóa Người"])
 app.include_router(delete_image_router, tags=["🗑️ Xóa Ảnh"])
 app.include_router(vector_info_router, tags=["📊 Thông Tin Database"])
+app.include_router(near_duplicates_router, tags=["📊 Thông Tin Database"])
 app.include_router(change_password_router, tags=["🔐 MySQL Authentication"])
 app.include_router(change_pin_router, tags=["🔐 MySQL Authentication"])
 app.include_router(reset_password_router, tags=["🔐 MySQL Authentication"])
@@ -146,11 +153,13 @@ app.include_router(add_emotion_router, tags=["📝 Emotion Logs"])
 app.include_router(pin_router, tags=["🔐 PIN"])
 app.include_router(emotion_router, tags=["📝 Emotion Logs"])
 app.include_router(embedding_search_router, tags=["🔍 Tìm Kiếm Nâng Cao"])
+app.include_router(similar_faces_router, tags=["🔍 Tìm Kiếm Nâng Cao"])
 app.include_router(delete_emotion_router, tags=["🗑️ Xóa Emotion"])
 app.include_router(status_router, tags=["💡 Trạng Thái"])
 app.include_router(checkin_router, tags=["🕒 Check-in"])
 app.include_router(kpi_router, tags=["📊 KPI"])
 app.include_router(reset_router, tags=["🔄 Reset Database"])
+app.include_router(rebuild_router, tags=["🔄 Reset Database"])
 app.include_router(users_router, tags=["📋 Danh Sách Người"])
 app.include_router(add_users_router, tags=["➕ Quản Lý Người"])
 app.include_router(checklog_router, tags=["🕒 Checklog"])
@@ -163,6 +172,11 @@ app.include_router(add_user_and_account_router, tags=["➕ Thêm Tài Khoản"])
 if PERFORMANCE_AVAILABLE:
     app.include_router(performance_router, prefix="/metrics", tags=["📈 Hiệu Suất"])
 
+# Load các model song song ở thread nền: server bind port ngay, /health/readiness báo trạng thái từng model
+@app.on_event("startup")
+def load_models():
+    start_loading()
+
 # Security Headers Middleware 
 @app.middleware("http")
 async def security_headers(request: Request, call_next):
@@ -256,6 +270,7 @@ def read_root():
             "public": [
                 "POST /query - Tìm kiếm khuôn mặt",
                 "POST /query_top5 - Top 5 kết quả tương tự",
+                "POST /query_batch - Nhận diện nhiều ảnh trong một request",
                 "GET /vector_info - Thông tin database",
                 "GET /health - Kiểm tra sức khỏe"
             ],
@@ -263,7 +278,8 @@ def read_root():
                 "POST /add_embedding - Thêm người mới (cần đăng nhập)",
                 "PUT /edit_embedding - Sửa thông tin (cần đăng nhập)",
                 "DELETE /delete_class - Xóa người (cần đăng nhập)",
-                "POST /reset_index - Reset database (cần đăng nhập)"
+                "POST /reset_index - Reset database (cần đăng nhập)",
+                "POST /rebuild_index - Embed lại gallery từ MySQL (cần đăng nhập)"
             ],
             "auth": [
                 "POST /auth/login - Đăng nhập MySQL",
@@ -277,5 +293,10 @@ if __name__ == "__main__":
     print("🚀 Starting Face Recognition API with MySQL Authentication...")
     print("📚 Swagger UI: http://localhost:8000/docs")
     print("📖 ReDoc: http://localhost:8000/redoc")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    from config import UVICORN_WORKERS
+    if UVICORN_WORKERS > 1:
+        # Nhiều worker cần import string; các worker dùng chung gallery FAISS (FAISS_MULTI_PROCESS)
+        uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=UVICORN_WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
 
@@ -7,10 +7,115 @@
 MODEL_PATH = 'model/glint360k_cosface_r18_fp16_0.1.pth'  # Primary ArcFace model
 AGE_MODEL=  'model/ModelAge.pth' # Age prediction model
 GENDER_MODEL = 'model/ModelGender.pth' # Gender prediction model
+# Các model (ArcFace, age/gender, EmoNet, DeepFace anti-spoofing) được load song song ở thread nền khi server
+# khởi động (service/model_loader.py), mỗi model chạy một forward mẫu (warm-up) sau khi load nếu MODEL_WARMUP.
+# Request cần model đang load chờ tối đa MODEL_LOAD_WAIT_SECONDS giây rồi trả 503
+MODEL_WARMUP = True
+MODEL_LOAD_WAIT_SECONDS = 60
+# Backend trích xuất embedding ArcFace: 'onnx' (onnxruntime, checkpoint được export sang ONNX một lần và cache
+# tại ONNX_MODEL_PATH, None = cạnh file .pth) hoặc 'torch'. Không có onnxruntime thì tự dùng PyTorch.
+# ONNX_INTRA_OP_THREADS: số thread onnxruntime cho mỗi model (0 = tự chọn theo số core vật lý)
+EXTRACTOR_BACKEND = 'onnx'
+ONNX_MODEL_PATH = None
+ONNX_INTRA_OP_THREADS = 0
+# Chế độ suy luận khi chạy bằng PyTorch: 'auto' (fp16 trên GPU, fp32 trên CPU), 'fp32' (channels_last),
+# 'bf16' (CPU có AVX512-BF16/AMX), 'int8' hoặc 'torchscript' (cache TorchScript cạnh file .pth).
+# Kiểm tra độ chính xác trước khi đổi: python scripts/inference_mode_report.py --bin lfw.bin
+TORCH_INFERENCE_MODE = 'auto'
+# Thư mục ảnh khuôn mặt đã crop để calibrate int8 static (None = chỉ quantize động lớp fc)
+INT8_CALIBRATION_DIR = None
+INT8_CALIBRATION_IMAGES = 256
+# Số ảnh tối đa mỗi lần forward khi trích xuất embedding theo batch (extract_batch)
+EXTRACT_MAX_BATCH_SIZE = 64
+# Micro-batching cho các request đồng thời (service/inference_scheduler.py): gom tối đa
+# INFERENCE_MAX_BATCH_SIZE ảnh hoặc các ảnh đến trong INFERENCE_MAX_WAIT_MS ms rồi chạy model một lần
+INFERENCE_BATCHING = True
+INFERENCE_MAX_BATCH_SIZE = 32
+INFERENCE_MAX_WAIT_MS = 5
+# Cache kết quả model (ArcFace, EmoNet, age/gender) theo hash nội dung ảnh upload (service/inference_cache.py):
+# kiosk gửi lại cùng frame hoặc admin upload lại cùng ảnh thì không chạy model lần nữa.
+# Tối đa INFERENCE_CACHE_MAX_ENTRIES phần tử mỗi model (LRU), hết hạn sau INFERENCE_CACHE_TTL_SECONDS giây;
+# INFERENCE_CACHE_HASH_PIXELS: hash ảnh đã decode thay vì bytes (khớp cả ảnh cùng pixel khác metadata)
+INFERENCE_CACHE = True
+INFERENCE_CACHE_MAX_ENTRIES = 10000
+INFERENCE_CACHE_TTL_SECONDS = 600
+INFERENCE_CACHE_HASH_PIXELS = False
 
 
 # FAISS Vector Database Configuration
 FAISS_INDEX_PATH = 'index/faiss_db_r18.index'
 FAISS_META_PATH = 'index/faiss_db_r18_meta.npz'
+# Thư mục gallery: các generation snapshot gen-XXXXXX (index.faiss + các cột .npy + manifest.json, load
+# bằng mmap) và mutation log wal-XXXXXX.log; nếu chưa có sẽ chuyển đổi từ 2 file .npz/.index ở trên
+FAISS_STORE_DIR = 'index/faiss_db_r18'
+# Mutation log: ghi snapshot mới (ở thread nền) khi log vượt kích thước hoặc sau khoảng thời gian này
+FAISS_WAL_COMPACT_BYTES = 64 * 1024 * 1024
+FAISS_WAL_COMPACT_SECONDS = 600
+# Số generation snapshot giữ lại; kiểm tra crc32 toàn bộ snapshot khi load (chậm hơn với gallery lớn)
+FAISS_SNAPSHOT_KEEP = 2
+FAISS_SNAPSHOT_VERIFY_CHECKSUMS = False
 
 
+
+# Loại FAISS index: 'flat' (exact, brute-force), 'ivf' (IVF-Flat), 'hnsw' (HNSW-Flat),
+# index nén cho máy ít RAM: 'sq8' (512 byte/vector), 'sq16' (1 KB/vector), 'pq' (FAISS_PQ_M byte/vector),
+# query re-rank top ứng viên bằng inner product chính xác nên ngưỡng score 0.42 giữ nguyên ý nghĩa.
+# Kết hợp FAISS_EMBEDDING_DTYPE = 'float16' để giảm tiếp bản embeddings dùng re-rank
+FAISS_INDEX_TYPE = 'flat'
+# IVF: số cluster, số cluster quét mỗi truy vấn và kích thước gallery tối thiểu để train
+# (trước khi đủ dữ liệu, index chạy ở chế độ flat)
+FAISS_IVF_NLIST = 256
+FAISS_IVF_NPROBE = 16
+FAISS_IVF_TRAIN_MIN = 39 * FAISS_IVF_NLIST
+# HNSW: số cạnh mỗi node, efConstruction khi build và efSearch mặc định khi truy vấn
+FAISS_HNSW_M = 32
+FAISS_HNSW_EF_CONSTRUCTION = 200
+FAISS_HNSW_EF_SEARCH = 64
+# PQ: số sub-quantizer (chia hết 512) và số bit mỗi code; sq8/pq chạy flat cho tới khi đủ
+# FAISS_QUANT_TRAIN_MIN vector để train (tối thiểu 2^FAISS_PQ_NBITS với pq, 256 với sq8).
+# Index nén lấy FAISS_RERANK_FACTOR * topk ứng viên để re-rank
+FAISS_PQ_M = 64
+FAISS_PQ_NBITS = 8
+FAISS_QUANT_TRAIN_MIN = 39 * 256
+FAISS_RERANK_FACTOR = 4
+# Kiểu lưu ma trận embeddings của gallery trong RAM/metadata: 'float32' hoặc 'float16' (giảm một nửa RAM)
+FAISS_EMBEDDING_DTYPE = 'float32'
+# Search hai tầng theo prototype class (embedding trung bình mỗi người): so query với prototype, giữ
+# FAISS_CENTROID_SHORTLIST người gần nhất rồi tính score chính xác trên ảnh của những người đó.
+# Nên bật khi mỗi người có nhiều ảnh; tắt thì /query dùng FAISS index như cũ
+FAISS_CENTROID_SEARCH = False
+FAISS_CENTROID_SHORTLIST = 32
+# Ngưỡng nhận diện: score (cosine) > 0.42 mới coi là cùng người (chọn qua validation của model)
+FACE_MATCH_THRESHOLD = 0.42
+# /similar_faces: ngưỡng score mặc định khi tìm người khác trông giống một ảnh
+SIMILAR_FACES_MIN_SCORE = 0.3
+# /query_batch: số ảnh tối đa mỗi request và số thread decode ảnh song song
+QUERY_BATCH_MAX_IMAGES = 32
+QUERY_BATCH_DECODE_WORKERS = 4
+# Rebuild gallery từ bảng khuonmat (/rebuild_index, scripts/rebuild_gallery.py): số dòng đọc từ MySQL mỗi khối
+# và số thread decode ảnh (model chạy theo batch EXTRACT_MAX_BATCH_SIZE)
+REBUILD_CHUNK_SIZE = 256
+REBUILD_DECODE_WORKERS = 4
+# /near_duplicates: ngưỡng score cho ảnh trùng cùng người / nghi gán nhầm người, số hàng xóm mỗi ảnh
+# và số dòng mỗi khối khi chạy self-kNN (bộ nhớ tạm ~ tile^2 * 4 byte)
+DUPLICATE_SCORE_THRESHOLD = 0.95
+CROSS_CLASS_SCORE_THRESHOLD = 0.8
+DUPLICATE_KNN_K = 10
+DUPLICATE_TILE_SIZE = 4096
+# Số worker process khi chạy `python app.py`. > 1: các worker dùng chung gallery trong FAISS_STORE_DIR
+# (snapshot mmap qua page cache + mutation log chung, xem index/shared_gallery.py); mỗi worker vẫn load model riêng.
+# Chạy `uvicorn app:app --workers N` thì cũng đặt UVICORN_WORKERS = N để bật FAISS_MULTI_PROCESS
+UVICORN_WORKERS = 1
+# True khi nhiều replica (container/máy) cùng ghi vào FAISS_STORE_DIR trên volume dùng chung: mọi thao tác ghi
+# đi qua lock ghi + bộ đếm phiên bản trong FAISS_STORE_DIR như các worker (volume phải hỗ trợ flock và mmap
+# nhất quán giữa các process, vd. volume local của host). Replica chỉ đọc không cần bật (dùng watcher bên dưới)
+FAISS_SHARED_STORE = False
+FAISS_MULTI_PROCESS = UVICORN_WORKERS > 1 or FAISS_SHARED_STORE
+# Chu kỳ (giây) mỗi worker kiểm tra thay đổi gallery do worker khác ghi
+FAISS_SYNC_POLL_SECONDS = 0.5
+# Chu kỳ (giây) kiểm tra generation snapshot mới do replica khác ghi vào FAISS_STORE_DIR (volume dùng chung)
+# để load lại ở thread nền; 0 = tắt. Dành cho replica chỉ đọc: process có thay đổi chưa vào snapshot không load
+# đè generation của process khác (nhiều replica cùng ghi thì bật FAISS_SHARED_STORE)
+FAISS_WATCH_INTERVAL_SECONDS = 2
+# POST /faces/batch: số ảnh tối đa mỗi request khi thêm nhiều khuôn mặt cho một người
+FACES_BATCH_MAX_IMAGES = 32
@@ -237,6 +237,43 @@ class NguoiRepository(ConnectionHelper):
             from db.models import KhuonMat
             return [KhuonMat.from_row(r) for r in rows]
 
+    def count_khuonmat(self):
+        with self as cursor:
+            cursor.execute('SELECT COUNT(*) AS total FROM khuonmat')
+            return int(cursor.fetchone()['total'])
+
+    def iter_khuonmat_chunks(self, chunk_size: int = 256, after_id: int = 0):
+        """Duyệt bảng khuonmat theo từng khối (keyset theo id), mỗi khối là list dict id/user_id/image_url.
+
+        Mỗi khối dùng một kết nối riêng nên không giữ toàn bộ blob ảnh trong bộ nhớ.
+        """
+        last_id = after_id
+        while True:
+            with self as cursor:
+                cursor.execute('SELECT id, user_id, image_url FROM khuonmat WHERE id > %s ORDER BY id LIMIT %s',
+                               (last_id, chunk_size))
+                rows = cursor.fetchall()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1]['id']
+
+    def get_khuonmat_ids(self):
+        """Tất cả (id, user_id) trong bảng khuonmat, không đọc blob ảnh."""
+        with self as cursor:
+            cursor.execute('SELECT id, user_id FROM khuonmat')
+            return {int(r['id']): int(r['user_id']) for r in cursor.fetchall()}
+
+    def get_khuonmats_by_ids(self, ids):
+        """Các dòng khuonmat (id, user_id, image_url) theo danh sách id."""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return []
+        placeholders = ', '.join(['%s'] * len(ids))
+        with self as cursor:
+            cursor.execute(f'SELECT id, user_id, image_url FROM khuonmat WHERE id IN ({placeholders})', ids)
+            return cursor.fetchall()
+
     def delete_khuonmat_by_id(self, khuonmat_id: int):
         """Delete a khuonmat row by id. Returns number of affected rows."""
         try:
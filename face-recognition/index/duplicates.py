@@ -0,0 +1,107 @@
+"""
+Phát hiện ảnh gần trùng trong gallery bằng self-kNN chính xác (inner product) theo từng khối.
+
+Gallery được chia thành các khối tile_size dòng; mỗi khối query được search lần lượt trên từng khối
+database bằng faiss.knn và gộp top-k qua faiss.ResultHeap, nên bộ nhớ tạm chỉ O(tile_size^2)
+dù gallery lớn tới đâu.
+"""
+import numpy as np
+import faiss
+
+
+def self_knn(embeddings, k, tile_size=4096):
+    """
+    k hàng xóm gần nhất (không tính chính nó) của mọi dòng trong ma trận embeddings (N, d) đã L2-normalize.
+    Trả về (D, I) dạng (N, k); I là vị trí dòng, -1 nếu gallery có ít hơn k + 1 vector.
+    """
+    n = len(embeddings)
+    k = min(k, max(0, n - 1))
+    if k == 0:
+        return np.empty((n, 0), dtype=np.float32), np.empty((n, 0), dtype=np.int64)
+    D = np.empty((n, k), dtype=np.float32)
+    I = np.empty((n, k), dtype=np.int64)
+    for q0 in range(0, n, tile_size):
+        queries = np.ascontiguousarray(embeddings[q0:q0 + tile_size], dtype=np.float32)
+        # lấy thêm 1 để bỏ chính nó
+        heap = faiss.ResultHeap(len(queries), k + 1, keep_max=True)
+        for b0 in range(0, n, tile_size):
+            base = np.ascontiguousarray(embeddings[b0:b0 + tile_size], dtype=np.float32)
+            Dt, It = faiss.knn(queries, base, min(k + 1, len(base)), metric=faiss.METRIC_INNER_PRODUCT)
+            heap.add_result(Dt, np.where(It >= 0, It + b0, -1))
+        heap.finalize()
+        self_rows = np.arange(q0, q0 + len(queries))[:, None]
+        not_self = heap.I != self_rows
+        # mỗi dòng bỏ đúng một phần tử: chính nó, hoặc phần tử cuối nếu chính nó không nằm trong top
+        not_self[not_self.all(axis=1), -1] = False
+        D[q0:q0 + len(queries)] = heap.D[not_self].reshape(len(queries), k)
+        I[q0:q0 + len(queries)] = heap.I[not_self].reshape(len(queries), k)
+    return D, I
+
+
+def _pairs(D, I, threshold):
+    """Các cặp dòng (i < j) có score >= threshold, mỗi cặp một lần, sắp theo score giảm dần."""
+    rows = np.repeat(np.arange(len(I)), I.shape[1])
+    cols = I.ravel()
+    scores = D.ravel()
+    mask = (cols >= 0) & (scores >= threshold)
+    a, b, scores = rows[mask], cols[mask], scores[mask]
+    lo, hi = np.minimum(a, b), np.maximum(a, b)
+    _, first = np.unique(lo * (len(I) + 1) + hi, return_index=True)
+    order = first[np.argsort(-scores[first], kind='stable')]
+    return lo[order], hi[order], scores[order]
+
+
+def _prune_rows(lo, hi, image_ids):
+    """
+    Gom các cặp trùng thành cụm (union-find), giữ lại ảnh có image_id nhỏ nhất mỗi cụm
+    (ảnh được thêm sớm nhất), trả về các dòng còn lại để xóa.
+    """
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in zip(lo.tolist(), hi.tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            # gốc của cụm là dòng có image_id nhỏ nhất
+            if image_ids[rb] < image_ids[ra]:
+                ra, rb = rb, ra
+            parent[rb] = ra
+    return sorted(r for r in parent if find(r) != r)
+
+
+def find_near_duplicates(store, duplicate_threshold=0.95, cross_class_threshold=0.8, k=10, tile_size=4096,
+                         max_pairs=1000):
+    """
+    Báo cáo ảnh gần trùng của GalleryStore:
+    - duplicate_pairs: cặp ảnh cùng class_id có score >= duplicate_threshold (chụp lại / upload trùng)
+    - cross_class_pairs: cặp ảnh khác class_id có score >= cross_class_threshold (có thể gán nhầm người)
+    - prune_rows: các dòng có thể xóa (mỗi cụm ảnh trùng trong cùng class giữ lại một ảnh)
+    Danh sách cặp trả về tối đa max_pairs phần tử (các số đếm vẫn tính đủ).
+    """
+    D, I = self_knn(store.embeddings, k, tile_size)
+    lo, hi, scores = _pairs(D, I, min(duplicate_threshold, cross_class_threshold))
+    class_ids, image_ids = store.class_ids, store.image_ids
+    same = class_ids[lo] == class_ids[hi]
+    dup = same & (scores >= duplicate_threshold)
+    cross = ~same & (scores >= cross_class_threshold)
+
+    def _describe(mask):
+        return [{
+            'image_id_a': int(image_ids[a]), 'class_id_a': int(class_ids[a]),
+            'image_id_b': int(image_ids[b]), 'class_id_b': int(class_ids[b]),
+            'score': float(s),
+        } for a, b, s in zip(lo[mask][:max_pairs], hi[mask][:max_pairs], scores[mask][:max_pairs])]
+
+    return {
+        'num_duplicate_pairs': int(dup.sum()),
+        'num_cross_class_pairs': int(cross.sum()),
+        'duplicate_pairs': _describe(dup),
+        'cross_class_pairs': _describe(cross),
+        'prune_rows': _prune_rows(lo[dup], hi[dup], image_ids),
+    }
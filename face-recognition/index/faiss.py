@@ -1,8 +1,236 @@
 import numpy as np
 import faiss
 import os
+import time
+import threading
+import functools
+import contextlib
 import pandas as pd
 
+from index import snapshot
+from index.gallery_store import GalleryStore
+from index.mutation_log import MutationLog
+from index.prototypes import ClassPrototypes
+from index import duplicates
+from index.shared_gallery import GalleryCoordinator
+
+
+# Các loại index hỗ trợ: flat (exact), ivf (IVF-Flat), hnsw (HNSW-Flat) và các index nén:
+# sq8 (scalar quantizer 8 bit, 1 byte/chiều), sq16 (float16, 2 byte/chiều), pq (product quantizer, pq_m byte/vector)
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'sq8', 'sq16', 'pq')
+# Index nén: score từ FAISS là xấp xỉ, query() lấy rerank_factor * topk ứng viên rồi tính lại
+# inner product chính xác từ embeddings trong store
+QUANTIZED_INDEX_TYPES = ('sq8', 'sq16', 'pq')
+
+# Đọc index bằng mmap: IVF mmap inverted list (IO_FLAG_MMAP); IO_FLAG_MMAP_IFC (FAISS >= 1.9) cho
+# IndexFlat/IndexIDMap trỏ thẳng vào file nhưng read_index với IVF thì báo lỗi
+# "mmap only supported for File objects", xem _read_index_mmap
+MMAP_IO_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+MMAP_IFC_IO_FLAGS = MMAP_IO_FLAGS | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+
+
+def _read_index_mmap(path):
+    """Đọc index bằng mmap: thử IO_FLAG_MMAP_IFC trước, loại index không hỗ trợ (IVF) đọc lại bằng IO_FLAG_MMAP."""
+    if MMAP_IFC_IO_FLAGS == MMAP_IO_FLAGS:
+        return faiss.read_index(path, MMAP_IO_FLAGS)
+    try:
+        return faiss.read_index(path, MMAP_IFC_IO_FLAGS)
+    except RuntimeError:
+        return faiss.read_index(path, MMAP_IO_FLAGS)
+
+
+def _mutation(method):
+    """
+    Các hàm thay đổi gallery chạy tuần tự với nhau (giữ _write_lock, cho phép gọi lồng nhau);
+    kết quả được publish cho reader khi lời gọi ngoài cùng kết thúc.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._writing(exclusive=True):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _to_id(value):
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode()
+    return int(value)
+
+
+class _GalleryLookup:
+    """
+    Map tra cứu của một store, dùng chung giữa writer và mọi phiên bản publish trên store đó (store chỉ append,
+    dòng bị xóa chỉ được đánh dấu nên vị trí dòng không đổi):
+    - row_by_image_id: image_id -> dòng mới nhất (kể cả dòng đã xóa)
+    - rows_by_class_id: class_id -> frozenset các dòng (kể cả dòng đã xóa)
+    - previous_row: dòng -> dòng cũ hơn cùng image_id (ảnh được đổi embedding/đường dẫn hoặc thêm lại)
+    Writer chỉ thêm vào map (O(số dòng thêm)); mỗi phiên bản tự lọc các dòng nó nhìn thấy. Map được dựng lười
+    từ store lúc tạo (load mmap không trả chi phí O(N) lúc khởi động), writer dựng trước khi sửa store.
+    """
+
+    def __init__(self, store):
+        self._source = store.view()
+        self._lock = threading.Lock()
+        self.row_by_image_id = None
+        self.rows_by_class_id = None
+        self.previous_row = {}
+
+    def ensure(self):
+        if self.row_by_image_id is None:
+            with self._lock:
+                if self.row_by_image_id is None:
+                    row_by_image_id = {}
+                    rows_by_class_id = {}
+                    store = self._source
+                    for row, (image_id, class_id) in enumerate(zip(store.image_ids.tolist(),
+                                                                   store.class_ids.tolist())):
+                        if image_id in row_by_image_id:
+                            self.previous_row[row] = row_by_image_id[image_id]
+                        row_by_image_id[image_id] = row
+                        rows_by_class_id.setdefault(class_id, []).append(row)
+                    # gán map class trước: điều kiện kiểm tra chỉ dựa vào row_by_image_id
+                    self.rows_by_class_id = {c: frozenset(rows) for c, rows in rows_by_class_id.items()}
+                    self.row_by_image_id = row_by_image_id
+        return self
+
+    def add(self, start, image_ids, class_ids):
+        """Ghi nhận các dòng start, start + 1, ... vừa append (caller là writer, đã gọi ensure)."""
+        row_by_image_id = self.row_by_image_id
+        rows_by_class_id = self.rows_by_class_id
+        for row, (image_id, class_id) in enumerate(zip(image_ids, class_ids), start):
+            old = row_by_image_id.get(image_id)
+            if old is not None:
+                self.previous_row[row] = old
+            row_by_image_id[image_id] = row
+            rows_by_class_id[class_id] = rows_by_class_id.get(class_id, frozenset()) | {row}
+
+
+class _GalleryState:
+    """
+    Một phiên bản gallery đã publish cho reader. Không bao giờ bị sửa sau khi publish nên reader chỉ cần
+    đọc self._state một lần và dùng không cần lock:
+    - index: index FAISS (key theo image_id) chứa các dòng [0, base_rows) của store, có thể còn vector của
+      dòng đã xóa (image_id trong base_dead[:base_dead_count], bị loại khi search); writer không sửa index đã publish
+    - store: view O(1) của store tại thời điểm publish; dòng [base_rows, N) (delta) chưa vào index, được
+      tính score trực tiếp từ embeddings
+    - version: dòng bị xóa ở phiên bản lớn hơn version vẫn còn với phiên bản này
+    Map tra cứu (dùng chung, xem _GalleryLookup) và prototype class được dựng lười ở lần truy cập đầu.
+    """
+
+    def __init__(self, index, store, active_index_type, version, base_rows, base_dead, num_dead, lookup,
+                 prototypes=None):
+        self.index = index
+        self.store = store
+        self.active_index_type = active_index_type
+        self.version = version
+        self.n = len(store)
+        self.base_rows = base_rows
+        self.base_dead = base_dead
+        self.base_dead_count = len(base_dead)
+        self.num_dead = num_dead
+        self.lookup = lookup
+        self._prototypes = prototypes
+        self._live_rows = None
+        self._live_store = None
+        self._delta_rows = None
+        self._selector = None
+        # Cache của check_index_data cho phiên bản này
+        self._health = None
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self.n - self.num_dead
+
+    def visible(self, rows):
+        """Mask các dòng tồn tại ở phiên bản này (-1, dòng thêm sau hoặc đã xóa -> False)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        ok = (rows >= 0) & (rows < self.n)
+        if self.num_dead and ok.any():
+            ok[ok] = self.store.alive(rows[ok], self.version)
+        return ok
+
+    def row_of(self, image_id, limit=None):
+        """Dòng của image_id ở phiên bản này (chỉ xét dòng < limit, mặc định N), None nếu không tồn tại."""
+        try:
+            image_id = _to_id(image_id)
+        except (TypeError, ValueError):
+            return None
+        lookup = self.lookup.ensure()
+        limit = self.n if limit is None else limit
+        row = lookup.row_by_image_id.get(image_id)
+        while row is not None and row >= limit:
+            row = lookup.previous_row.get(row)
+        if row is None or (self.num_dead and not self.store.alive(row, self.version)):
+            return None
+        return row
+
+    def index_rows(self, labels):
+        """Map nhãn FAISS (image_id) của index sang dòng của store (-1: không có kết quả hoặc đã xóa)."""
+        lookup = self.lookup.ensure()
+        get_row, get_previous = lookup.row_by_image_id.get, lookup.previous_row.get
+        base_rows = self.base_rows
+        rows = []
+        for label in np.asarray(labels).ravel().tolist():
+            row = get_row(label, -1) if label != -1 else -1
+            while row >= base_rows:
+                row = get_previous(row, -1)
+            rows.append(row)
+        rows = np.array(rows, dtype=np.int64).reshape(np.shape(labels))
+        return np.where(self.visible(rows), rows, -1)
+
+    def class_rows(self, class_id):
+        """Các dòng thuộc class_id ở phiên bản này, sắp xếp tăng dần (O(k) với k là số dòng của class)."""
+        try:
+            rows = self.lookup.ensure().rows_by_class_id.get(_to_id(class_id), ())
+        except (TypeError, ValueError):
+            rows = ()
+        rows = np.array(sorted(rows), dtype=np.int64)
+        return rows[self.visible(rows)]
+
+    def live_rows(self):
+        """Vị trí các dòng còn tồn tại (tăng dần); O(N) ở lần gọi đầu nếu có dòng đã xóa."""
+        if self._live_rows is None:
+            self._live_rows = self.store.live_rows(self.version) if self.num_dead else np.arange(self.n)
+        return self._live_rows
+
+    def live_store(self):
+        """Store chỉ gồm các dòng còn tồn tại (chính store nếu không có dòng nào bị xóa)."""
+        if self._live_store is None:
+            with self._lock:
+                if self._live_store is None:
+                    self._live_store = self.store.take(self.live_rows()) if self.num_dead else self.store
+        return self._live_store
+
+    def delta_rows(self):
+        """Các dòng còn tồn tại chưa được đưa vào index."""
+        if self._delta_rows is None:
+            rows = self.store.live_rows(self.version, self.base_rows) if self.num_dead else \
+                np.arange(self.base_rows, self.n)
+            self._delta_rows = rows
+        return self._delta_rows
+
+    def selector(self):
+        """IDSelector loại các image_id đã xóa nhưng vẫn còn trong index (None nếu không có)."""
+        if not self.base_dead_count:
+            return None
+        if self._selector is None:
+            with self._lock:
+                if self._selector is None:
+                    ids = np.array(self.base_dead[:self.base_dead_count], dtype=np.int64)
+                    batch = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+                    # giữ tham chiếu tới batch: IDSelectorNot chỉ giữ con trỏ
+                    self._selector = (faiss.IDSelectorNot(batch), batch)
+        return self._selector[0]
+
+    @property
+    def prototypes(self):
+        if self._prototypes is None:
+            with self._lock:
+                if self._prototypes is None:
+                    self._prototypes = ClassPrototypes.from_store(self.live_store())
+        return self._prototypes
+
 
 class FaissIndexManager:
     def query_embeddings_by_string(self, query, page=1, page_size=15, sort_by="image_id_asc"):
@@ -14,47 +242,31 @@ class FaissIndexManager:
         - sort_by: sắp xếp theo (image_id_asc, image_id_desc, class_id_asc, class_id_desc, image_path_asc, image_path_desc)
         Trả về dict: { 'total': ..., 'total_pages': ..., 'page': ..., 'results': [...] }
         """
+        state = self._state
         query = str(query).strip().lower()
-        results = []
         if not query:
             # Trả về tất cả embedding nếu query rỗng
-            for idx, (img_id, img_path, cls_id) in enumerate(zip(self.image_ids, self.image_paths, self.class_ids)):
-                results.append({
-                    'image_id': img_id,
-                    'image_path': img_path,
-                    'class_id': cls_id,
-                    'faiss_index': idx
-                })
+            rows = state.live_rows()
         else:
-            for idx, (img_id, img_path, cls_id) in enumerate(zip(self.image_ids, self.image_paths, self.class_ids)):
-                if query == str(cls_id).strip().lower():
-                    results.append({
-                        'image_id': img_id,
-                        'image_path': img_path,
-                        'class_id': cls_id,
-                        'faiss_index': idx
-                    })
+            rows = state.class_rows(query)
         
-        # Sorting
-        if sort_by == "image_id_desc":
-            results.sort(key=lambda x: int(str(x['image_id']).split('_')[0]) if '_' in str(x['image_id']) else int(x['image_id']), reverse=True)
-        elif sort_by == "class_id_asc":
-            results.sort(key=lambda x: int(x['class_id']) if str(x['class_id']).isdigit() else 0)
-        elif sort_by == "class_id_desc":
-            results.sort(key=lambda x: int(x['class_id']) if str(x['class_id']).isdigit() else 0, reverse=True)
-        elif sort_by == "image_path_asc":
-            results.sort(key=lambda x: str(x['image_path']))
-        elif sort_by == "image_path_desc":
-            results.sort(key=lambda x: str(x['image_path']), reverse=True)
+        # Sorting (vector hóa trên các cột của store)
+        if sort_by in ("class_id_asc", "class_id_desc"):
+            keys = state.store.class_ids[rows]
+        elif sort_by in ("image_path_asc", "image_path_desc"):
+            keys = np.array([str(p) for p in state.store.image_paths[rows]], dtype=str)
         else:  # default image_id_asc
-            results.sort(key=lambda x: int(str(x['image_id']).split('_')[0]) if '_' in str(x['image_id']) else int(x['image_id']))
+            keys = state.store.image_ids[rows]
+        rows = rows[np.argsort(keys, kind='stable')]
+        if sort_by.endswith('_desc'):
+            rows = rows[::-1]
         
-        total = len(results)
+        total = len(rows)
         total_pages = (total + page_size - 1) // page_size if page_size > 0 else 1
         page = max(1, min(page, total_pages))
         start = (page - 1) * page_size
         end = start + page_size
-        paged_results = results[start:end]
+        paged_results = [state.store.row(r) for r in rows[start:end]]
         return {
             'total': total,
             'total_pages': total_pages,
@@ -62,158 +274,1355 @@ class FaissIndexManager:
             'page_size': page_size,
             'results': paged_results
         }
+
+    def replace_gallery(self, embeddings, image_ids, image_paths, class_ids):
+        """
+        Thay toàn bộ gallery bằng dữ liệu mới (vd. embed lại từ bảng khuonmat sau khi đổi model).
+        Store và index mới được build ngoài _write_lock (reader và writer khác không bị chặn),
+        sau đó thay vào bằng một lần publish; với store_dir, generation snapshot mới được ghi ngay
+        (mutation log chuyển sang generation đó) nên gallery mới bền vững khi hàm trả về.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.embedding_size)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        embeddings = embeddings / norms
+        ids = [self._to_id(i) for i in image_ids]
+        if len(set(ids)) != len(ids):
+            raise ValueError('image_id bị trùng trong gallery mới')
+        store = GalleryStore.from_arrays(embeddings, ids, list(image_paths),
+                                         [self._to_class_id(c) for c in class_ids], dtype=self.embedding_dtype)
+        index, index_type = self._make_index(embeddings, ids)
+        with self._snapshot_write_lock:
+            with self._writing(exclusive=True):
+                self._set_gallery(store, index, index_type)
+                self._next_synthetic_id = None
+            if self.store_dir:
+                self._write_generation()
+            elif self.index_path and self.meta_path:
+                self.save()
+
+    @_mutation
     def reset_index(self):
         """
         Xóa toàn bộ dữ liệu FAISS index và metadata
         """
-        self.index = faiss.IndexFlatIP(self.embedding_size)
-        self.image_ids = []
-        self.image_paths = []
-        self.class_ids = []
-        self.embeddings = []
+        # Thay bằng store/index mới (không sửa bản reader đang dùng)
+        self._set_gallery(GalleryStore(self.embedding_size, dtype=self.embedding_dtype))
+        self._next_synthetic_id = -2
         # Làm trống file index và metadata, giữ cấu trúc file
-        if self.index_path:
+        if self.store_dir:
+            # reset cũng là một record trong mutation log; snapshot rỗng được ghi ở thread nền
+            self._log([('reset',)])
+            if not self._replaying:
+                self.save()
+        elif self.index_path:
             faiss.write_index(self.index, self.index_path)
-        if self.meta_path:
+        if not self.store_dir and self.meta_path:
             np.savez(self.meta_path,
                      image_ids=np.array([]),
                      image_paths=np.array([]),
                      class_ids=np.array([]),
-                     embeddings=np.array([], dtype=np.float32))
+                     embeddings=np.array([], dtype=np.float32),
+                     index_type=np.array(self.active_index_type))
         # Index and metadata cleared, structure preserved
         
-    def __init__(self, embedding_size, index_path=None, meta_path=None):
+    def __init__(self, embedding_size, index_path=None, meta_path=None, index_type='flat',
+                 nlist=256, nprobe=16, train_min=None, hnsw_m=32, ef_construction=200, ef_search=64,
+                 embedding_dtype='float32', store_dir=None, wal_compact_bytes=64 * 1024 * 1024,
+                 wal_compact_seconds=600, snapshot_keep=2, verify_checksums=False,
+                 centroid_search=False, centroid_shortlist=32, pq_m=64, pq_nbits=8, quant_train_min=None,
+                 rerank_factor=4, multi_process=False, poll_interval=0.5):
+        """
+        - store_dir: thư mục gallery gồm các generation snapshot (xem index/snapshot.py), được load
+          bằng mmap nên thời gian khởi động không phụ thuộc kích thước gallery. Khi có store_dir,
+          index_path/meta_path (định dạng .npz cũ) chỉ dùng để chuyển đổi một lần.
+          Mỗi thay đổi được ghi vào mutation log (fsync) thay vì ghi lại toàn bộ gallery; snapshot mới
+          được ghi ở thread nền khi log vượt wal_compact_bytes hoặc sau wal_compact_seconds.
+        - snapshot_keep: số generation giữ lại trên đĩa; verify_checksums: kiểm tra crc32 khi load
+          (đọc toàn bộ snapshot, mặc định chỉ kiểm tra manifest và kích thước file)
+        - index_type: 'flat' | 'ivf' | 'hnsw' | 'sq8' | 'sq16' | 'pq'
+        - nlist, nprobe, train_min: tham số IVF. IVF chỉ được train khi gallery có ít nhất
+          train_min vector (mặc định 39 * nlist); trước đó index chạy ở chế độ flat.
+        - hnsw_m, ef_construction, ef_search: tham số HNSW
+        - pq_m, pq_nbits: số sub-quantizer và số bit mỗi code của PQ (pq_m phải chia hết embedding_size)
+        - quant_train_min: số vector tối thiểu để train sq8/pq (mặc định 39 * 2^pq_nbits); trước đó chạy flat.
+          Giá trị nhỏ hơn mức FAISS cần (2^pq_nbits với pq, 256 với sq8) được nâng lên mức đó
+        - rerank_factor: index nén lấy rerank_factor * topk ứng viên rồi re-rank bằng inner product chính xác
+        - embedding_dtype: kiểu lưu ma trận embeddings trong metadata ('float32' hoặc 'float16')
+        - centroid_search: query/query_batch search hai tầng: so với prototype (embedding trung bình) của
+          từng class, giữ centroid_shortlist class gần nhất rồi tính score chính xác trên ảnh của các class đó
+        - multi_process: nhiều process (uvicorn --workers, hoặc replica dùng chung volume) cùng ghi vào store_dir,
+          mọi thao tác ghi đi qua GalleryCoordinator (xem index/shared_gallery.py); mỗi process kiểm tra thay đổi
+          của process khác sau mỗi poll_interval giây. Không bật thì store_dir chỉ được có một process ghi
+        """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"index_type phải là một trong {INDEX_TYPES}, nhận được {index_type!r}")
+        if index_type == 'pq' and embedding_size % pq_m:
+            raise ValueError(f"pq_m ({pq_m}) phải chia hết embedding_size ({embedding_size})")
         self.embedding_size = embedding_size
-        self.index = faiss.IndexFlatIP(embedding_size)
-        self.image_ids = []
-        self.image_paths = []
-        self.class_ids = []
-        self.embeddings = []
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_min = train_min if train_min is not None else 39 * nlist
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.quant_train_min = quant_train_min if quant_train_min is not None else 39 * (1 << pq_nbits)
+        self.rerank_factor = max(1, int(rerank_factor))
+        self.embedding_dtype = np.dtype(embedding_dtype)
+        self.centroid_search = centroid_search
+        self.centroid_shortlist = centroid_shortlist
+        # Phiên bản đang ghi: dòng bị xóa trong lần ghi này mang số phiên bản này (tombstone trong store),
+        # tăng mỗi lần publish
+        self._version = 0
+        # Metadata dạng cột (embeddings, image_ids, image_paths, class_ids), chỉ append + tombstone; map tra cứu
+        # image_id/class_id -> dòng (xem _GalleryLookup). Index FAISS (key theo image_id) chứa các dòng
+        # [0, _base_rows) của store; _base_dead là image_id của các dòng đã xóa còn vector trong index.
+        # Prototype class (chỉ khi centroid_search) cập nhật tăng dần; None = dựng lười.
+        # self._index_mmapped: index đang trỏ vào file qua mmap (chỉ-đọc).
+        self._set_gallery(GalleryStore(embedding_size, dtype=self.embedding_dtype))
+        # image_id âm (-1 dành cho FAISS "không có kết quả") cấp cho ảnh không có khuonmat id;
+        # None = chưa tính (store vừa load mmap)
+        self._next_synthetic_id = -2
         self.index_path = index_path
         self.meta_path = meta_path
+        self.store_dir = store_dir
+        self.wal_compact_bytes = wal_compact_bytes
+        self.wal_compact_seconds = wal_compact_seconds
+        self.snapshot_keep = snapshot_keep
+        self.verify_checksums = verify_checksums
+        # Reader/writer: self.index, self.store và các map ở trên là trạng thái của writer (chỉ sửa khi
+        # giữ _write_lock); reader chỉ đọc self._state, phiên bản bất biến được thay nguyên object khi writer
+        # publish. Publish O(1): store/map dùng chung (chỉ append), index đã publish không bị sửa.
+        # Thứ tự lock: _snapshot_write_lock (một snapshot được ghi tại một thời điểm) rồi _write_lock
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._state = None
+        self._publish()
+        self._snapshot_write_lock = threading.Lock()
+        # generation: snapshot mới nhất đã load/ghi; _wal_generation: wal-K đang được ghi
+        self.generation = 0
+        self._wal_generation = 0
+        self._loaded = False
+        self._checked_generation = 0
+        self._wal = MutationLog(snapshot.wal_path(store_dir, 0), embedding_size) if store_dir else None
+        # True khi đang phát lại log lúc load (không ghi lại vào log)
+        self._replaying = False
+        # Số record process này đã ghi vào mutation log mà chưa nằm trong snapshot do chính nó ghi
+        # (một process ghi): không load generation khác đè lên các record này
+        self._unsnapshotted_records = 0
+        self._snapshot_requested = threading.Event()
+        # Chế độ nhiều process: bộ đếm phiên bản + lock ghi liên process; _seen_seq/_wal_offset là
+        # phiên bản và số byte của wal hiện tại mà process này đã áp dụng
+        self._coordinator = None
+        self._seen_seq = 0
+        self._wal_offset = 0
+        self.poll_interval = poll_interval
+        if store_dir and multi_process:
+            self._coordinator = GalleryCoordinator(store_dir)
+            threading.Thread(target=self._follow_loop, name='faiss-gallery-follower', daemon=True).start()
+        if store_dir:
+            threading.Thread(target=self._snapshot_loop, name='faiss-snapshot-writer', daemon=True).start()
+
+    def _target_index_type(self, n):
+        """Loại index thực sự dùng cho gallery n vector (IVF, sq8, pq cần đủ dữ liệu để train)."""
+        if self.index_type == 'ivf' and n < max(self.train_min, self.nlist):
+            return 'flat'
+        if self.index_type in ('sq8', 'pq') and n < max(self.quant_train_min, self._quant_train_floor()):
+            return 'flat'
+        return self.index_type
+
+    def _quant_train_floor(self):
+        """Số vector ít nhất FAISS cần để train: 2^pq_nbits centroid mỗi sub-quantizer (pq), 256 (sq8)."""
+        return 1 << self.pq_nbits if self.index_type == 'pq' else 256
+
+    def _new_index(self, index_type):
+        """
+        Tạo index rỗng được key theo image_id:
+        - ivf: IVF hỗ trợ id gốc, direct map dạng hashtable để remove/reconstruct theo id
+        - flat/hnsw/sq8/sq16/pq: bọc trong IndexIDMap2
+        """
+        if index_type == 'ivf':
+            quantizer = faiss.IndexFlatIP(self.embedding_size)
+            index = faiss.IndexIVFFlat(quantizer, self.embedding_size, self.nlist, faiss.METRIC_INNER_PRODUCT)
+            index.nprobe = self.nprobe
+            return index
+        if index_type == 'hnsw':
+            inner = faiss.IndexHNSWFlat(self.embedding_size, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            inner.hnsw.efConstruction = self.ef_construction
+            inner.hnsw.efSearch = self.ef_search
+        elif index_type == 'sq8':
+            inner = faiss.IndexScalarQuantizer(self.embedding_size, faiss.ScalarQuantizer.QT_8bit,
+                                               faiss.METRIC_INNER_PRODUCT)
+        elif index_type == 'sq16':
+            inner = faiss.IndexScalarQuantizer(self.embedding_size, faiss.ScalarQuantizer.QT_fp16,
+                                               faiss.METRIC_INNER_PRODUCT)
+        elif index_type == 'pq':
+            inner = faiss.IndexPQ(self.embedding_size, self.pq_m, self.pq_nbits, faiss.METRIC_INNER_PRODUCT)
+        else:
+            inner = faiss.IndexFlatIP(self.embedding_size)
+        return faiss.IndexIDMap2(inner)
+
+    @staticmethod
+    def _unwrap(index):
+        if isinstance(index, faiss.IndexIDMap2):
+            return faiss.downcast_index(index.index)
+        return index
+
+    @classmethod
+    def _detect_index_type(cls, index):
+        inner = cls._unwrap(index)
+        if isinstance(inner, faiss.IndexHNSW):
+            return 'hnsw'
+        if isinstance(inner, faiss.IndexIVF):
+            return 'ivf'
+        if isinstance(inner, faiss.IndexScalarQuantizer):
+            return 'sq16' if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else 'sq8'
+        if isinstance(inner, faiss.IndexPQ):
+            return 'pq'
+        return 'flat'
+
+    @staticmethod
+    def _is_id_mapped(index):
+        """Index cũ (trước khi chuyển sang id) dùng vị trí dòng làm id, cần build lại."""
+        if isinstance(index, faiss.IndexIDMap2):
+            return True
+        return isinstance(index, faiss.IndexIVF) and index.direct_map.type == faiss.DirectMap.Hashtable
+
+    _to_id = staticmethod(_to_id)
+
+    @classmethod
+    def _to_class_id(cls, value):
+        """class_id trong metadata cũ có thể là chuỗi; giá trị không hợp lệ được lưu là -1."""
+        try:
+            return cls._to_id(value)
+        except (TypeError, ValueError):
+            return -1
+
+    def _allocate_synthetic_id(self):
+        if self._next_synthetic_id is None:
+            ids = self.store.image_ids
+            self._next_synthetic_id = min(-2, int(ids.min()) - 1) if len(ids) else -2
+        image_id = self._next_synthetic_id
+        self._next_synthetic_id -= 1
+        return image_id
+
+    # Thay đổi (dòng mới chưa vào index + vector đã xóa còn trong index) được gom lại rồi mới đưa vào index bằng
+    # một lần copy index (xem _sync_index); giữa hai lần, dòng mới được tính score trực tiếp từ store và vector
+    # đã xóa bị loại khi search. Chi phí O(N) của lần copy được chia cho INDEX_MERGE_ROWS thay đổi.
+    INDEX_MERGE_ROWS = 1024
+    # HNSW không xóa được vector: build lại graph khi vector đã xóa vượt tỷ lệ này của graph
+    HNSW_REBUILD_DEAD_FRACTION = 0.1
+    # Tạo store mới không còn dòng đã xóa khi số dòng đã xóa vượt tỷ lệ này của store
+    STORE_COMPACT_DEAD_FRACTION = 0.25
+
+    def _build_index(self, embeddings, image_ids):
+        """
+        Build lại FAISS index từ ma trận embeddings (đã L2-normalize) và image_ids tương ứng
+        theo loại index cấu hình. IVF được train trên chính gallery. Index mới chứa mọi dòng hiện có của store.
+        """
+        self.index, self.active_index_type = self._make_index(embeddings, image_ids)
+        self._index_mmapped = False
+        self._base_rows = len(self.store)
+        self._base_dead = []
+
+    def _make_index(self, embeddings, image_ids):
+        """Tạo index mới (chưa gắn vào manager) từ embeddings/image_ids, trả về (index, loại index)."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1, self.embedding_size)
+        index_type = self._target_index_type(len(embeddings))
+        index = self._new_index(index_type)
+        if index_type == 'ivf':
+            index.train(embeddings)
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        elif index_type in QUANTIZED_INDEX_TYPES and not index.is_trained:
+            # sq8: min/max từng chiều; pq: codebook k-means. Train lại mỗi lần build index
+            index.train(embeddings)
+        if len(embeddings) > 0:
+            index.add_with_ids(embeddings, np.asarray(image_ids, dtype=np.int64))
+        return index, index_type
 
+    def rebuild_index(self):
+        """Build lại index từ các dòng còn tồn tại của store (khi đổi loại index, hoặc HNSW có nhiều vector đã xóa)."""
+        rows = self.store.live_rows(self._version)
+        self._build_index(self.store.embeddings_float32(rows), self.store.image_ids[rows])
+
+    def _set_gallery(self, store, index=None, index_type=None, mmapped=False):
+        """
+        Thay toàn bộ dữ liệu của writer (load/reset/thay gallery): store mới và index chứa mọi dòng của store
+        (None: build lại từ store). Map tra cứu được dựng lười (load mmap không trả chi phí O(N) lúc khởi động).
+        """
+        self.store = store
+        self._lookup = _GalleryLookup(store)
+        self._prototypes = None
+        self._num_dead = 0
+        if index is None:
+            self.rebuild_index()
+        else:
+            self.index = index
+            self.active_index_type = index_type
+            self._index_mmapped = mmapped
+            self._base_rows = len(store)
+            self._base_dead = []
+
+    def _live_row(self, image_id):
+        """Dòng hiện tại (phía writer) của image_id, None nếu không tồn tại."""
+        try:
+            image_id = self._to_id(image_id)
+        except (TypeError, ValueError):
+            return None
+        row = self._lookup.ensure().row_by_image_id.get(image_id)
+        if row is None or not self.store.alive(row, self._version):
+            return None
+        return row
+
+    def _live_class_rows(self, class_id):
+        """Các dòng hiện tại (phía writer) của class_id, sắp xếp tăng dần."""
+        try:
+            rows = self._lookup.ensure().rows_by_class_id.get(self._to_id(class_id), ())
+        except (TypeError, ValueError):
+            rows = ()
+        rows = np.array(sorted(rows), dtype=np.int64)
+        return rows[self.store.alive(rows, self._version)]
+
+    def _ensure_prototypes(self):
+        if self._prototypes is None:
+            state = self._state
+            if state is not None and state.lookup is self._lookup:
+                # Cùng store với bản đã publish (writer chưa sửa gì): dùng chung prototype reader đã dựng
+                self._prototypes = state.prototypes
+            else:
+                rows = self.store.live_rows(self._version)
+                self._prototypes = ClassPrototypes.from_store(self.store.take(rows) if self._num_dead else self.store)
+
+    def _detach(self):
+        """
+        Chuẩn bị sửa gallery: dựng map tra cứu (nếu chưa) trước khi store thay đổi, và copy prototype class
+        đang dùng chung với bản đã publish. Store, map và index không cần copy: store chỉ append + tombstone,
+        map chỉ thêm, index đã publish không bị sửa (xem _sync_index).
+        """
+        self._lookup.ensure()
+        if self.centroid_search:
+            self._ensure_prototypes()
+            if self._prototypes is self._state._prototypes:
+                self._prototypes = self._prototypes.copy()
+
+    @contextlib.contextmanager
+    def _writing(self, exclusive=False):
+        """
+        Giữ _write_lock; khi thoát lần ghi ngoài cùng thì gom thay đổi vào index nếu cần (_sync_index)
+        và publish trạng thái mới cho reader.
+        exclusive=True (thao tác ghi mutation log): ở chế độ nhiều process giữ thêm lock ghi liên process
+        và bắt kịp thay đổi của process khác trước khi sửa.
+        """
+        with self._write_lock:
+            coordinated = exclusive and self._write_depth == 0 and self._coordinator is not None
+            with self._coordinator.write_lock() if coordinated else contextlib.nullcontext():
+                if coordinated and not self._loaded:
+                    raise RuntimeError('Gallery FAISS nhiều process: cần load() trước khi ghi')
+                self._write_depth += 1
+                try:
+                    if coordinated:
+                        self._catch_up()
+                    yield
+                    if self._write_depth == 1:
+                        self._sync_index()
+                finally:
+                    self._write_depth -= 1
+                    if self._write_depth == 0:
+                        self._publish()
+
+    def _seal(self):
+        """Kết thúc phiên bản đang ghi, trả về số phiên bản; các lần xóa sau đó thuộc phiên bản mới."""
+        version = self._version
+        self._version += 1
+        return version
+
+    def _publish(self):
+        """Thay phiên bản reader bằng trạng thái hiện tại của writer: O(1), không copy index, store hay map."""
+        state = self._state
+        prototypes = self._prototypes
+        if prototypes is None and state is not None and state.lookup is self._lookup:
+            # Giữ prototype mà reader đã dựng lười trên cùng store
+            prototypes = state._prototypes
+        self._state = _GalleryState(self.index, self.store.view(), self.active_index_type, self._seal(),
+                                    self._base_rows, self._base_dead, self._num_dead, self._lookup, prototypes)
+
+    def _append(self, embeddings, image_ids, image_paths, class_ids):
+        """Thêm dòng vào store (chưa vào index cho tới lần gộp sau, xem _sync_index) và cập nhật map tra cứu."""
+        start = self.store.append(embeddings, image_ids, image_paths, class_ids)
+        self._lookup.add(start, image_ids, class_ids)
+        if self._prototypes is not None:
+            self._prototypes.add(class_ids, embeddings)
+
+    def _kill(self, rows):
+        """
+        Xóa các dòng (tombstone ở phiên bản đang ghi, O(số dòng bị xóa)). Vector của dòng đã vào index
+        được loại khi search và bỏ hẳn khỏi index ở lần gộp sau.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if self._prototypes is not None:
+            self._prototypes.remove(self.store.class_ids[rows], self.store.embeddings[rows])
+        self.store.kill(rows, self._version)
+        self._num_dead += len(rows)
+        self._base_dead.extend(self.store.image_ids[rows[rows < self._base_rows]].tolist())
+
+    def _replace_row(self, row, embedding, image_path):
+        """Đổi embedding/đường dẫn của một ảnh: xóa dòng cũ, thêm dòng mới cùng image_id và class_id."""
+        image_id, class_id = int(self.store.image_ids[row]), int(self.store.class_ids[row])
+        embedding = np.array(embedding, dtype=np.float32).reshape(1, self.embedding_size)
+        self._kill([row])
+        self._append(embedding, [image_id], [image_path], [class_id])
+
+    def _sync_index(self):
+        """
+        Gọi trước khi publish: đưa thay đổi vào index theo lô thay vì sửa index (và copy) ở mỗi thao tác.
+        - gallery vừa đủ lớn để train loại index cấu hình (IVF, sq8, pq): build lại index
+        - số dòng đã xóa vượt STORE_COMPACT_DEAD_FRACTION: tạo store mới chỉ gồm dòng còn tồn tại (_compact)
+        - thay đổi chưa vào index đạt INDEX_MERGE_ROWS: gộp vào bản copy của index (_merge_index)
+        """
+        n = len(self.store)
+        pending = n - self._base_rows
+        if self.active_index_type != self.index_type and \
+           self._target_index_type(n - self._num_dead) == self.index_type:
+            # Gallery vừa đủ lớn để train IVF/sq8/pq: chuyển từ flat sang loại index cấu hình
+            self.rebuild_index()
+        elif self._num_dead >= max(self.INDEX_MERGE_ROWS, n * self.STORE_COMPACT_DEAD_FRACTION):
+            self._compact()
+        elif self.active_index_type == 'hnsw' and \
+                len(self._base_dead) >= max(self.INDEX_MERGE_ROWS, self.index.ntotal * self.HNSW_REBUILD_DEAD_FRACTION):
+            self.rebuild_index()
+        elif pending + (0 if self.active_index_type == 'hnsw' else len(self._base_dead)) >= self.INDEX_MERGE_ROWS:
+            self._merge_index()
+
+    def _merge_index(self):
+        """
+        Đưa thay đổi vào index mới (index đã publish không bị sửa): copy index, bỏ vector đã xóa, thêm các dòng
+        delta còn tồn tại. HNSW không hỗ trợ remove_ids nên vector đã xóa ở lại trong graph (vẫn bị loại khi
+        search); nếu image_id của chúng được thêm lại thì build lại graph (selector lọc theo image_id).
+        """
+        hnsw = self.active_index_type == 'hnsw'
+        if hnsw and self._base_dead:
+            delta = self.store.live_rows(self._version, self._base_rows)
+            if not set(self._base_dead).isdisjoint(self.store.image_ids[delta].tolist()):
+                self.rebuild_index()
+                return
+        self.index = self._merged_index(self.index, self.active_index_type, self._index_mmapped, self.store,
+                                        self._version, self._base_rows, [] if hnsw else self._base_dead)
+        self._index_mmapped = False
+        self._base_rows = len(self.store)
+        if not hnsw:
+            self._base_dead = []
+
+    def _merged_index(self, index, index_type, mmapped, store, version, base_rows, base_dead):
+        """
+        Index mới (index truyền vào không bị sửa) gồm index bỏ các image_id base_dead, cộng các dòng
+        [base_rows, N) của store còn tồn tại ở phiên bản version.
+        Index mmap là chỉ-đọc: IVF mmap dùng inverted list trên đĩa nên được dựng lại với quantizer đã train
+        từ các dòng còn tồn tại; các loại khác copy qua serialize/deserialize. Index trong RAM dùng clone_index.
+        """
+        if mmapped and index_type == 'ivf':
+            rows = store.live_rows(version)
+            quantizer = faiss.clone_index(index.quantizer)
+            merged = faiss.IndexIVFFlat(quantizer, self.embedding_size, index.nlist, faiss.METRIC_INNER_PRODUCT)
+            merged.nprobe = self.nprobe
+            merged.set_direct_map_type(faiss.DirectMap.Hashtable)
+            if len(rows) > 0:
+                merged.add_with_ids(store.embeddings_float32(rows), np.ascontiguousarray(store.image_ids[rows]))
+            return merged
+        merged = faiss.deserialize_index(faiss.serialize_index(index)) if mmapped else faiss.clone_index(index)
+        if base_dead:
+            merged.remove_ids(np.asarray(base_dead, dtype=np.int64))
+        delta = store.live_rows(version, base_rows)
+        if len(delta) > 0:
+            merged.add_with_ids(store.embeddings_float32(delta), np.ascontiguousarray(store.image_ids[delta]))
+        return merged
+
+    def _compact(self):
+        """
+        Thay store bằng store mới chỉ gồm các dòng còn tồn tại (O(N), chỉ khi dòng đã xóa vượt
+        STORE_COMPACT_DEAD_FRACTION) cùng index không còn vector đã xóa; phiên bản đã publish vẫn dùng bản cũ.
+        """
+        prototypes = self._prototypes
+        store = self.store.take(self.store.live_rows(self._version))
+        if self.active_index_type == 'hnsw' and self._base_dead:
+            index = None
+        else:
+            index = self._merged_index(self.index, self.active_index_type, self._index_mmapped, self.store,
+                                       self._version, self._base_rows, self._base_dead)
+        self._set_gallery(store, index, self.active_index_type)
+        # prototype không đổi (cùng dữ liệu)
+        self._prototypes = prototypes
+
+    def _capture(self):
+        """
+        Chụp trạng thái writer để ghi ra đĩa ngoài lock (caller giữ _write_lock): chỉ giữ tham chiếu,
+        các lần ghi sau không sửa index/store đã chụp (xóa sau đó thuộc phiên bản mới).
+        """
+        return (self.index, self.active_index_type, self._index_mmapped, self.store.view(), self._seal(),
+                self._base_rows, list(self._base_dead))
+
+    def _snapshot_data(self, captured):
+        """(index, store) chỉ gồm các dòng còn tồn tại của trạng thái đã chụp bằng _capture, để ghi ra đĩa."""
+        index, index_type, mmapped, store, version, base_rows, base_dead = captured
+        rows = store.live_rows(version)
+        if len(rows) == len(store) and base_rows == len(store) and not base_dead:
+            if mmapped and index_type == 'ivf':
+                # IVF mmap dùng inverted list trên đĩa, serialize cần bản trong RAM
+                index = self._merged_index(index, index_type, mmapped, store, version, base_rows, [])
+            return index, store
+        live = store.take(rows)
+        if index_type == 'hnsw' and base_dead:
+            # vector đã xóa không bỏ được khỏi graph: build lại từ các dòng còn tồn tại
+            index = self._new_index('hnsw')
+            if len(live) > 0:
+                index.add_with_ids(live.embeddings_float32(), np.ascontiguousarray(live.image_ids))
+            return index, live
+        return self._merged_index(index, index_type, mmapped, store, version, base_rows, base_dead), live
+
+    @_mutation
     def add_embeddings(self, embeddings, image_ids, image_paths, class_ids):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.embedding_size)
         embeddings_norm = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
-        self.index.add(embeddings_norm.astype(np.float32))
-        self.image_ids.extend(image_ids)
-        self.image_paths.extend(image_paths)
-        self.class_ids.extend(class_ids)
-        if len(self.embeddings) == 0:
-            self.embeddings = embeddings_norm.tolist()
+        ids = [self._allocate_synthetic_id() if i is None else self._to_id(i) for i in image_ids]
+        if len(set(ids)) != len(ids):
+            raise ValueError('image_id bị trùng trong cùng một lần thêm')
+        for image_id in ids:
+            if self._live_row(image_id) is not None:
+                raise ValueError(f'image_id {image_id} đã tồn tại trong FAISS index')
+        cids = [self._to_class_id(c) for c in class_ids]
+        image_paths = list(image_paths)
+        self._detach()
+        self._append(embeddings_norm, ids, image_paths, cids)
+        self._log([('add', i, c, p, e) for i, c, p, e in zip(ids, cids, image_paths, embeddings_norm)])
+
+    @_mutation
+    def update_embedding(self, image_id, embedding):
+        """
+        Thay embedding của một ảnh (xóa dòng cũ, thêm dòng mới cùng image_id).
+        Trả về False nếu image_id không tồn tại.
+        """
+        image_id = self._to_id(image_id)
+        row = self._live_row(image_id)
+        if row is None:
+            return False
+        emb = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        emb = emb / np.linalg.norm(emb, axis=1, keepdims=True)
+        self._detach()
+        image_path = self.store.image_paths[row]
+        self._replace_row(row, emb, None if image_path == '' else image_path)
+        self._log([('update_embedding', image_id, emb[0])])
+        return True
+
+    @_mutation
+    def update_image_path(self, image_id, image_path):
+        image_id = self._to_id(image_id)
+        row = self._live_row(image_id)
+        if row is None:
+            return False
+        self._detach()
+        self._replace_row(row, self.store.embeddings[row], image_path)
+        self._log([('update_path', image_id, image_path)])
+        return True
+
+    # ----- Accessor API: service đọc gallery qua các hàm này, không truy cập trực tiếp store -----
+
+    # Các hàm đọc dùng phiên bản đã publish (self._state), không cần lock
+
+    def size(self):
+        """Số ảnh (vector) trong gallery."""
+        return self._state.size
+
+    def has_image(self, image_id):
+        return self._state.row_of(image_id) is not None
+
+    def has_class(self, class_id):
+        return len(self._state.class_rows(class_id)) > 0
+
+    def class_id_of(self, image_id):
+        """class_id của một ảnh, None nếu image_id không tồn tại."""
+        state = self._state
+        row = state.row_of(image_id)
+        return None if row is None else int(state.store.class_ids[row])
+
+    def image_path_of(self, image_id):
+        """image_path của một ảnh, None nếu image_id không tồn tại hoặc ảnh không có đường dẫn."""
+        state = self._state
+        row = state.row_of(image_id)
+        return None if row is None else state.store.row(row)['image_path']
+
+    def get_embedding(self, image_id):
+        """Embedding (float32, đã normalize) của một ảnh, None nếu không tồn tại."""
+        state = self._state
+        row = state.row_of(image_id)
+        return None if row is None else state.store.embeddings_float32([row])[0]
+
+    def get_embeddings(self):
+        """Ma trận embeddings (N, d) chỉ-đọc, cùng thứ tự dòng với get_rows."""
+        return self._state.live_store().embeddings
+
+    def get_row(self, row):
+        return self._state.store.row(row)
+
+    def get_rows(self, start=0, stop=None):
+        """Metadata các dòng [start, stop) dạng list dict (image_id, image_path, class_id, faiss_index)."""
+        state = self._state
+        return [state.store.row(r) for r in state.live_rows()[max(0, start):stop]]
+
+    def _source_mtimes(self):
+        """mtime của file index và metadata .npz (định dạng cũ) để biết khi nào cần load lại."""
+        return tuple(os.path.getmtime(p) if p and os.path.exists(p) else None
+                     for p in (self.index_path, self.meta_path))
+
+    def save(self, wait=False):
+        """
+        Ghi toàn bộ gallery.
+        - Với store_dir: ghi một generation snapshot mới ở thread nền (wait=True: ghi ngay và chờ xong).
+          Các service không cần gọi sau mỗi thay đổi vì mutation log đã bền vững.
+        - Định dạng cũ: ghi đè file index và metadata .npz.
+        """
+        if self.store_dir:
+            if wait:
+                with self._snapshot_write_lock:
+                    self._write_generation()
+            else:
+                self._snapshot_requested.set()
+            return
+        with self._write_lock:
+            index_type = self.active_index_type
+            index, store = self._snapshot_data(self._capture())
+            faiss.write_index(index, self.index_path)
+            np.savez(self.meta_path,
+                     image_ids=store.image_ids,
+                     image_paths=store.image_paths,
+                     class_ids=store.class_ids,
+                     embeddings=store.embeddings,
+                     index_type=np.array(index_type))
+            # file do chính process này ghi: không cần load lại
+            self._last_mtimes = self._source_mtimes()
+
+    # ----- Snapshot theo generation + mutation log -----
+
+    def _write_generation(self):
+        """
+        Chụp trạng thái hiện tại thành generation mới (caller giữ _snapshot_write_lock).
+        Chỉ giữ _write_lock trong lúc copy dữ liệu và chuyển mutation log sang wal của generation mới;
+        phần ghi đĩa chạy ngoài lock nên các thao tác thêm/xóa không bị chặn.
+        Ở chế độ nhiều process, số generation được giữ chỗ qua bộ đếm phiên bản (dưới lock ghi liên process)
+        và mọi process, kể cả process này, load lại generation mới bằng mmap qua _catch_up.
+        """
+        coordinator = self._coordinator
+        with self._writing(exclusive=True) if coordinator is not None else self._write_lock:
+            generation = max(self.generation, self._wal_generation) + 1
+            self._wal.switch(snapshot.wal_path(self.store_dir, generation))
+            self._wal_generation = generation
+            # record ghi trước khi chuyển wal đều nằm trong snapshot này
+            snapshotted = self._unsnapshotted_records
+            if coordinator is not None:
+                self._wal_offset = 0
+                self._seen_seq = coordinator.update(wal_generation=generation, wal_offset=0)
+            captured = self._capture()
+            info = {'index_type': self.active_index_type}
+        # Bỏ dòng đã xóa và gộp các dòng chưa vào index ngoài lock
+        index, store = self._snapshot_data(captured)
+        index_bytes = faiss.serialize_index(index)
+        os.makedirs(self.store_dir, exist_ok=True)
+        snapshot.write_generation(self.store_dir, generation, store, index_bytes, info)
+        if coordinator is None:
+            with self._write_lock:
+                self.generation = generation
+                self._unsnapshotted_records -= snapshotted
         else:
-            self.embeddings.extend(embeddings_norm.tolist())
+            with coordinator.write_lock():
+                # generation chỉ tăng: snapshot ghi xong muộn hơn không làm lùi generation đã publish
+                coordinator.update(generation=max(generation, coordinator.read()[1]))
+            if self._loaded:
+                # store và index trong RAM được thay bằng mmap của generation mới
+                with self._writing():
+                    self._catch_up()
+        snapshot.prune(self.store_dir, keep=self.snapshot_keep)
+        print(f'Đã ghi snapshot FAISS generation {generation} ({len(store)} vectors)')
 
-    def save(self):
-        faiss.write_index(self.index, self.index_path)
-        np.savez(self.meta_path,
-                 image_ids=np.array(self.image_ids),
-                 image_paths=np.array(self.image_paths),
-                 class_ids=np.array(self.class_ids),
-                 embeddings=np.array(self.embeddings, dtype=np.float32))
+    def _snapshot_loop(self):
+        """Thread nền ghi snapshot khi được yêu cầu hoặc định kỳ khi mutation log còn thay đổi."""
+        while True:
+            requested = self._snapshot_requested.wait(timeout=self.wal_compact_seconds)
+            self._snapshot_requested.clear()
+            if not self._loaded or (not requested and self._wal.size() == 0):
+                continue
+            if self._coordinator is not None and not self._coordinator.try_become_owner():
+                # Nhiều process: chỉ owner ghi snapshot
+                continue
+            try:
+                with self._snapshot_write_lock:
+                    self._write_generation()
+            except Exception as e:
+                # Mutation log vẫn còn nguyên, snapshot sẽ được ghi lại ở lần sau
+                print(f'Lỗi ghi snapshot FAISS: {e}')
+
+    def _log(self, records):
+        """Ghi thay đổi vào mutation log (fsync); yêu cầu snapshot mới khi log vượt wal_compact_bytes."""
+        if self._wal is None or self._replaying or not records:
+            return
+        if self._coordinator is None:
+            self._unsnapshotted_records += len(records)
+            if self._wal.append(records) >= self.wal_compact_bytes:
+                self._snapshot_requested.set()
+            return
+        # Nhiều process: caller giữ lock ghi liên process và đã bắt kịp log (_writing(exclusive=True)).
+        # Bỏ phần đuôi chưa commit (process ghi dở rồi chết) trước khi ghi tiếp, rồi tăng bộ đếm phiên bản
+        self._wal.truncate(self._wal_offset)
+        self._wal_offset = self._wal.append(records)
+        self._seen_seq = self._coordinator.update(wal_generation=self._wal_generation, wal_offset=self._wal_offset)
+        if self._wal_offset >= self.wal_compact_bytes and self._coordinator.is_owner:
+            self._snapshot_requested.set()
+
+    def _apply_record(self, record):
+        """Áp dụng một record của mutation log (idempotent với snapshot đã chứa record đó)."""
+        op = record[0]
+        if op == 'add':
+            _, image_id, class_id, image_path, embedding = record
+            if self._live_row(image_id) is None:
+                self.add_embeddings([embedding], [image_id], [image_path], [class_id])
+        elif op == 'delete_image':
+            self.delete_by_image_id(record[1])
+        elif op == 'delete_class':
+            self.delete_by_class_id(record[1])
+        elif op == 'update_embedding':
+            self.update_embedding(record[1], record[2])
+        elif op == 'update_path':
+            self.update_image_path(record[1], record[2])
+        elif op == 'reset':
+            self.reset_index()
+
+    def _replay_log(self, generation):
+        """
+        Phát lại các mutation log wal-K với K >= generation theo thứ tự, rồi tiếp tục ghi vào log
+        mới nhất (giữ đúng thứ tự record nếu lần ghi snapshot trước bị dừng giữa chừng).
+        """
+        wal_generations = [g for g in snapshot.list_wal_generations(self.store_dir) if g >= generation]
+        records = []
+        for g in wal_generations:
+            records.extend(self._wal.read(snapshot.wal_path(self.store_dir, g)))
+        self._wal_generation = max(wal_generations + [generation])
+        self._wal.switch(snapshot.wal_path(self.store_dir, self._wal_generation))
+        if records:
+            self._apply_records(records)
+            print(f'Đã phát lại {len(records)} thay đổi từ mutation log FAISS')
+
+    def _apply_records(self, records):
+        """Áp dụng các record đọc từ mutation log mà không ghi lại vào log."""
+        if not records:
+            return
+        self._replaying = True
+        try:
+            for record in records:
+                self._apply_record(record)
+        finally:
+            self._replaying = False
+        self._next_synthetic_id = None
+
+    # ----- Nhiều process dùng chung store_dir (index/shared_gallery.py) -----
+
+    def _catch_up(self):
+        """
+        Áp dụng các thay đổi process khác đã commit (caller giữ _write_lock): load generation mới
+        bằng mmap nếu có snapshot mới, nếu không thì đọc phần mutation log mới từ offset đã áp dụng.
+        """
+        seq, generation, wal_generation, wal_offset = self._coordinator.read()
+        if seq == self._seen_seq:
+            return
+        if generation != self.generation:
+            self._load_snapshot(generation, wal_generation, wal_offset)
+        else:
+            self._apply_wal_tail(wal_generation, wal_offset)
+        self._seen_seq = seq
+
+    def _load_snapshot(self, generation, wal_generation, wal_offset):
+        """Load generation (0 = chưa có snapshot) rồi phát lại log tới offset đã commit."""
+        if generation == 0:
+            self._clear_gallery()
+        else:
+            self._load_generation(snapshot.generation_path(self.store_dir, generation))
+        self.generation = generation
+        self._wal_generation = generation
+        self._wal_offset = 0
+        self._wal.switch(snapshot.wal_path(self.store_dir, generation))
+        self._apply_wal_tail(wal_generation, wal_offset)
+
+    def _apply_wal_tail(self, wal_generation, wal_offset):
+        """Đọc và áp dụng record từ (_wal_generation, _wal_offset) tới (wal_generation, wal_offset)."""
+        records = []
+        for g in range(self._wal_generation, wal_generation + 1):
+            start = self._wal_offset if g == self._wal_generation else 0
+            end = wal_offset if g == wal_generation else None
+            records.extend(self._wal.read_from(snapshot.wal_path(self.store_dir, g), start, end)[0])
+        if wal_generation != self._wal_generation:
+            self._wal.switch(snapshot.wal_path(self.store_dir, wal_generation))
+            self._wal_generation = wal_generation
+        self._wal_offset = wal_offset
+        self._apply_records(records)
+
+    def _follow_loop(self):
+        """
+        Thread nền (nhiều process): khi bộ đếm phiên bản đổi thì bắt kịp thay đổi của process khác;
+        owner yêu cầu snapshot khi mutation log dùng chung vượt wal_compact_bytes (kể cả do process khác ghi).
+        Process giữ owner.lock chết thì process khác nhận vai trò owner ở vòng sau.
+        """
+        while True:
+            time.sleep(self.poll_interval)
+            if not self._loaded:
+                continue
+            try:
+                seq, _, _, wal_offset = self._coordinator.read()
+                if seq != self._seen_seq:
+                    with self._writing():
+                        self._catch_up()
+                if wal_offset >= self.wal_compact_bytes and self._coordinator.try_become_owner():
+                    self._snapshot_requested.set()
+            except Exception as e:
+                print(f'Lỗi đồng bộ gallery FAISS giữa các process: {e}')
 
     def load(self):
         """
-        Load lại FAISS index và metadata từ file nếu file thực sự thay đổi.
-        - Sử dụng timestamp (mtime) của file index và metadata để kiểm tra thay đổi.
-        - Nếu file không thay đổi kể từ lần load trước, bỏ qua việc load lại để tối ưu hiệu năng.
-        - Nếu file thay đổi, đọc lại index và metadata, đồng bộ các thuộc tính image_ids, image_paths, class_ids, embeddings.
-        - Nếu embeddings trong metadata bị thiếu hoặc không khớp số lượng với image_ids, sẽ reconstruct lại embeddings từ FAISS index.
+        Load lại FAISS index và metadata nếu dữ liệu trên đĩa thực sự thay đổi.
+        - Với store_dir: chọn generation snapshot mới nhất hợp lệ (manifest đủ file, đúng kích thước,
+          và đúng crc32 nếu bật verify_checksums), mmap index + các cột .npy (O(1), các worker dùng
+          chung page cache) rồi phát lại mutation log. Bỏ qua nếu generation không đổi.
+          Nếu chưa có snapshot/log nào mà còn file .npz cũ thì chuyển đổi một lần.
+          Nhiều process: owner load từ đĩa lúc khởi động và khởi tạo bộ đếm phiên bản, các process khác
+          load theo bộ đếm (generation + offset đã commit của mutation log).
+        - Với định dạng .npz cũ: dùng mtime của file index và metadata để kiểm tra thay đổi (xem _load_legacy).
+        """
+        if not self.store_dir:
+            with self._writing():
+                mtimes = self._source_mtimes()
+                if getattr(self, '_last_mtimes', None) == mtimes:
+                    # Index and metadata unchanged, no need to reload
+                    return
+                self._load_legacy()
+                self._last_mtimes = mtimes
+            return
+
+        with self._snapshot_write_lock, self._writing():
+            generations = snapshot.list_generations(self.store_dir)
+            self._checked_generation = generations[-1] if generations else 0
+            if self._coordinator is None:
+                self._load_store()
+                return
+            with self._coordinator.write_lock():
+                seq = self._coordinator.read()[0]
+                if not self._loaded and (self._coordinator.try_become_owner() or seq == 0):
+                    # Owner (hoặc process đầu tiên) lúc khởi động: dữ liệu trên đĩa là chuẩn,
+                    # khởi tạo lại bộ đếm phiên bản (process cũ có thể đã chết giữa chừng)
+                    self._load_store()
+                    self._wal_offset = self._wal.size()
+                    self._seen_seq = self._coordinator.update(self.generation, self._wal_generation,
+                                                              self._wal_offset)
+                else:
+                    self._catch_up()
+                    self._loaded = True
+
+    def has_newer_on_disk(self):
         """
-        # 1. Lấy thời gian sửa đổi cuối cùng (mtime) của file index và metadata
-        index_mtime = os.path.getmtime(self.index_path) if self.index_path and os.path.exists(self.index_path) else None
-        meta_mtime = os.path.getmtime(self.meta_path) if self.meta_path and os.path.exists(self.meta_path) else None
+        True nếu trên đĩa có dữ liệu mới hơn bản đang dùng và load lại được (vd. replica chỉ-đọc dùng chung
+        volume với replica ghi): generation snapshot mới hơn với store_dir, mtime file index/metadata đổi với
+        định dạng .npz cũ. Chỉ listdir/stat nên đủ rẻ để poll định kỳ.
+        Nhiều process (multi_process): luôn False, thread theo dõi bộ đếm phiên bản đã tự bắt kịp.
+        """
+        if self.store_dir:
+            if self._coordinator is not None:
+                return False
+            generations = snapshot.list_generations(self.store_dir)
+            # _checked_generation: generation mới nhất đã thấy lúc load (bỏ qua snapshot hỏng đã thử)
+            if not generations or generations[-1] <= max(self.generation, self._checked_generation):
+                return False
+            if self._unsnapshotted_records:
+                # Load sẽ bỏ mất các record chưa có trong snapshot nào: báo một lần cho generation này
+                self._checked_generation = generations[-1]
+                self._warn_foreign_generation(generations[-1])
+                return False
+            return True
+        return self._source_mtimes() != getattr(self, '_last_mtimes', None)
+
+    def _warn_foreign_generation(self, generation):
+        print(f'⚠️ Bỏ qua generation FAISS {generation} do process khác ghi vào {self.store_dir}: '
+              f'process này còn {self._unsnapshotted_records} thay đổi chưa có trong snapshot. '
+              f'Nhiều process/replica cùng ghi một store_dir cần multi_process (FAISS_SHARED_STORE)')
 
-        # 2. Nếu đã từng load và mtime không đổi, bỏ qua việc load lại
-        if hasattr(self, '_last_index_mtime') and self._last_index_mtime == index_mtime and \
-           hasattr(self, '_last_meta_mtime') and self._last_meta_mtime == meta_mtime:
-            # Index and metadata unchanged, no need to reload
+    def _load_store(self):
+        """Load generation snapshot mới nhất hợp lệ của store_dir rồi phát lại mutation log."""
+        generation, manifest = snapshot.latest_valid_generation(self.store_dir, self.verify_checksums)
+        if generation is None and not snapshot.list_wal_generations(self.store_dir) and \
+           self.index_path and os.path.exists(self.index_path) and self.meta_path and os.path.exists(self.meta_path):
+            print(f'Chuyển FAISS index/metadata .npz sang snapshot trong {self.store_dir}')
+            self._load_legacy()
+            self._write_generation()
+            generation, manifest = snapshot.latest_valid_generation(self.store_dir, self.verify_checksums)
+
+        if self._loaded and generation == self.generation:
+            return
+        if self._loaded and self._unsnapshotted_records:
+            self._warn_foreign_generation(generation)
             return
+        if generation is None:
+            self._clear_gallery()
+            self.generation = 0
+        else:
+            self._load_generation(snapshot.generation_path(self.store_dir, generation))
+            self.generation = generation
+        self._replay_log(self.generation)
+        self._loaded = True
+
+    def _clear_gallery(self):
+        """Gallery rỗng (chưa có snapshot nào trên đĩa)."""
+        self._set_gallery(GalleryStore(self.embedding_size, dtype=self.embedding_dtype))
+        self._next_synthetic_id = -2
+
+    def _load_generation(self, gen_dir):
+        """Mmap index và các cột metadata của một generation; map tra cứu được dựng lười."""
+        index = _read_index_mmap(os.path.join(gen_dir, snapshot.INDEX_FILE))
+        # map dựng lười (trên bản publish cho reader, hoặc khi writer cần)
+        self._set_gallery(GalleryStore.from_directory(gen_dir, dtype=self.embedding_dtype), index,
+                          self._detect_index_type(index), mmapped=True)
+        self._next_synthetic_id = None
 
-        # 3. Đọc lại FAISS index từ file
+        if self.active_index_type not in (self.index_type, self._target_index_type(len(self.store))):
+            print(f'FAISS index trên đĩa là {self.active_index_type}, cấu hình là {self.index_type}: build lại index')
+            self.rebuild_index()
+        elif self.active_index_type == 'ivf':
+            self.index.nprobe = self.nprobe
+        elif self.active_index_type == 'hnsw':
+            self._unwrap(self.index).hnsw.efSearch = self.ef_search
+
+    def _load_legacy(self):
+        """
+        Đọc index + metadata .npz (định dạng cũ) vào bộ nhớ.
+        - Nếu embeddings trong metadata bị thiếu hoặc không khớp số lượng với image_ids, sẽ reconstruct lại embeddings từ FAISS index.
+        """
+        # 1. Đọc lại FAISS index từ file
         idx = faiss.read_index(self.index_path)
-        self.index = idx
+        index_type = self._detect_index_type(idx)
 
-        # 4. Đọc lại metadata từ file (image_ids, image_paths, class_ids, embeddings)
+        # 2. Đọc lại metadata từ file (image_ids, image_paths, class_ids, embeddings)
         meta = np.load(self.meta_path, allow_pickle=True)
-        self.image_ids = list(meta['image_ids']) if 'image_ids' in meta else []
-        self.image_paths = list(meta['image_paths']) if 'image_paths' in meta else []
-        self.class_ids = list(meta['class_ids']) if 'class_ids' in meta else []
+        raw_image_ids = list(meta['image_ids']) if 'image_ids' in meta else []
+        image_paths = list(meta['image_paths']) if 'image_paths' in meta else [None] * len(raw_image_ids)
+        class_ids = [self._to_class_id(c) for c in meta['class_ids']] if 'class_ids' in meta else []
+        # Index định dạng cũ dùng vị trí dòng làm id; index mới key theo image_id
+        id_mapped = self._is_id_mapped(idx)
+        if not id_mapped and index_type == 'ivf':
+            idx.make_direct_map()
+        image_ids = self._normalize_image_ids(raw_image_ids)
 
-        # 5. Kiểm tra embeddings: nếu tồn tại và đủ số lượng thì dùng luôn, ngược lại reconstruct lại từ index
-        if 'embeddings' in meta and meta['embeddings'].shape[0] == len(self.image_ids):
-            self.embeddings = meta['embeddings'].tolist()
+        # 3. Kiểm tra embeddings: nếu tồn tại và đủ số lượng thì dùng luôn, ngược lại reconstruct lại từ index
+        if 'embeddings' in meta and meta['embeddings'].shape[0] == len(image_ids):
+            embeddings = np.asarray(meta['embeddings']).reshape(-1, self.embedding_size)
         else:
             # Embeddings missing or mismatched, reconstruct from FAISS index
-            self.embeddings = []
-            for i in range(len(self.image_ids)):
-                self.embeddings.append(self.index.reconstruct(i).tolist())
+            embeddings = self._reconstruct_all(idx, image_ids if id_mapped else None)
+        store = GalleryStore(self.embedding_size, dtype=self.embedding_dtype)
+        store.append(embeddings, image_ids, image_paths, class_ids)
+        self._set_gallery(store, idx, index_type)
 
-        # 6. Lưu lại mtime để lần sau kiểm tra
-        self._last_index_mtime = index_mtime
-        self._last_meta_mtime = meta_mtime
-        
+        # 4. Build lại nếu index trên đĩa là định dạng cũ (key theo vị trí) hoặc khác loại index
+        #    cấu hình hiện tại (đổi FAISS_INDEX_TYPE)
+        if not id_mapped:
+            print('FAISS index trên đĩa chưa key theo image_id: build lại index')
+            self.rebuild_index()
+        elif self.active_index_type not in (self.index_type, self._target_index_type(len(self.store))):
+            print(f'FAISS index trên đĩa là {self.active_index_type}, cấu hình là {self.index_type}: build lại index')
+            self.rebuild_index()
+        elif self.active_index_type == 'ivf':
+            self.index.nprobe = self.nprobe
+        elif self.active_index_type == 'hnsw':
+            self._unwrap(self.index).hnsw.efSearch = self.ef_search
+
+    def _reconstruct_all(self, index, image_ids=None):
+        """
+        Lấy lại toàn bộ vector từ index theo khối thay vì reconstruct từng vector.
+        image_ids=None: index cũ key theo vị trí dòng (reconstruct_n). Ngược lại trả về vector theo đúng
+        thứ tự image_ids (id không có trong index -> vector 0).
+        """
+        if image_ids is None:
+            return index.reconstruct_n(0, index.ntotal)
+        if isinstance(index, faiss.IndexIDMap2):
+            ids = faiss.vector_to_array(index.id_map)
+            vecs = self._unwrap(index).reconstruct_n(0, index.ntotal)
+        else:
+            # IVF key theo id: đọc thẳng inverted list (IVF-Flat lưu vector float32 nguyên bản)
+            invlists = index.invlists
+            ids_parts, vec_parts = [], []
+            for list_no in range(index.nlist):
+                size = invlists.list_size(list_no)
+                if size == 0:
+                    continue
+                ids_parts.append(faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy())
+                codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), size * invlists.code_size).copy()
+                vec_parts.append(codes.view(np.float32).reshape(size, self.embedding_size))
+            if not ids_parts:
+                return np.zeros((len(image_ids), self.embedding_size), dtype=np.float32)
+            ids = np.concatenate(ids_parts)
+            vecs = np.concatenate(vec_parts)
+        embeddings = np.zeros((len(image_ids), self.embedding_size), dtype=np.float32)
+        if len(ids) == 0:
+            return embeddings
+        wanted = np.asarray(image_ids, dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+        pos = np.clip(np.searchsorted(ids[order], wanted), 0, len(ids) - 1)
+        found = ids[order][pos] == wanted
+        embeddings[found] = vecs[order[pos[found]]]
+        return embeddings
+
+    def _normalize_image_ids(self, raw_image_ids):
+        """
+        Chuyển image_id đọc từ metadata về int. Giá trị None/không hợp lệ hoặc bị trùng
+        được cấp id âm để mỗi vector có một id duy nhất trong FAISS.
+        """
+        parsed = []
+        for value in raw_image_ids:
+            try:
+                parsed.append(self._to_id(value))
+            except (TypeError, ValueError):
+                parsed.append(None)
+        valid = [i for i in parsed if i is not None]
+        self._next_synthetic_id = min([-2] + [i - 1 for i in valid])
+        seen = set()
+        image_ids = []
+        for image_id in parsed:
+            if image_id is None or image_id in seen:
+                image_id = self._allocate_synthetic_id()
+                print(f'Metadata FAISS có image_id rỗng hoặc trùng, cấp id tạm {image_id}')
+            seen.add(image_id)
+            image_ids.append(image_id)
+        return image_ids
+
+    @_mutation
     def delete_by_image_id(self, image_id):
-        image_id = str(image_id)
-        if image_id not in [str(i) for i in self.image_ids]:
+        try:
+            image_id = self._to_id(image_id)
+        except (TypeError, ValueError):
             return False
-        idx = [str(i) for i in self.image_ids].index(str(image_id))
-        del self.image_ids[idx]
-        del self.image_paths[idx]
-        del self.class_ids[idx]
-        del self.embeddings[idx]
-        self.index = faiss.IndexFlatIP(self.embedding_size)
-        if len(self.embeddings) > 0:
-            self.index.add(np.array(self.embeddings, dtype=np.float32))
+        row = self._live_row(image_id)
+        if row is None:
+            return False
+        self._detach()
+        self._kill([row])
+        self._log([('delete_image', image_id)])
         return True
 
+    @_mutation
+    def delete_by_image_ids(self, image_ids):
+        """
+        Xóa nhiều ảnh trong một thao tác: một lần publish và một lần ghi mutation log.
+        Bỏ qua image_id không tồn tại; trả về danh sách image_id đã xóa.
+        """
+        rows, ids = [], []
+        for image_id in image_ids:
+            try:
+                image_id = self._to_id(image_id)
+            except (TypeError, ValueError):
+                continue
+            row = self._live_row(image_id)
+            if row is not None and image_id not in ids:
+                rows.append(row)
+                ids.append(image_id)
+        if not ids:
+            return []
+        self._detach()
+        self._kill(rows)
+        self._log([('delete_image', image_id) for image_id in ids])
+        return ids
+
+    def find_near_duplicates(self, duplicate_threshold=0.95, cross_class_threshold=0.8, k=10, tile_size=4096,
+                             max_pairs=1000):
+        """
+        Báo cáo ảnh gần trùng trên phiên bản đã publish (xem index/duplicates.py), kèm các image_id nên xóa
+        (prune_image_ids) và dung lượng tiết kiệm được nếu xóa chúng.
+        """
+        state = self._state
+        store = state.live_store()
+        report = duplicates.find_near_duplicates(store, duplicate_threshold, cross_class_threshold,
+                                                 k, tile_size, max_pairs)
+        prune_rows = report.pop('prune_rows')
+        n = len(store)
+        # index + một dòng store (embedding, image_id, class_id, con trỏ image_path)
+        per_vector = self._index_bytes_per_vector(state.active_index_type) + \
+            store.dtype.itemsize * self.embedding_size + 24
+        report.update({
+            'num_vectors': n,
+            'prune_image_ids': [int(i) for i in store.image_ids[prune_rows]],
+            'savings': {
+                'vectors': len(prune_rows),
+                'percent': round(100.0 * len(prune_rows) / n, 2) if n else 0.0,
+                'bytes': int(len(prune_rows) * per_vector),
+            },
+        })
+        return report
+
+    def _index_bytes_per_vector(self, index_type):
+        """Ước lượng số byte index dùng cho mỗi vector (gồm id 8 byte)."""
+        d = self.embedding_size
+        return 8 + {
+            'flat': 4 * d,
+            'ivf': 4 * d,
+            'hnsw': 4 * d + 2 * self.hnsw_m * 4,
+            'sq8': d,
+            'sq16': 2 * d,
+            'pq': self.pq_m * self.pq_nbits // 8,
+        }.get(index_type, 4 * d)
+
+    @_mutation
     def delete_by_class_id(self, class_id):
         """
-        Xóa toàn bộ ảnh có class_id chỉ định và rebuild lại FAISS index
+        Xóa toàn bộ ảnh có class_id chỉ định (tombstone, không rebuild FAISS index)
         """
-        class_id = str(class_id)
-        # Lấy các chỉ số cần xóa
-        idxs_to_delete = [i for i, cls in enumerate(self.class_ids) if str(cls) == class_id]
-        if not idxs_to_delete:
+        # Lấy các chỉ số cần xóa từ map class_id -> dòng
+        idxs_to_delete = self._live_class_rows(class_id)
+        if len(idxs_to_delete) == 0:
             return False
-        # Xóa các phần tử metadata tại các vị trí index
-        self.image_ids = [img_id for i, img_id in enumerate(self.image_ids) if i not in idxs_to_delete]
-        self.image_paths = [img_path for i, img_path in enumerate(self.image_paths) if i not in idxs_to_delete]
-        self.class_ids = [cls for i, cls in enumerate(self.class_ids) if i not in idxs_to_delete]
-        self.embeddings = [emb for i, emb in enumerate(self.embeddings) if i not in idxs_to_delete]
-        # Rebuild lại FAISS index từ embeddings còn lại
-        self.index = faiss.IndexFlatIP(self.embedding_size)
-        if len(self.embeddings) > 0:
-            self.index.add(np.array(self.embeddings, dtype=np.float32))
+        self._detach()
+        self._kill(idxs_to_delete)
+        self._log([('delete_class', self._to_id(class_id))])
         return True
         
-    def query(self, query_emb, topk=5):
+    def _search_params(self, index_type, nprobe=None, ef_search=None, sel=None):
+        """
+        Tham số search theo từng truy vấn (không thay đổi trạng thái index dùng chung). sel: IDSelector loại
+        vector đã xóa (index nén không nhận selector, xem _search_rows).
+        """
+        if index_type == 'ivf':
+            return faiss.SearchParametersIVF(nprobe=int(nprobe or self.nprobe), sel=sel)
+        if index_type == 'hnsw':
+            return faiss.SearchParametersHNSW(efSearch=int(ef_search or self.ef_search), sel=sel)
+        if sel is not None and index_type not in QUANTIZED_INDEX_TYPES:
+            return faiss.SearchParameters(sel=sel)
+        return None
+
+    def _search_rows(self, state, query_embs, topk, nprobe=None, ef_search=None):
+        """
+        Search top-k trên một phiên bản: index (bỏ vector đã xóa) cộng các dòng delta chưa vào index (tính
+        inner product trực tiếp). Trả về (D, rows) dạng (N, topk), rows là vị trí dòng trong store
+        (-1, score -inf nếu không đủ kết quả).
+        """
+        query_embs = np.ascontiguousarray(query_embs, dtype=np.float32).reshape(-1, self.embedding_size)
+        nq = len(query_embs)
+        quantized = state.active_index_type in QUANTIZED_INDEX_TYPES
+        if state.index.ntotal > 0:
+            # Index nén: lấy dư số vector đã xóa rồi lọc khi map sang dòng
+            k = topk + state.base_dead_count if quantized else topk
+            params = self._search_params(state.active_index_type, nprobe, ef_search,
+                                         None if quantized else state.selector())
+            if params is None:
+                D, I = state.index.search(query_embs, k)
+            else:
+                D, I = state.index.search(query_embs, k, params=params)
+            rows = state.index_rows(I)
+            D = np.where(rows >= 0, D, -np.inf).astype(np.float32)
+        else:
+            D = np.empty((nq, 0), dtype=np.float32)
+            rows = np.empty((nq, 0), dtype=np.int64)
+        delta = state.delta_rows()
+        if len(delta) > 0:
+            D = np.hstack([D, query_embs @ state.store.embeddings_float32(delta).T])
+            rows = np.hstack([rows, np.broadcast_to(delta, (nq, len(delta)))])
+        if D.shape[1] < topk:
+            pad = topk - D.shape[1]
+            D = np.hstack([D, np.full((nq, pad), -np.inf, dtype=np.float32)])
+            rows = np.hstack([rows, np.full((nq, pad), -1, dtype=np.int64)])
+        if D.shape[1] > topk or len(delta) > 0:
+            order = np.argsort(-D, axis=1, kind='stable')[:, :topk]
+            D = np.take_along_axis(D, order, axis=1)
+            rows = np.take_along_axis(rows, order, axis=1)
+        rows = np.where(np.isfinite(D), rows, -1)
+        return D.astype(np.float32), rows
+
+    def search(self, query_embs, topk=5, nprobe=None, ef_search=None):
+        """
+        Search thô trên ma trận query (N, d) đã L2-normalize.
+        Trả về (D, I) như faiss.Index.search; nprobe/ef_search chỉ áp dụng cho IVF/HNSW.
+        Với index nén (sq8/sq16/pq) score là xấp xỉ, chưa re-rank (query/query_batch mới re-rank).
+        """
+        state = self._state
+        D, rows = self._search_rows(state, query_embs, topk, nprobe, ef_search)
+        if len(state.store) == 0:
+            return D, rows
+        return D, np.where(rows >= 0, state.store.image_ids[np.maximum(rows, 0)], -1)
+
+    def query(self, query_emb, topk=5, nprobe=None, ef_search=None):
         import time
+        # Search và đọc metadata trên cùng một phiên bản (không lock, writer không chặn query)
+        state = self._state
         print(f'--- FAISS query ---')
-        print(f'Số lượng vector trong index: {self.index.ntotal}')
+        print(f'Số lượng vector trong gallery: {state.size}')
         start = time.time()
-        query_emb_norm = query_emb / np.linalg.norm(query_emb)
-        D, I = self.index.search(query_emb_norm.reshape(1, -1).astype(np.float32), topk)
+        results = self._query_state(state, np.asarray(query_emb).reshape(1, -1), topk, nprobe, ef_search)[0]
         print(f'Thời gian search FAISS: {time.time() - start:.3f}s')
+        print(f'Kết quả truy vấn: {results}')
+        return results
+
+    def query_batch(self, query_embs, topk=5, nprobe=None, ef_search=None):
+        """
+        Truy vấn nhiều embedding (N, d) bằng một lần index.search.
+        Trả về list N phần tử, mỗi phần tử là list kết quả như query() (đã bỏ các vị trí -1).
+        """
+        return self._query_state(self._state, query_embs, topk, nprobe, ef_search)
+
+    def _query_state(self, state, query_embs, topk, nprobe=None, ef_search=None):
+        query_embs = np.asarray(query_embs, dtype=np.float32).reshape(-1, self.embedding_size)
+        if len(query_embs) == 0:
+            return []
+        norms = np.linalg.norm(query_embs, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        query_embs = query_embs / norms
+        if self.centroid_search and len(state.prototypes) > self.centroid_shortlist:
+            D, rows = self._centroid_search(state, query_embs, topk)
+        else:
+            rerank = state.active_index_type in QUANTIZED_INDEX_TYPES
+            k = topk * self.rerank_factor if rerank else topk
+            # Dòng trong store cho cả ma trận kết quả (-1: không đủ kết quả)
+            D, rows = self._search_rows(state, query_embs, k, nprobe, ef_search)
+            if rerank:
+                D, rows = self._rerank(state, query_embs, rows, topk)
+        valid = rows >= 0
+        safe_rows = np.where(valid, rows, 0)
+        store = state.store
+        if len(store):
+            image_ids = store.image_ids[safe_rows]
+            class_ids = store.class_ids[safe_rows]
+            image_paths = store.image_paths[safe_rows]
         results = []
-        for idx, dist in zip(I[0], D[0]):
-            if idx >= 0 and idx < len(self.image_ids):
-                results.append({
-                    'image_id': self.image_ids[idx],
-                    'image_path': self.image_paths[idx],
-                    'class_id': self.class_ids[idx],
-                    'score': dist,
-                    'faiss_index': idx
+        for q in range(len(query_embs)):
+            hits = []
+            for k in np.flatnonzero(valid[q]):
+                image_path = image_paths[q, k]
+                hits.append({
+                    'image_id': int(image_ids[q, k]),
+                    # store mmap lưu image_path rỗng là ''
+                    'image_path': None if image_path is None or image_path == '' else str(image_path),
+                    'class_id': int(class_ids[q, k]),
+                    'faiss_index': int(rows[q, k]),
+                    'score': D[q, k],
                 })
-        print(f'Kết quả truy vấn: {results}')
+            results.append(hits)
         return results
 
+    # range_query trên index nén / search hai tầng với include_classes: số ứng viên = hệ số này * max_results
+    RANGE_CLASS_CANDIDATE_FACTOR = 20
+
+    def range_query(self, query_emb, min_score, max_results=None, nprobe=None, ef_search=None,
+                    include_classes=False):
+        """
+        Tìm mọi ảnh có score > min_score bằng range_search của FAISS (ứng viên dưới ngưỡng bị loại ngay
+        trong FAISS). Dùng khi ngưỡng chặt (chỉ ít ảnh vượt ngưỡng); cần top-k với ngưỡng thấp thì dùng query().
+        Trả về dict:
+        - results: các ảnh sắp theo score giảm dần (tối đa max_results), cùng dạng với query()
+        - classes (chỉ khi include_classes=True): ảnh có score cao nhất của từng class_id trong toàn bộ
+          kết quả, sắp theo score giảm dần
+        Index nén và search hai tầng theo prototype không dùng range_search: lấy top ứng viên (đã re-rank
+        chính xác) rồi lọc theo ngưỡng, nên chỉ xét tối đa max_results ảnh (mặc định 100); với include_classes
+        xét RANGE_CLASS_CANDIDATE_FACTOR lần số đó để các ảnh cùng người không chiếm hết ứng viên.
+        """
+        state = self._state
+        query_emb = np.asarray(query_emb, dtype=np.float32).reshape(1, self.embedding_size)
+        norm = np.linalg.norm(query_emb)
+        query_emb = query_emb / (norm if norm > 0 else 1.0)
+        if (self.centroid_search and len(state.prototypes) > self.centroid_shortlist) or \
+                state.active_index_type in QUANTIZED_INDEX_TYPES:
+            pool = max_results or 100
+            if include_classes:
+                pool *= self.RANGE_CLASS_CANDIDATE_FACTOR
+            hits = self._query_state(state, query_emb, pool, nprobe, ef_search)[0]
+            rows = np.array([h['faiss_index'] for h in hits if h['score'] > min_score], dtype=np.int64)
+            scores = np.array([h['score'] for h in hits if h['score'] > min_score], dtype=np.float32)
+        else:
+            rows = np.empty(0, dtype=np.int64)
+            scores = np.empty(0, dtype=np.float32)
+            if state.index.ntotal > 0:
+                params = self._search_params(state.active_index_type, nprobe, ef_search, state.selector())
+                if params is None:
+                    lims, D, I = state.index.range_search(query_emb, float(min_score))
+                else:
+                    lims, D, I = state.index.range_search(query_emb, float(min_score), params=params)
+                rows = state.index_rows(I[lims[0]:lims[1]])
+                scores = np.asarray(D[lims[0]:lims[1]], dtype=np.float32)
+            # Dòng chưa vào index: tính score trực tiếp
+            delta = state.delta_rows()
+            if len(delta) > 0:
+                rows = np.concatenate([rows, delta])
+                scores = np.concatenate([scores, state.store.embeddings_float32(delta) @ query_emb[0]])
+            keep = (rows >= 0) & (scores > min_score)
+            rows, scores = rows[keep], scores[keep]
+        if not include_classes and max_results is not None and len(rows) > max_results:
+            # Chỉ cần max_results ảnh tốt nhất: chọn trước rồi mới sắp xếp
+            top = np.argpartition(-scores, max_results - 1)[:max_results] if max_results > 0 else []
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        rows, scores = rows[order], scores[order]
+        store = state.store
+
+        def _hit(row, score):
+            result = store.row(int(row))
+            result['score'] = float(score)
+            return result
+
+        limit = len(rows) if max_results is None else max_results
+        found = {'results': [_hit(r, d) for r, d in zip(rows[:limit], scores[:limit])]}
+        if include_classes:
+            # Ảnh tốt nhất mỗi class: lần xuất hiện đầu tiên của class_id trong danh sách đã sắp xếp
+            _, first = np.unique(store.class_ids[rows], return_index=True)
+            found['classes'] = [_hit(rows[i], scores[i]) for i in np.sort(first)]
+        return found
+
+    @staticmethod
+    def _rerank(state, query_embs, rows, topk):
+        """
+        Tính lại inner product chính xác giữa query và các dòng ứng viên (N, k) từ embeddings trong store,
+        giữ topk dòng score cao nhất. Trả về (D, rows) dạng (N, topk), rows = -1 ở vị trí không có kết quả.
+        """
+        valid = rows >= 0
+        if not valid.any():
+            return np.full((len(rows), topk), -np.inf, dtype=np.float32), np.full((len(rows), topk), -1, dtype=np.int64)
+        candidates = state.store.embeddings_float32(np.where(valid, rows, 0).ravel())
+        scores = np.einsum('nkd,nd->nk', candidates.reshape(rows.shape + (-1,)), query_embs)
+        scores[~valid] = -np.inf
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :topk]
+        D = np.take_along_axis(scores, order, axis=1).astype(np.float32)
+        rows = np.where(np.isfinite(D), np.take_along_axis(rows, order, axis=1), -1)
+        return D, rows
+
+    def _centroid_search(self, state, query_embs, topk):
+        """
+        Search hai tầng: shortlist centroid_shortlist class có prototype gần query nhất, rồi tính
+        inner product chính xác với mọi ảnh của các class đó. Trả về (D, rows) dạng (N, topk),
+        rows là vị trí dòng trong store (-1 nếu không đủ kết quả).
+        """
+        shortlists = state.prototypes.shortlist(query_embs, self.centroid_shortlist)
+        D = np.full((len(query_embs), topk), -np.inf, dtype=np.float32)
+        rows_out = np.full((len(query_embs), topk), -1, dtype=np.int64)
+        for q, class_ids in enumerate(shortlists):
+            rows = np.concatenate([state.class_rows(c) for c in class_ids]) if len(class_ids) else \
+                np.empty(0, dtype=np.int64)
+            if len(rows) == 0:
+                continue
+            scores = state.store.embeddings_float32(rows) @ query_embs[q]
+            k = min(topk, len(rows))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best], kind='stable')]
+            D[q, :k] = scores[best]
+            rows_out[q, :k] = rows[best]
+        return D, rows_out
+
     def print_example_vectors(self, n=5):
         print('Ví dụ một số vector trong FAISS index:')
-        for i in range(min(n, len(self.image_paths))):
-            vec = self.index.reconstruct(i)
-            image_id = self.image_ids[i] if i < len(self.image_ids) else None
-            image_path = self.image_paths[i]
-            class_id = self.class_ids[i]
+        state = self._state
+        for i, r in enumerate(state.live_rows()[:n]):
+            row = state.store.row(r)
+            image_id = row['image_id']
+            vec = state.store.embeddings_float32([r])[0]
+            image_path = row['image_path']
+            class_id = row['class_id']
             norm = np.linalg.norm(vec)
             print(f'Vector {i}:')
             print(f'  image_id: {image_id}')
@@ -221,37 +1630,86 @@ class FaissIndexManager:
             print(f'  class_id: {class_id}')
             # print(f'  norm: {norm:.4f}')
             print(f'  values[:10]: {vec[:10]} ...')
+    # Số dòng embeddings xử lý mỗi lần khi tính thống kê (giới hạn bộ nhớ tạm với store mmap/float16)
+    HEALTH_CHUNK = 65536
+
     def check_index_data(self):
+        """
+        Thống kê sức khỏe gallery (số lượng, id trùng, vector NaN, min/max, norm), tính vector hóa trên
+        ma trận embeddings của store. Kết quả được cache theo phiên bản đã publish: mỗi thay đổi publish
+        phiên bản mới nên cache tự mất hiệu lực, các lần gọi sau chỉ trả về bản copy.
+        """
+        state = self._state
+        health = state._health
+        if health is None:
+            health = self._compute_health(state)
+            state._health = health
+        return dict(health)
+
+    def _compute_health(self, state):
+        store, index = state.live_store(), state.index
+        n = len(store)
+        num_unique_image_ids = len(np.unique(store.image_ids))
+        # vector search được: index bỏ vector đã xóa, cộng các dòng chưa vào index
+        num_vectors = index.ntotal - state.base_dead_count + len(state.delta_rows())
         result = {
-            'num_vectors': self.index.ntotal,
-            'num_image_ids': len(self.image_ids),
-            'num_image_paths': len(self.image_paths),
-            'num_class_ids': len(self.class_ids),
-            'num_embeddings': len(self.embeddings),
-            'num_unique_image_ids': len(set(self.image_ids)),
-            'num_unique_image_paths': len(set(self.image_paths)),
-            'num_unique_class_ids': len(set(self.class_ids)),
+            'index_type': state.active_index_type,
+            'configured_index_type': self.index_type,
+            'num_vectors': num_vectors,
+            'num_image_ids': n,
+            'num_image_paths': len(store.image_paths),
+            'num_class_ids': len(store.class_ids),
+            'num_embeddings': len(store.embeddings),
+            'num_unique_image_ids': num_unique_image_ids,
+            'num_duplicate_image_ids': n - num_unique_image_ids,
+            'num_unique_image_paths': len(pd.unique(np.asarray(store.image_paths, dtype=object))),
+            'num_unique_class_ids': len(np.unique(store.class_ids)),
+            'index_in_sync': num_vectors == n,
+            'num_pending_vectors': len(state.delta_rows()),
+            'num_deleted_vectors_in_index': state.base_dead_count,
+            'embedding_dtype': str(store.dtype),
+            'metadata_bytes': store.nbytes,
         }
-        # Kiểm tra vector NaN và min/max
-        if self.index.ntotal > 0:
-            vecs = np.zeros((self.index.ntotal, self.embedding_size), dtype=np.float32)
-            for i in range(self.index.ntotal):
-                vecs[i] = self.index.reconstruct(i)
-            result['num_nan_vectors'] = int(np.isnan(vecs).any(axis=1).sum())
-            result['min_vector_value'] = float(vecs.min())
-            result['max_vector_value'] = float(vecs.max())
-        else:
-            result['num_nan_vectors'] = 0
-            result['min_vector_value'] = None
-            result['max_vector_value'] = None
+        if n == 0:
+            result.update({'num_nan_vectors': 0, 'min_vector_value': None, 'max_vector_value': None,
+                           'min_norm': None, 'max_norm': None, 'mean_norm': None, 'num_unnormalized_vectors': 0})
+            return result
+        # Kiểm tra vector NaN, min/max và norm theo từng khối dòng
+        num_nan = num_unnormalized = 0
+        vmin, vmax = np.inf, -np.inf
+        nmin, nmax, nsum = np.inf, -np.inf, 0.0
+        embeddings = store.embeddings
+        for start in range(0, n, self.HEALTH_CHUNK):
+            chunk = np.asarray(embeddings[start:start + self.HEALTH_CHUNK], dtype=np.float32)
+            nan_rows = np.isnan(chunk).any(axis=1)
+            num_nan += int(nan_rows.sum())
+            chunk = chunk[~nan_rows]
+            if len(chunk) == 0:
+                continue
+            norms = np.linalg.norm(chunk, axis=1)
+            vmin, vmax = min(vmin, float(chunk.min())), max(vmax, float(chunk.max()))
+            nmin, nmax, nsum = min(nmin, float(norms.min())), max(nmax, float(norms.max())), nsum + float(norms.sum())
+            # float16 làm lệch norm cỡ 1e-3
+            num_unnormalized += int((np.abs(norms - 1.0) > 1e-2).sum())
+        valid = n - num_nan
+        result.update({
+            'num_nan_vectors': num_nan,
+            'min_vector_value': vmin if valid else None,
+            'max_vector_value': vmax if valid else None,
+            'min_norm': nmin if valid else None,
+            'max_norm': nmax if valid else None,
+            'mean_norm': nsum / valid if valid else None,
+            'num_unnormalized_vectors': num_unnormalized,
+        })
         return result
+
     def get_image_ids_by_class(self, class_id):
         """
         Trả về danh sách image_id có class trùng với class_id được truy vấn
         """
-        class_id = str(class_id)
-        result = [str(img_id) for img_id, cls in zip(self.image_ids, self.class_ids) if str(cls) == class_id]
-        return result
+        state = self._state
+        rows = state.class_rows(class_id)
+        return [str(img_id) for img_id in state.store.image_ids[rows]]
 ## Module only: import and use FaissIndexManager from another file
 
 
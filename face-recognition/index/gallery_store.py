@@ -0,0 +1,229 @@
+import os
+
+import numpy as np
+
+
+# Tên các cột, mỗi cột lưu thành một file <tên>.npy
+COLUMNS = ('embeddings', 'image_ids', 'class_ids', 'image_paths')
+
+# deleted_at của dòng chưa bị xóa (lớn hơn mọi phiên bản)
+ALIVE = np.iinfo(np.int64).max
+
+
+def _load_column(path):
+    """Đọc một cột .npy dạng memory-map (chỉ-đọc); mảng rỗng không mmap được thì đọc thường."""
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        return np.load(path)
+
+
+class GalleryStore:
+    """
+    Metadata của gallery FAISS lưu theo cột:
+    - embeddings: ma trận (N, d) liên tục, float32 (hoặc float16 để tiết kiệm RAM)
+    - image_ids, class_ids: int64
+    - image_paths: object (chuỗi hoặc None)
+    Append tăng capacity theo cấp số nhân (amortized O(1)). Dòng đã ghi không bao giờ bị sửa hay di chuyển:
+    xóa chỉ đánh dấu dòng (tombstone) với phiên bản xóa trong cột deleted_at (không lưu ra đĩa), nên view()
+    chụp N dòng hiện tại với chi phí O(1) và không bị ảnh hưởng bởi các lần append/xóa sau đó.
+    Dòng đã xóa được bỏ hẳn khi tạo store mới bằng take(). Các thuộc tính trả về view chỉ-đọc trên N dòng
+    (kể cả dòng đã xóa).
+
+    Store đọc bằng from_directory() trỏ thẳng vào các file .npy qua mmap (nhiều process dùng chung
+    page cache); lần ghi đầu tiên mới copy các cột vào bộ nhớ riêng.
+    """
+
+    MIN_CAPACITY = 64
+
+    def __init__(self, embedding_size, dtype=np.float32):
+        self.embedding_size = embedding_size
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.dtype(np.float32), np.dtype(np.float16)):
+            raise ValueError(f"dtype embeddings phải là float32 hoặc float16, nhận được {self.dtype}")
+        self.clear()
+
+    def clear(self):
+        self._mapped = False
+        self._size = 0
+        self._embeddings = np.empty((0, self.embedding_size), dtype=self.dtype)
+        self._image_ids = np.empty(0, dtype=np.int64)
+        self._class_ids = np.empty(0, dtype=np.int64)
+        self._image_paths = np.empty(0, dtype=object)
+        # None: chưa có dòng nào bị xóa
+        self._deleted_at = None
+
+    @classmethod
+    def from_arrays(cls, embeddings, image_ids, image_paths, class_ids, dtype=np.float32):
+        store = cls(np.asarray(embeddings).shape[1], dtype=dtype)
+        store.append(embeddings, image_ids, image_paths, class_ids)
+        return store
+
+    @classmethod
+    def from_directory(cls, directory, dtype=np.float32):
+        """Mở store đã lưu bằng save(): O(1), không đọc dữ liệu cho tới khi được truy cập."""
+        cols = {name: _load_column(os.path.join(directory, f'{name}.npy')) for name in COLUMNS}
+        embeddings = cols['embeddings']
+        store = cls(embeddings.shape[1], dtype=dtype)
+        if embeddings.dtype != store.dtype:
+            embeddings = embeddings.astype(store.dtype)
+        store._embeddings = embeddings
+        store._image_ids = cols['image_ids']
+        store._class_ids = cols['class_ids']
+        store._image_paths = cols['image_paths']
+        store._size = len(store._image_ids)
+        store._mapped = True
+        return store
+
+    def save(self, directory):
+        """
+        Ghi mỗi cột ra một file .npy (image_paths lưu dạng chuỗi cố định, None -> '').
+        Ghi vào file tạm rồi os.replace để không làm hỏng các mmap đang mở trên file cũ.
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = np.array(['' if p is None else str(p) for p in self.image_paths], dtype=str)
+        cols = {
+            'embeddings': self.embeddings,
+            'image_ids': self.image_ids,
+            'class_ids': self.class_ids,
+            'image_paths': paths,
+        }
+        for name, col in cols.items():
+            path = os.path.join(directory, f'{name}.npy')
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.ascontiguousarray(col))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+    def view(self):
+        """
+        Ảnh chụp O(1) của N dòng hiện tại, dùng chung mảng với store này: append sau đó ghi vào sau dòng N
+        (hoặc sang mảng mới khi tăng capacity), xóa sau đó mang phiên bản lớn hơn phiên bản của người đọc.
+        """
+        view = object.__new__(GalleryStore)
+        view.__dict__.update(self.__dict__)
+        return view
+
+    def take(self, rows):
+        """Store mới trong bộ nhớ chỉ gồm các dòng rows (theo thứ tự), không còn tombstone."""
+        rows = np.asarray(rows, dtype=np.int64)
+        return GalleryStore.from_arrays(self._embeddings[rows], self._image_ids[rows],
+                                        list(self._image_paths[rows]), self._class_ids[rows], dtype=self.dtype)
+
+    def _materialize(self):
+        """Copy các cột đang mmap vào bộ nhớ riêng trước khi sửa."""
+        if not self._mapped:
+            return
+        self._embeddings = np.array(self._embeddings[:self._size])
+        self._image_ids = np.array(self._image_ids[:self._size])
+        self._class_ids = np.array(self._class_ids[:self._size])
+        paths = np.asarray(self._image_paths[:self._size]).astype(object)
+        paths[paths == ''] = None
+        self._image_paths = paths
+        self._mapped = False
+
+    @property
+    def mapped(self):
+        return self._mapped
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _readonly(view):
+        view.flags.writeable = False
+        return view
+
+    @property
+    def embeddings(self):
+        return self._readonly(self._embeddings[:self._size])
+
+    @property
+    def image_ids(self):
+        return self._readonly(self._image_ids[:self._size])
+
+    @property
+    def class_ids(self):
+        return self._readonly(self._class_ids[:self._size])
+
+    @property
+    def image_paths(self):
+        return self._readonly(self._image_paths[:self._size])
+
+    @property
+    def nbytes(self):
+        return int(self._embeddings.nbytes + self._image_ids.nbytes + self._class_ids.nbytes + self._image_paths.nbytes)
+
+    def _reserve(self, n):
+        capacity = len(self._image_ids)
+        if n <= capacity:
+            return
+        new_capacity = max(n, 2 * capacity, self.MIN_CAPACITY)
+
+        def grow(col, shape):
+            new_col = np.empty(shape, dtype=col.dtype)
+            new_col[:self._size] = col[:self._size]
+            return new_col
+
+        self._embeddings = grow(self._embeddings, (new_capacity, self.embedding_size))
+        self._image_ids = grow(self._image_ids, new_capacity)
+        self._class_ids = grow(self._class_ids, new_capacity)
+        self._image_paths = grow(self._image_paths, new_capacity)
+        if self._deleted_at is not None:
+            self._deleted_at = grow(self._deleted_at, new_capacity)
+            self._deleted_at[self._size:] = ALIVE
+
+    def append(self, embeddings, image_ids, image_paths, class_ids):
+        """Thêm các dòng vào cuối store, trả về vị trí dòng đầu tiên vừa thêm."""
+        self._materialize()
+        embeddings = np.asarray(embeddings).reshape(-1, self.embedding_size)
+        n = len(embeddings)
+        if not (len(image_ids) == len(image_paths) == len(class_ids) == n):
+            raise ValueError('Số lượng embeddings, image_ids, image_paths, class_ids không khớp')
+        start = self._size
+        self._reserve(start + n)
+        end = start + n
+        self._embeddings[start:end] = embeddings
+        self._image_ids[start:end] = image_ids
+        self._class_ids[start:end] = class_ids
+        self._image_paths[start:end] = list(image_paths)
+        self._size = end
+        return start
+
+    def kill(self, rows, version):
+        """Đánh dấu các dòng bị xóa từ phiên bản version (view có phiên bản nhỏ hơn vẫn thấy các dòng này)."""
+        if self._deleted_at is None:
+            deleted_at = np.empty(len(self._image_ids), dtype=np.int64)
+            deleted_at.fill(ALIVE)
+            self._deleted_at = deleted_at
+        self._deleted_at[np.asarray(rows, dtype=np.int64)] = version
+
+    def alive(self, rows, version):
+        """Mask các dòng (trong N dòng) chưa bị xóa ở phiên bản version."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if self._deleted_at is None:
+            return np.ones(rows.shape, dtype=bool)
+        return self._deleted_at[rows] > version
+
+    def live_rows(self, version, start=0):
+        """Vị trí các dòng trong [start, N) chưa bị xóa ở phiên bản version."""
+        if self._deleted_at is None:
+            return np.arange(start, self._size, dtype=np.int64)
+        return start + np.flatnonzero(self._deleted_at[start:self._size] > version)
+
+    def row(self, row):
+        image_path = self._image_paths[row]
+        return {
+            'image_id': int(self._image_ids[row]),
+            # store mmap lưu image_path rỗng là ''
+            'image_path': None if image_path is None or image_path == '' else str(image_path),
+            'class_id': int(self._class_ids[row]),
+            'faiss_index': int(row),
+        }
+
+    def embeddings_float32(self, rows=None):
+        """Embeddings dạng float32 liên tục (để đưa vào FAISS), toàn bộ hoặc theo danh sách dòng."""
+        emb = self.embeddings if rows is None else self._embeddings[np.asarray(rows, dtype=np.int64)]
+        return np.ascontiguousarray(emb, dtype=np.float32)
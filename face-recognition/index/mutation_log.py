@@ -0,0 +1,240 @@
+"""
+Write-ahead log cho các thay đổi của gallery FAISS.
+
+Mỗi thay đổi (add / delete / update) được ghi thành một record nhỏ vào cuối file và fsync trước khi
+trả về, nên chi phí một lần ghi không phụ thuộc kích thước gallery. Khi load, snapshot trên đĩa
+được phát lại cùng các record trong log; định kỳ log được gộp vào một snapshot mới (compaction,
+xem index/snapshot.py: mỗi generation snapshot có một file log riêng).
+
+Định dạng record: <độ dài payload: uint32><crc32 payload: uint32><payload>, payload bắt đầu bằng
+1 byte mã thao tác. Record cuối bị ghi dở (crash giữa chừng) được bỏ qua và cắt khỏi file.
+"""
+import os
+import struct
+import zlib
+
+import numpy as np
+
+
+OP_ADD = 1
+OP_DELETE_IMAGE = 2
+OP_DELETE_CLASS = 3
+OP_UPDATE_EMBEDDING = 4
+OP_UPDATE_PATH = 5
+OP_RESET = 6
+
+_FRAME = struct.Struct('<II')
+_OP_ID = struct.Struct('<Bq')
+_OP_ID_CLASS = struct.Struct('<Bqq')
+_OP = struct.Struct('<B')
+_PATH_LEN = struct.Struct('<I')
+_NO_PATH = 0xFFFFFFFF
+
+
+def _encode_path(image_path):
+    if image_path is None:
+        return _PATH_LEN.pack(_NO_PATH)
+    data = str(image_path).encode('utf-8')
+    return _PATH_LEN.pack(len(data)) + data
+
+
+def _decode_path(payload, offset):
+    (n,) = _PATH_LEN.unpack_from(payload, offset)
+    offset += _PATH_LEN.size
+    if n == _NO_PATH:
+        return None, offset
+    return payload[offset:offset + n].decode('utf-8'), offset + n
+
+
+def _fsync_dir(directory):
+    """fsync thư mục để việc tạo/đổi tên file cũng bền vững (bỏ qua trên hệ điều hành không hỗ trợ)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class MutationLog:
+    """
+    File log append-only. append() ghi một nhóm record bằng một lần write + fsync; read() trả về
+    các record đã ghi, read_from() đọc phần log mới từ một offset (process khác đang ghi). Record là tuple:
+    - ('add', image_id, class_id, image_path, embedding)
+    - ('delete_image', image_id)
+    - ('delete_class', class_id)
+    - ('update_embedding', image_id, embedding)
+    - ('update_path', image_id, image_path)
+    - ('reset',)
+    """
+
+    def __init__(self, path, embedding_size):
+        self.path = path
+        self.embedding_size = embedding_size
+        self._file = None
+
+    # ----- encode -----
+
+    def _encode_embedding(self, embedding):
+        return np.ascontiguousarray(embedding, dtype='<f4').reshape(self.embedding_size).tobytes()
+
+    def encode_add(self, image_id, class_id, image_path, embedding):
+        return _OP_ID_CLASS.pack(OP_ADD, int(image_id), int(class_id)) + _encode_path(image_path) + \
+            self._encode_embedding(embedding)
+
+    @staticmethod
+    def encode_delete_image(image_id):
+        return _OP_ID.pack(OP_DELETE_IMAGE, int(image_id))
+
+    @staticmethod
+    def encode_delete_class(class_id):
+        return _OP_ID.pack(OP_DELETE_CLASS, int(class_id))
+
+    def encode_update_embedding(self, image_id, embedding):
+        return _OP_ID.pack(OP_UPDATE_EMBEDDING, int(image_id)) + self._encode_embedding(embedding)
+
+    @staticmethod
+    def encode_update_path(image_id, image_path):
+        return _OP_ID.pack(OP_UPDATE_PATH, int(image_id)) + _encode_path(image_path)
+
+    def encode(self, record):
+        op = record[0]
+        if op == 'add':
+            return self.encode_add(*record[1:])
+        if op == 'delete_image':
+            return self.encode_delete_image(record[1])
+        if op == 'delete_class':
+            return self.encode_delete_class(record[1])
+        if op == 'update_embedding':
+            return self.encode_update_embedding(*record[1:])
+        if op == 'update_path':
+            return self.encode_update_path(*record[1:])
+        if op == 'reset':
+            return _OP.pack(OP_RESET)
+        raise ValueError(f'Thao tác không hợp lệ: {op!r}')
+
+    def _decode(self, payload):
+        op = payload[0]
+        emb_bytes = 4 * self.embedding_size
+        if op == OP_RESET:
+            return ('reset',)
+        if op == OP_ADD:
+            _, image_id, class_id = _OP_ID_CLASS.unpack_from(payload, 0)
+            image_path, offset = _decode_path(payload, _OP_ID_CLASS.size)
+            embedding = np.frombuffer(payload, dtype='<f4', count=self.embedding_size, offset=offset)
+            return ('add', image_id, class_id, image_path, embedding.astype(np.float32))
+        _, key = _OP_ID.unpack_from(payload, 0)
+        if op == OP_DELETE_IMAGE:
+            return ('delete_image', key)
+        if op == OP_DELETE_CLASS:
+            return ('delete_class', key)
+        if op == OP_UPDATE_EMBEDDING:
+            if len(payload) != _OP_ID.size + emb_bytes:
+                raise ValueError('record update_embedding sai kích thước')
+            embedding = np.frombuffer(payload, dtype='<f4', count=self.embedding_size, offset=_OP_ID.size)
+            return ('update_embedding', key, embedding.astype(np.float32))
+        if op == OP_UPDATE_PATH:
+            image_path, _ = _decode_path(payload, _OP_ID.size)
+            return ('update_path', key, image_path)
+        raise ValueError(f'Mã thao tác không hợp lệ trong mutation log: {op}')
+
+    # ----- ghi / đọc file -----
+
+    def _open(self):
+        if self._file is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            created = not os.path.exists(self.path)
+            self._file = open(self.path, 'ab')
+            if created:
+                _fsync_dir(directory)
+        return self._file
+
+    def append(self, records):
+        """Ghi các record (một lần write + fsync), trả về kích thước log sau khi ghi."""
+        payloads = [self.encode(r) for r in records]
+        buf = b''.join(_FRAME.pack(len(p), zlib.crc32(p)) + p for p in payloads)
+        f = self._open()
+        f.write(buf)
+        f.flush()
+        os.fsync(f.fileno())
+        # fstat thay vì tell(): process khác có thể đã ghi thêm vào cùng file (index/shared_gallery.py)
+        return os.fstat(f.fileno()).st_size
+
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def switch(self, path):
+        """Chuyển sang ghi file log khác (log của generation snapshot mới)."""
+        self.close()
+        self.path = path
+
+    def truncate(self, size):
+        """Cắt log về `size` byte (bỏ phần đuôi ghi dở của process khác đã chết, xem index/shared_gallery.py)."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) <= size:
+            return
+        self.close()
+        with open(self.path, 'r+b') as f:
+            f.truncate(size)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _parse(self, data):
+        """Decode các record hợp lệ liên tiếp từ đầu data, trả về (records, số byte hợp lệ)."""
+        records = []
+        offset = 0
+        while offset + _FRAME.size <= len(data):
+            length, crc = _FRAME.unpack_from(data, offset)
+            start = offset + _FRAME.size
+            payload = data[start:start + length]
+            if len(payload) != length or length == 0 or zlib.crc32(payload) != crc:
+                break
+            try:
+                records.append(self._decode(payload))
+            except (ValueError, struct.error, UnicodeDecodeError):
+                break
+            offset = start + length
+        return records, offset
+
+    def read(self, path=None):
+        """
+        Đọc các record hợp lệ của log (mặc định self.path). Phần đuôi hỏng (record ghi dở
+        hoặc sai checksum) bị bỏ qua và cắt khỏi file.
+        """
+        path = path or self.path
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as f:
+            data = f.read()
+        records, offset = self._parse(data)
+        if offset < len(data):
+            print(f'Mutation log {path}: bỏ {len(data) - offset} byte cuối bị hỏng')
+            if path == self.path:
+                self.close()
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+                f.flush()
+                os.fsync(f.fileno())
+        return records
+
+    def read_from(self, path, start=0, end=None):
+        """
+        Đọc các record trong đoạn [start, end) của log (end=None: tới cuối file) mà không sửa file,
+        dùng khi process khác đang ghi log này. Trả về (records, offset ngay sau record cuối đọc được).
+        """
+        if not os.path.exists(path):
+            return [], start
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read() if end is None else f.read(max(0, end - start))
+        records, offset = self._parse(data)
+        return records, start + offset
@@ -0,0 +1,104 @@
+import numpy as np
+
+
+class ClassPrototypes:
+    """
+    Prototype của từng class: trung bình các embedding của class (lưu tổng float64 + số ảnh),
+    dùng làm tầng lọc đầu của search hai tầng (shortlist class rồi re-rank chính xác ảnh của các class đó).
+    Cập nhật tăng dần khi add/delete/update, chi phí O(số ảnh thay đổi) (+ O(số class) khi một class bị xóa hết).
+    """
+
+    # Số dòng cộng dồn mỗi lần khi dựng từ store (giới hạn bộ nhớ tạm float64)
+    BUILD_CHUNK = 65536
+
+    def __init__(self, embedding_size):
+        self.embedding_size = embedding_size
+        self.class_ids = np.empty(0, dtype=np.int64)
+        self._sums = np.empty((0, embedding_size), dtype=np.float64)
+        self._counts = np.empty(0, dtype=np.int64)
+        self._pos = {}
+        self._matrix = None
+
+    @classmethod
+    def from_store(cls, store):
+        """Dựng prototype cho toàn bộ gallery từ GalleryStore."""
+        protos = cls(store.embedding_size)
+        if len(store) == 0:
+            return protos
+        class_ids, inverse, counts = np.unique(store.class_ids, return_inverse=True, return_counts=True)
+        sums = np.zeros((len(class_ids), store.embedding_size), dtype=np.float64)
+        embeddings = store.embeddings
+        for start in range(0, len(store), cls.BUILD_CHUNK):
+            stop = start + cls.BUILD_CHUNK
+            np.add.at(sums, inverse[start:stop], embeddings[start:stop].astype(np.float64))
+        protos.class_ids = class_ids.astype(np.int64)
+        protos._sums = sums
+        protos._counts = counts.astype(np.int64)
+        protos._pos = {int(c): i for i, c in enumerate(protos.class_ids)}
+        return protos
+
+    def copy(self):
+        protos = ClassPrototypes(self.embedding_size)
+        protos.class_ids = self.class_ids.copy()
+        protos._sums = self._sums.copy()
+        protos._counts = self._counts.copy()
+        protos._pos = dict(self._pos)
+        protos._matrix = self._matrix
+        return protos
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    def _positions(self, class_ids, create=False):
+        new = [int(c) for c in dict.fromkeys(int(c) for c in class_ids) if int(c) not in self._pos]
+        if new and create:
+            start = len(self.class_ids)
+            self.class_ids = np.concatenate([self.class_ids, np.asarray(new, dtype=np.int64)])
+            self._sums = np.concatenate([self._sums, np.zeros((len(new), self.embedding_size))])
+            self._counts = np.concatenate([self._counts, np.zeros(len(new), dtype=np.int64)])
+            for offset, class_id in enumerate(new):
+                self._pos[class_id] = start + offset
+        return np.array([self._pos[int(c)] for c in class_ids], dtype=np.int64)
+
+    def add(self, class_ids, embeddings):
+        if len(class_ids) == 0:
+            return
+        pos = self._positions(class_ids, create=True)
+        np.add.at(self._sums, pos, np.asarray(embeddings, dtype=np.float64).reshape(-1, self.embedding_size))
+        np.add.at(self._counts, pos, 1)
+        self._matrix = None
+
+    def remove(self, class_ids, embeddings):
+        if len(class_ids) == 0:
+            return
+        pos = self._positions(class_ids)
+        np.subtract.at(self._sums, pos, np.asarray(embeddings, dtype=np.float64).reshape(-1, self.embedding_size))
+        np.subtract.at(self._counts, pos, 1)
+        if (self._counts[pos] <= 0).any():
+            # Class không còn ảnh: bỏ khỏi prototype
+            keep = self._counts > 0
+            self.class_ids = self.class_ids[keep]
+            self._sums = self._sums[keep]
+            self._counts = self._counts[keep]
+            self._pos = {int(c): i for i, c in enumerate(self.class_ids)}
+        self._matrix = None
+
+    def matrix(self):
+        """Ma trận prototype (C, d) float32 đã L2-normalize, cùng thứ tự với class_ids."""
+        matrix = self._matrix
+        if matrix is None:
+            norms = np.linalg.norm(self._sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = np.ascontiguousarray(self._sums / norms, dtype=np.float32)
+            self._matrix = matrix
+        return matrix
+
+    def shortlist(self, query_embs, n):
+        """class_id của n prototype gần nhất với mỗi query (ma trận (N, n), không sắp xếp)."""
+        n = min(n, len(self.class_ids))
+        sims = np.asarray(query_embs, dtype=np.float32) @ self.matrix().T
+        if n < sims.shape[1]:
+            top = np.argpartition(-sims, n - 1, axis=1)[:, :n]
+        else:
+            top = np.broadcast_to(np.arange(sims.shape[1]), sims.shape)
+        return self.class_ids[top]
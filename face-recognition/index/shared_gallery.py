@@ -0,0 +1,118 @@
+"""
+Dùng chung một gallery FAISS giữa nhiều process (vd. uvicorn --workers N, hoặc nhiều replica cùng ghi
+vào store_dir trên một volume dùng chung hỗ trợ flock).
+
+Dữ liệu không bị copy theo số worker: generation snapshot (index.faiss + các cột .npy, xem
+index/snapshot.py) được mọi process load bằng mmap nên nằm một lần trong page cache của hệ điều hành.
+File này chỉ lo phần phối hợp, qua vài file nhỏ trong store_dir:
+
+    version.bin   bộ đếm phiên bản (mmap, mọi process cùng thấy): seq, generation snapshot mới nhất,
+                  wal generation đang ghi và số byte đã commit trong wal đó
+    write.lock    lock ghi liên process (flock): mỗi thời điểm chỉ một process ghi mutation log
+    owner.lock    process giữ lock này là owner, chịu trách nhiệm ghi generation snapshot (compaction)
+
+Worker ghi (add/delete/...) giữ write.lock, bắt kịp các thay đổi của process khác, ghi record vào
+mutation log dùng chung rồi tăng bộ đếm. Các process khác thấy seq đổi thì đọc phần log mới, hoặc
+load generation mới bằng mmap khi owner vừa ghi snapshot (trả lại bộ nhớ riêng về page cache dùng chung).
+Số generation và wal chỉ được cấp dưới write.lock nên hai process không bao giờ ghi cùng một wal-K/gen-K
+theo cách riêng, và không process nào load generation mới mà bỏ qua record chưa vào snapshot.
+"""
+import os
+import mmap
+import struct
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: không hỗ trợ chế độ nhiều process
+    fcntl = None
+
+
+VERSION_FILE = 'version.bin'
+WRITE_LOCK_FILE = 'write.lock'
+OWNER_LOCK_FILE = 'owner.lock'
+
+# seq, generation, wal_generation, wal_offset
+_VERSION = struct.Struct('<QQQQ')
+_SEQ = struct.Struct('<Q')
+
+
+class GalleryCoordinator:
+    """
+    Bộ đếm phiên bản + lock liên process cho một store_dir.
+    Bộ đếm dùng seqlock: writer tăng seq thành số lẻ, ghi các trường rồi tăng tiếp thành số chẵn;
+    reader đọc lại nếu seq lẻ hoặc đổi giữa chừng, nên không cần lock để đọc.
+    """
+
+    def __init__(self, root):
+        if fcntl is None:
+            raise RuntimeError('Chế độ nhiều process của gallery FAISS cần fcntl (Linux/macOS)')
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        fd = os.open(os.path.join(root, VERSION_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < _VERSION.size:
+                os.ftruncate(fd, _VERSION.size)
+            self._version = mmap.mmap(fd, _VERSION.size)
+        finally:
+            os.close(fd)
+        self._write_fd = os.open(os.path.join(root, WRITE_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        self._owner_fd = None
+        # flock thuộc về file descriptor (dùng chung giữa các thread), nên các thread trong cùng
+        # process loại trừ nhau bằng RLock; flock chỉ lấy ở lần vào ngoài cùng
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+
+    def read(self):
+        """(seq, generation, wal_generation, wal_offset) hiện tại; seq == 0 khi chưa process nào khởi tạo."""
+        while True:
+            values = _VERSION.unpack_from(self._version, 0)
+            (seq,) = _SEQ.unpack_from(self._version, 0)
+            if values[0] % 2 == 0 and values[0] == seq:
+                return values
+
+    def update(self, generation=None, wal_generation=None, wal_offset=None):
+        """Ghi các trường được truyền vào (None = giữ nguyên) và tăng seq (caller giữ write_lock), trả về seq mới."""
+        seq, cur_generation, cur_wal_generation, cur_wal_offset = self.read()
+        generation = cur_generation if generation is None else generation
+        wal_generation = cur_wal_generation if wal_generation is None else wal_generation
+        wal_offset = cur_wal_offset if wal_offset is None else wal_offset
+        _SEQ.pack_into(self._version, 0, seq + 1)
+        _VERSION.pack_into(self._version, 0, seq + 1, generation, wal_generation, wal_offset)
+        _SEQ.pack_into(self._version, 0, seq + 2)
+        return seq + 2
+
+    @contextlib.contextmanager
+    def write_lock(self):
+        """Lock ghi liên process (gọi lồng nhau được trong cùng thread)."""
+        with self._thread_lock:
+            if self._depth == 0:
+                fcntl.flock(self._write_fd, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._write_fd, fcntl.LOCK_UN)
+
+    def try_become_owner(self):
+        """
+        True nếu process này là owner. Lock được giữ tới khi process kết thúc, nên khi owner chết
+        một process khác sẽ nhận vai trò này ở lần gọi sau.
+        """
+        if self._owner_fd is not None:
+            return True
+        fd = os.open(os.path.join(self.root, OWNER_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._owner_fd = fd
+        return True
+
+    @property
+    def is_owner(self):
+        return self._owner_fd is not None
@@ -0,0 +1,177 @@
+"""
+Snapshot gallery FAISS theo generation.
+
+Thư mục gốc (store_dir) có dạng:
+    gen-000007/            snapshot đầy đủ: index.faiss, các cột .npy, manifest.json
+    gen-000008/
+    wal-000008.log         mutation log ghi sau snapshot 8 (replay khi load gen 8 hoặc cũ hơn)
+    wal-000009.log         ...
+
+Mỗi generation được ghi vào thư mục tạm gen-XXXXXX.tmp, fsync rồi os.rename sang tên chính thức,
+nên một thư mục gen-XXXXXX luôn là snapshot hoàn chỉnh. manifest.json lưu kích thước và crc32 của
+từng file để load phát hiện snapshot hỏng và lùi về generation trước.
+"""
+import os
+import re
+import json
+import time
+import shutil
+import zlib
+
+import numpy as np
+
+
+INDEX_FILE = 'index.faiss'
+MANIFEST_FILE = 'manifest.json'
+
+_GEN_RE = re.compile(r'^gen-(\d{6,})$')
+_WAL_RE = re.compile(r'^wal-(\d{6,})\.log$')
+
+
+def generation_path(root, generation):
+    return os.path.join(root, f'gen-{generation:06d}')
+
+
+def wal_path(root, generation):
+    return os.path.join(root, f'wal-{generation:06d}.log')
+
+
+def _list_numbered(root, pattern):
+    if not os.path.isdir(root):
+        return []
+    numbers = []
+    for name in os.listdir(root):
+        match = pattern.match(name)
+        if match:
+            numbers.append(int(match.group(1)))
+    return sorted(numbers)
+
+
+def list_generations(root):
+    return [g for g in _list_numbered(root, _GEN_RE) if os.path.isdir(generation_path(root, g))]
+
+
+def list_wal_generations(root):
+    return _list_numbered(root, _WAL_RE)
+
+
+def _fsync_path(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _file_crc32(path, chunk_size=4 * 1024 * 1024):
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return crc
+            crc = zlib.crc32(chunk, crc)
+
+
+def write_generation(root, generation, store, index_bytes, info=None):
+    """
+    Ghi snapshot (GalleryStore + index FAISS đã serialize) thành generation mới, trả về đường dẫn.
+    info: các trường bổ sung cho manifest (index_type, ...).
+    """
+    final_dir = generation_path(root, generation)
+    tmp_dir = final_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    store.save(tmp_dir)
+    with open(os.path.join(tmp_dir, INDEX_FILE), 'wb') as f:
+        f.write(np.asarray(index_bytes, dtype=np.uint8).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+    files = {}
+    for name in sorted(os.listdir(tmp_dir)):
+        path = os.path.join(tmp_dir, name)
+        files[name] = {'size': os.path.getsize(path), 'crc32': _file_crc32(path)}
+    manifest = dict(info or {})
+    manifest.update({
+        'generation': generation,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'num_vectors': len(store),
+        'embedding_size': store.embedding_size,
+        'embedding_dtype': str(store.dtype),
+        'files': files,
+    })
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    _fsync_path(tmp_dir)
+
+    os.rename(tmp_dir, final_dir)
+    _fsync_path(root)
+    return final_dir
+
+
+def read_manifest(root, generation, verify_checksums=False):
+    """
+    Manifest của generation nếu snapshot hợp lệ (đủ file, đúng kích thước, và đúng crc32 nếu
+    verify_checksums), ngược lại None. Kiểm tra kích thước là O(số file); crc32 phải đọc toàn bộ dữ liệu.
+    """
+    gen_dir = generation_path(root, generation)
+    try:
+        with open(os.path.join(gen_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('generation') != generation:
+            return None
+        for name, expected in manifest['files'].items():
+            path = os.path.join(gen_dir, name)
+            if os.path.getsize(path) != expected['size']:
+                return None
+            if verify_checksums and _file_crc32(path) != expected['crc32']:
+                return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return manifest
+
+
+def latest_valid_generation(root, verify_checksums=False):
+    """(generation, manifest) mới nhất hợp lệ, bỏ qua các snapshot hỏng; (None, None) nếu không có."""
+    for generation in reversed(list_generations(root)):
+        manifest = read_manifest(root, generation, verify_checksums)
+        if manifest is not None:
+            return generation, manifest
+        print(f'Snapshot FAISS {generation_path(root, generation)} không hợp lệ, bỏ qua')
+    return None, None
+
+
+def prune(root, keep=2):
+    """
+    Giữ lại `keep` generation mới nhất; xóa generation cũ hơn, thư mục tạm còn sót
+    và mutation log không còn cần để replay từ generation cũ nhất được giữ lại.
+    """
+    generations = list_generations(root)
+    kept = generations[-max(1, keep):]
+    if not kept:
+        return
+    oldest_kept = kept[0]
+    for generation in generations:
+        if generation < oldest_kept:
+            shutil.rmtree(generation_path(root, generation), ignore_errors=True)
+    for generation in list_wal_generations(root):
+        if generation < oldest_kept:
+            try:
+                os.remove(wal_path(root, generation))
+            except OSError:
+                pass
+    for name in os.listdir(root):
+        if name.startswith('gen-') and name.endswith('.tmp'):
+            match = _GEN_RE.match(name[:-len('.tmp')])
+            if match and int(match.group(1)) <= kept[-1]:
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
@@ -1,58 +1,318 @@
-import torch
+import os
+import sys
+import glob
+import threading
+import contextlib
 import numpy as np
 import cv2
-# from albumentations.pytorch import ToTensorV2  # Temporarily disabled
-# import albumentations as A  # Temporarily disabled
-import torchvision.transforms as transforms
-import sys
-# sys.path.append('/home/intern1/lab/face_recognition/casia-webface/insightface/recognition/arcface_torch')
-sys.path.append('E:/intern-bes/intern-2025-AI/face_api/insightface/recognition/arcface_torch')
-from backbones import get_model
+
+# Thư mục arcface_torch trong repo (chứa package backbones), chỉ cần khi load model bằng PyTorch
+ARCFACE_TORCH_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'insightface', 'recognition',
+                                                 'arcface_torch'))
+
+BACKENDS = ('torch', 'onnx')
+# Chế độ suy luận của backend 'torch' (xem ArcFaceFeatureExtractor)
+TORCH_MODES = ('auto', 'fp16', 'fp32', 'bf16', 'int8', 'torchscript')
+
+
+# (x / 255 - 0.5) / 0.5 = x / 127.5 - 1
+_SCALE = np.float32(1.0 / 127.5)
+
+
+def preprocess_into(img, out):
+    """
+    Ảnh BGR uint8 (H, W, 3) -> out (3, size, size) float32 chuẩn hóa về [-1, 1], ghi thẳng vào out:
+    cv2.resize (INTER_AREA khi thu nhỏ, gần với resize có antialias của PIL), rồi đổi BGR -> RGB,
+    HWC -> CHW, chia tỉ lệ và trừ trong cùng các phép ghi vào out (không tạo mảng trung gian nào khác).
+    img=None hoặc sai số kênh cho ra ảnh đen (toàn -1) như trước.
+    """
+    if img is None or img.ndim != 3 or img.shape[2] != 3:
+        out.fill(-1.0)
+        return out
+    height, width = out.shape[1:]
+    if img.shape[:2] != (height, width):
+        shrink = img.shape[0] > height or img.shape[1] > width
+        img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA if shrink else cv2.INTER_LINEAR)
+    for c in range(3):
+        # kênh c (RGB) của out là kênh 2 - c (BGR) của ảnh
+        np.multiply(img[:, :, 2 - c], _SCALE, out=out[c], dtype=np.float32)
+    np.subtract(out, np.float32(1.0), out=out)
+    return out
+
+
+def _get_model(*args, **kwargs):
+    if ARCFACE_TORCH_DIR not in sys.path:
+        sys.path.append(ARCFACE_TORCH_DIR)
+    from backbones import get_model
+    return get_model(*args, **kwargs)
+
+
+def bf16_supported():
+    """CPU có lệnh bfloat16 (AVX512-BF16 / AMX) để autocast bf16 nhanh hơn fp32 hay không."""
+    import torch
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        try:
+            with open('/proc/cpuinfo') as f:
+                flags = f.read()
+        except OSError:
+            return False
+        return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
 
 class ArcFaceFeatureExtractor:
+    """
+    Trích xuất embedding ArcFace với hai backend:
+    - 'torch': iresnet của arcface_torch chạy bằng PyTorch
+    - 'onnx': checkpoint được export sang ONNX một lần (cache cạnh file .pth, export lại khi checkpoint
+      mới hơn) rồi chạy bằng onnxruntime; không import torch nếu file ONNX đã có.
+      Không có onnxruntime hoặc export lỗi thì tự chuyển về 'torch'.
+
+    torch_mode chọn cách chạy backend 'torch':
+    - 'auto': 'fp16' trên GPU, 'fp32' trên CPU
+    - 'fp16': autocast fp16 của iresnet (chỉ có tác dụng trên GPU, trên CPU dùng 'fp32')
+    - 'fp32': fp32 với layout channels_last (conv của oneDNN nhanh hơn trên CPU)
+    - 'bf16': như 'fp32' nhưng chạy trong autocast bfloat16; CPU không hỗ trợ bf16 thì dùng 'fp32'
+    - 'int8': quantization static (calibrate bằng ảnh trong calibration_dir) hoặc dynamic (chỉ lớp fc)
+      khi không có calibration_dir; chỉ chạy trên CPU
+    - 'int8' và 'torchscript' (trace + freeze) được cache thành file TorchScript cạnh file .pth,
+      tạo lại khi checkpoint mới hơn (xóa file cache để calibrate lại)
+    Kiểm tra độ chính xác từng chế độ trước khi đổi: scripts/inference_mode_report.py
+    """
     # def __init__(self, model_path='model/ms1mv3_arcface_r18_fp16.pth', model_version='r18', device=None, img_size=112):
-    def __init__(self, model_path='model/ms1mv3_arcface_r18_fp16.pth', model_version='r18', device=None, img_size=112):
+    def __init__(self, model_path='model/ms1mv3_arcface_r18_fp16.pth', model_version='r18', device=None, img_size=112,
+                 max_batch_size=64, embedding_size=512, backend='torch', onnx_path=None, intra_op_threads=0,
+                 torch_mode='auto', calibration_dir=None, calibration_images=256):
+        if backend not in BACKENDS:
+            raise ValueError(f"backend phải là một trong {BACKENDS}, nhận được {backend!r}")
+        if torch_mode not in TORCH_MODES:
+            raise ValueError(f"torch_mode phải là một trong {TORCH_MODES}, nhận được {torch_mode!r}")
         self.model_path = model_path
         self.model_version = model_version
         self.img_size = img_size
-        # Tự động chọn GPU nếu có, không thì dùng CPU
-        if device is None:
-            import torch
-            self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        else:
-            self.device = device
-        self.model = self._load_model()
-        # Use torchvision transforms instead of albumentations
-        self.val_aug = transforms.Compose([
-            transforms.ToPILImage(),
-            transforms.Resize((self.img_size, self.img_size)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
-        ])
+        # extract_batch forward tối đa max_batch_size ảnh mỗi lần (giới hạn bộ nhớ activation)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.embedding_size = embedding_size
+        self.onnx_path = onnx_path or os.path.splitext(model_path)[0] + '.onnx'
+        # Số thread intra-op của onnxruntime (0 = onnxruntime tự chọn theo số core vật lý)
+        self.intra_op_threads = intra_op_threads
+        self.torch_mode = torch_mode
+        self.calibration_dir = calibration_dir
+        self.calibration_images = calibration_images
+        self._memory_format = None
+        self._autocast_dtype = None
+        self.model = None
+        self.session = None
+        self.device = device
+        # Buffer input (N, 3, H, W) dùng lại giữa các lần gọi, mỗi thread một buffer
+        self._local = threading.local()
+        if backend == 'onnx':
+            try:
+                self.session = self._load_onnx()
+            except Exception as e:
+                print(f"Không dùng được ONNX Runtime cho ArcFace ({e}), chuyển sang PyTorch")
+                backend = 'torch'
+        self.backend = backend
+        if backend == 'torch':
+            # Tự động chọn GPU nếu có, không thì dùng CPU
+            if device is None:
+                import torch
+                self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            self.model = self._load_model()
+
+    def _build_net(self, fp16=False, map_location='cpu'):
+        import torch
+        net = _get_model(self.model_version, fp16=fp16)
+        net.load_state_dict(torch.load(self.model_path, map_location=map_location))
+        net.eval()
+        return net
+
+    def _resolve_torch_mode(self):
+        mode = self.torch_mode
+        on_gpu = str(self.device).startswith('cuda')
+        if mode == 'auto':
+            return 'fp16' if on_gpu else 'fp32'
+        if mode == 'fp16' and not on_gpu:
+            print("ArcFace: fp16 chỉ có tác dụng trên GPU, dùng fp32 trên CPU")
+            return 'fp32'
+        if mode == 'bf16' and (on_gpu or not bf16_supported()):
+            print("ArcFace: CPU không hỗ trợ bf16 (hoặc đang chạy GPU), dùng fp32")
+            return 'fp32'
+        if mode == 'int8' and on_gpu:
+            print("ArcFace: int8 chỉ chạy trên CPU, chuyển sang CPU")
+            self.device = 'cpu'
+        return mode
 
     def _load_model(self):
-        model = get_model(self.model_version, fp16=True)
-        model.load_state_dict(torch.load(self.model_path, map_location=self.device))
-        model.eval()
-        model.to(self.device)
+        import torch
+        self.torch_mode = mode = self._resolve_torch_mode()
+        self._memory_format = torch.preserve_format
+        if mode in ('int8', 'torchscript'):
+            model = self._load_traced(mode)
+        else:
+            model = self._build_net(fp16=(mode == 'fp16'), map_location=self.device)
+            model.to(self.device)
+            if mode in ('fp32', 'bf16'):
+                model.to(memory_format=torch.channels_last)
+                self._memory_format = torch.channels_last
+            if mode == 'bf16':
+                self._autocast_dtype = torch.bfloat16
+        print(f"ArcFace PyTorch: mode={mode}, device={self.device}")
+        return model
+
+    # ----- TorchScript (int8 / torchscript) -----
+
+    def _traced_path(self, mode):
+        if mode == 'int8':
+            mode = 'int8' if self.calibration_dir else 'int8-dynamic'
+        return f'{os.path.splitext(self.model_path)[0]}.{mode}.pt'
+
+    def _load_traced(self, mode):
+        """Load module TorchScript đã cache, tạo lại (ghi file tạm rồi đổi tên) khi chưa có hoặc cũ hơn checkpoint."""
+        import torch
+        path = self._traced_path(mode)
+        if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(self.model_path):
+            net = self._quantize() if mode == 'int8' else self._build_net().to(memory_format=torch.channels_last)
+            example = torch.zeros(2, 3, self.img_size, self.img_size)
+            if mode == 'torchscript':
+                example = example.contiguous(memory_format=torch.channels_last)
+            with torch.no_grad():
+                traced = torch.jit.freeze(torch.jit.trace(net, example))
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            torch.jit.save(traced, tmp_path)
+            os.replace(tmp_path, path)
+            print(f"Đã lưu ArcFace {mode} (TorchScript): {path}")
+        model = torch.jit.load(path, map_location=self.device)
+        if mode == 'torchscript':
+            self._memory_format = torch.channels_last
+            if self.device == 'cpu':
+                model = torch.jit.optimize_for_inference(model)
         return model
 
-    @torch.no_grad()
+    def _quantize(self):
+        """Quantize int8: static (FX, qconfig x86) nếu có ảnh calibrate, không thì dynamic cho lớp fc."""
+        import torch
+        net = self._build_net()
+        if not self.calibration_dir:
+            print("ArcFace int8: không có ảnh calibrate, chỉ quantize động lớp fc")
+            return torch.ao.quantization.quantize_dynamic(net, {torch.nn.Linear}, dtype=torch.qint8)
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+        example = (torch.zeros(1, 3, self.img_size, self.img_size),)
+        prepared = prepare_fx(net, get_default_qconfig_mapping('x86'), example)
+        paths = sorted(p for ext in ('jpg', 'jpeg', 'png', 'bmp')
+                       for p in glob.glob(os.path.join(self.calibration_dir, '**', f'*.{ext}'), recursive=True))
+        paths = paths[:self.calibration_images]
+        if not paths:
+            raise ValueError(f"Không có ảnh calibrate trong {self.calibration_dir}")
+        batch = np.empty((self.max_batch_size, 3, self.img_size, self.img_size), dtype=np.float32)
+        with torch.no_grad():
+            for start in range(0, len(paths), self.max_batch_size):
+                chunk = paths[start:start + self.max_batch_size]
+                for i, path in enumerate(chunk):
+                    preprocess_into(cv2.imread(path), batch[i])
+                prepared(torch.from_numpy(batch[:len(chunk)]))
+        print(f"ArcFace int8: đã calibrate với {len(paths)} ảnh")
+        return convert_fx(prepared)
+
+    # ----- ONNX -----
+
+    def _export_onnx(self):
+        """Export checkpoint sang ONNX (batch động), ghi file tạm rồi đổi tên để các worker không đọc file dở."""
+        import torch
+        net = _get_model(self.model_version, dropout=0.0, fp16=False, num_features=self.embedding_size)
+        net.load_state_dict(torch.load(self.model_path, map_location='cpu'), strict=True)
+        net.eval()
+        dummy = torch.zeros(1, 3, self.img_size, self.img_size)
+        tmp_path = f'{self.onnx_path}.{os.getpid()}.tmp'
+        torch.onnx.export(net, dummy, tmp_path, input_names=['data'], output_names=['embedding'],
+                          dynamic_axes={'data': {0: 'batch'}, 'embedding': {0: 'batch'}},
+                          keep_initializers_as_inputs=False, opset_version=11)
+        os.replace(tmp_path, self.onnx_path)
+        print(f"Đã export ArcFace sang ONNX: {self.onnx_path}")
+
+    def _load_onnx(self):
+        import onnxruntime as ort
+        if not os.path.exists(self.onnx_path) or \
+           os.path.getmtime(self.onnx_path) < os.path.getmtime(self.model_path):
+            self._export_onnx()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = int(self.intra_op_threads)
+        # Các request đã được gom batch (service/inference_scheduler.py), song song hóa trong từng op là đủ
+        options.inter_op_num_threads = 1
+        providers = ['CPUExecutionProvider']
+        if self.device != 'cpu' and 'CUDAExecutionProvider' in ort.get_available_providers():
+            providers.insert(0, 'CUDAExecutionProvider')
+        session = ort.InferenceSession(self.onnx_path, options, providers=providers)
+        self._input_name = session.get_inputs()[0].name
+        self.device = 'cuda' if session.get_providers()[0] == 'CUDAExecutionProvider' else 'cpu'
+        return session
+
+    # ----- Trích xuất -----
+
+    def _buffer(self, n):
+        """
+        Buffer input cho n ảnh: (mảng numpy (n, 3, H, W), tensor torch dùng chung bộ nhớ hoặc None).
+        Chỉ cấp phát lại khi cần batch lớn hơn; với PyTorch trên GPU buffer nằm trong pinned memory.
+        """
+        local = self._local
+        if getattr(local, 'array', None) is None or len(local.array) < n:
+            shape = (n, 3, self.img_size, self.img_size)
+            if self.model is not None:
+                import torch
+                tensor = torch.empty(shape, dtype=torch.float32)
+                if str(self.device).startswith('cuda'):
+                    tensor = tensor.pin_memory()
+                local.tensor, local.array = tensor, tensor.numpy()
+            else:
+                local.tensor, local.array = None, np.empty(shape, dtype=np.float32)
+        return local.array[:n], (local.tensor[:n] if local.tensor is not None else None)
+
+    def _preprocess_batch(self, images):
+        """Tiền xử lý các ảnh BGR (hoặc đường dẫn) vào buffer của thread hiện tại."""
+        array, tensor = self._buffer(len(images))
+        for i, img in enumerate(images):
+            preprocess_into(cv2.imread(img) if isinstance(img, str) else img, array[i])
+        return array, tensor
+
+    def _forward(self, array, tensor=None):
+        """Forward một batch đã tiền xử lý, trả về (N, embedding_size) float32."""
+        if self.session is not None:
+            return self.session.run(None, {self._input_name: array})[0].astype(np.float32, copy=False)
+        import torch
+        if tensor is None:
+            tensor = torch.from_numpy(array)
+        autocast = torch.autocast('cpu', dtype=self._autocast_dtype) if self._autocast_dtype is not None \
+            else contextlib.nullcontext()
+        with torch.no_grad(), autocast:
+            x = tensor.to(self.device, memory_format=self._memory_format, non_blocking=True)
+            return self.model(x).float().cpu().numpy()
+
+    def forward_preprocessed(self, batch):
+        """Embedding cho batch (N, 3, H, W) RGB đã chuẩn hóa về [-1, 1] (vd. tập verification .bin)."""
+        return self._forward(np.ascontiguousarray(batch, dtype=np.float32))
+
     def extract(self, img):
-        # img: đường dẫn hoặc numpy array
-        if isinstance(img, str):
-            img = cv2.imread(img)
-        if img is None or len(img.shape) != 3 or img.shape[2] != 3:
-            img = np.zeros((self.img_size, self.img_size, 3), dtype=np.uint8)
-        else:
-            # Convert BGR to RGB for PIL transforms
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            
-        # Apply transforms (note: different from albumentations)
-        img_tensor = self.val_aug(img).unsqueeze(0).to(self.device)
-        emb = self.model(img_tensor).cpu().numpy()[0]
+        emb = self._forward(*self._preprocess_batch([img]))[0]
         return emb
 
+    def extract_batch(self, images):
+        """
+        Embedding cho nhiều ảnh (đường dẫn hoặc numpy array BGR, như extract) bằng forward theo batch:
+        mỗi lần tối đa max_batch_size ảnh. Trả về mảng (N, embedding_size) float32 cùng thứ tự với images.
+        """
+        embs = np.empty((len(images), self.embedding_size), dtype=np.float32)
+        for start in range(0, len(images), self.max_batch_size):
+            chunk = images[start:start + self.max_batch_size]
+            embs[start:start + len(chunk)] = self._forward(*self._preprocess_batch(chunk))
+        return embs
+
 # Example usage:
 # extractor = ArcFaceFeatureExtractor('ms1mv3_arcface_r18_fp16.pth', model_version='r18')
 # emb = extractor.extract('path/to/image.jpg')
+# embs = extractor.extract_batch(['a.jpg', 'b.jpg'])  # (2, 512)
+# extractor = ArcFaceFeatureExtractor('ms1mv3_arcface_r18_fp16.pth', backend='onnx')  # onnxruntime
+# extractor = ArcFaceFeatureExtractor('ms1mv3_arcface_r18_fp16.pth', torch_mode='bf16')  # CPU bfloat16
@@ -0,0 +1,113 @@
+"""
+Báo cáo bộ nhớ và recall của các index nén (sq16 / sq8 / pq) so với index flat.
+
+Bộ nhớ: kích thước index FAISS (serialize) quy ra MB cho 1 triệu vector, cộng bản embeddings
+trong GalleryStore (dùng để re-rank) ở float32 và float16.
+Recall: so top-k với exact search của flat, trước re-rank (manager.search) và sau re-rank
+(manager.query_batch, đường đi của /query).
+
+Ví dụ:
+    python scripts/faiss_quantization_report.py                    # gallery thật từ FAISS_STORE_DIR
+    python scripts/faiss_quantization_report.py --synthetic 100000
+    python scripts/faiss_quantization_report.py --pq-m 32 64 128 --rerank-factor 2 4 8
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import faiss
+
+# Ensure project root is on sys.path so imports like `index.*` work when running
+# this script directly from the `scripts/` folder.
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from index.faiss import FaissIndexManager
+from config import FAISS_STORE_DIR, FAISS_META_PATH, FAISS_PQ_NBITS
+from faiss_recall_report import load_gallery, synthetic_gallery, make_queries, recall_at_k, top1_agreement
+
+MB = 1024.0 * 1024.0
+
+
+def build_manager(gallery, index_type, pq_m=64, pq_nbits=FAISS_PQ_NBITS, rerank_factor=4):
+    n = len(gallery)
+    manager = FaissIndexManager(gallery.shape[1], index_type=index_type, pq_m=pq_m, pq_nbits=pq_nbits,
+                                quant_train_min=min(n, 39 * (1 << pq_nbits)), rerank_factor=rerank_factor)
+    manager.add_embeddings(gallery, list(range(n)), [None] * n, [0] * n)
+    return manager
+
+
+def index_mb_per_million(manager, n):
+    nbytes = faiss.serialize_index(manager._state.index).nbytes
+    return nbytes / float(n) * 1e6 / MB
+
+
+def query_ids(manager, queries, topk):
+    """image_id top-k sau re-rank (N, topk), -1 nếu thiếu kết quả; kèm ms/query."""
+    manager.query_batch(queries[:1], topk)
+    start = time.time()
+    results = manager.query_batch(queries, topk)
+    ms = (time.time() - start) * 1000.0 / len(queries)
+    I = np.full((len(queries), topk), -1, dtype=np.int64)
+    for q, hits in enumerate(results):
+        I[q, :len(hits)] = [h['image_id'] for h in hits]
+    return I, ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bộ nhớ và recall của index nén so với flat')
+    parser.add_argument('--store', default=FAISS_STORE_DIR, help='Thư mục gallery (dùng generation snapshot mới nhất)')
+    parser.add_argument('--meta', default=FAISS_META_PATH, help='File metadata .npz cũ, dùng khi chưa có --store')
+    parser.add_argument('--synthetic', type=int, default=0, help='Dùng gallery giả lập với N vector')
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--topk', type=int, default=5)
+    parser.add_argument('--pq-m', type=int, nargs='+', default=[32, 64, 128])
+    parser.add_argument('--rerank-factor', type=int, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+
+    if args.synthetic:
+        gallery = synthetic_gallery(args.synthetic, args.dim)
+    else:
+        gallery = load_gallery(args.store, args.meta)
+    if len(gallery) == 0:
+        print('Gallery rỗng, không có gì để đánh giá.')
+        return
+    n, dim = gallery.shape
+    queries = make_queries(gallery, args.queries)
+    topk = min(args.topk, n)
+    print(f'Gallery: {n} vectors, dim={dim}, queries={len(queries)}, topk={topk}')
+    print(f'Embeddings trong store (re-rank): {dim * 4 * 1e6 / MB:.0f} MB/1M vector (float32), '
+          f'{dim * 2 * 1e6 / MB:.0f} MB/1M vector (float16)')
+
+    flat = build_manager(gallery, 'flat')
+    _, I_ref = flat.search(queries, topk)
+    _, flat_ms = query_ids(flat, queries, topk)
+
+    configs = [('flat', {}), ('sq16', {}), ('sq8', {})]
+    if n >= (1 << FAISS_PQ_NBITS):
+        configs += [(f'pq{m}', {'pq_m': m}) for m in args.pq_m if dim % m == 0]
+    else:
+        print(f'Gallery < {1 << FAISS_PQ_NBITS} vector: bỏ qua PQ (không đủ dữ liệu train)')
+
+    print(f"{'index':<10}{'MB/1M':>9}{'rerank':>8}{'recall raw':>12}{'recall':>9}{'top1':>8}{'ms/query':>10}")
+    for name, params in configs:
+        index_type = 'pq' if name.startswith('pq') else name
+        manager = build_manager(gallery, index_type, **params)
+        mb = index_mb_per_million(manager, n)
+        _, I_raw = manager.search(queries, topk)
+        recall_raw = recall_at_k(I_raw, I_ref)
+        factors = [1] if index_type == 'flat' else args.rerank_factor
+        for factor in factors:
+            manager.rerank_factor = factor
+            I, ms = query_ids(manager, queries, topk)
+            print(f'{name:<10}{mb:>9.0f}{factor:>8}{recall_raw:>12.4f}{recall_at_k(I, I_ref):>9.4f}'
+                  f'{top1_agreement(I, I_ref):>8.4f}{ms:>10.4f}')
+    print(f'(flat query_batch: {flat_ms:.4f} ms/query)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Báo cáo recall vs latency của các loại FAISS index (IVF / HNSW) so với index flat.
+
+Ground truth là kết quả exact search của IndexFlatIP trên cùng gallery. Query được
+tạo từ chính gallery cộng nhiễu (mô phỏng ảnh mới của người đã đăng ký).
+
+Ví dụ:
+    python scripts/faiss_recall_report.py                       # gallery thật từ FAISS_STORE_DIR
+    python scripts/faiss_recall_report.py --synthetic 100000    # gallery giả lập
+    python scripts/faiss_recall_report.py --nprobe 4 8 16 32 --ef-search 32 64 128
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+# Ensure project root is on sys.path so imports like `index.*` work when running
+# this script directly from the `scripts/` folder.
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from index import snapshot
+from index.faiss import FaissIndexManager
+from config import FAISS_STORE_DIR, FAISS_META_PATH, FAISS_IVF_NLIST, FAISS_HNSW_M, FAISS_HNSW_EF_CONSTRUCTION
+
+
+def normalize(x):
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+def load_gallery(store_dir, meta_path):
+    generation, _ = snapshot.latest_valid_generation(store_dir)
+    if generation is not None:
+        emb_path = os.path.join(snapshot.generation_path(store_dir, generation), 'embeddings.npy')
+        return normalize(np.load(emb_path, mmap_mode='r').astype(np.float32))
+    meta = np.load(meta_path, allow_pickle=True)
+    return normalize(np.asarray(meta['embeddings'], dtype=np.float32))
+
+
+def synthetic_gallery(n, dim, images_per_class=5, seed=0):
+    """Gallery giả lập: mỗi class là một tâm ngẫu nhiên, mỗi ảnh là tâm + nhiễu."""
+    rng = np.random.default_rng(seed)
+    n_classes = max(1, n // images_per_class)
+    centers = normalize(rng.standard_normal((n_classes, dim)))
+    labels = rng.integers(0, n_classes, size=n)
+    return normalize(centers[labels] + 0.6 * rng.standard_normal((n, dim)) / np.sqrt(dim))
+
+
+def make_queries(gallery, n_queries, noise=0.5, seed=1):
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(gallery), size=n_queries)
+    dim = gallery.shape[1]
+    return normalize(gallery[picks] + noise * rng.standard_normal((n_queries, dim)) / np.sqrt(dim))
+
+
+def build_manager(gallery, index_type, nlist):
+    manager = FaissIndexManager(gallery.shape[1], index_type=index_type, nlist=nlist, train_min=nlist,
+                                hnsw_m=FAISS_HNSW_M, ef_construction=FAISS_HNSW_EF_CONSTRUCTION)
+    n = len(gallery)
+    start = time.time()
+    manager.add_embeddings(gallery, list(range(n)), [None] * n, [0] * n)
+    return manager, time.time() - start
+
+
+def timed_search(manager, queries, topk, **params):
+    # warm-up để không tính chi phí lần đầu
+    manager.search(queries[:1], topk, **params)
+    start = time.time()
+    D, I = manager.search(queries, topk, **params)
+    elapsed = time.time() - start
+    return I, elapsed * 1000.0 / len(queries)
+
+
+def recall_at_k(I, I_ref):
+    hits = sum(len(set(row) & set(ref)) for row, ref in zip(I.tolist(), I_ref.tolist()))
+    return hits / float(I_ref.size)
+
+
+def top1_agreement(I, I_ref):
+    return float(np.mean(I[:, 0] == I_ref[:, 0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall vs latency của IVF/HNSW so với flat')
+    parser.add_argument('--store', default=FAISS_STORE_DIR, help='Thư mục gallery (dùng generation snapshot mới nhất)')
+    parser.add_argument('--meta', default=FAISS_META_PATH, help='File metadata .npz cũ, dùng khi chưa có --store')
+    parser.add_argument('--synthetic', type=int, default=0, help='Dùng gallery giả lập với N vector')
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--topk', type=int, default=5)
+    parser.add_argument('--nlist', type=int, default=FAISS_IVF_NLIST)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[16, 32, 64, 128, 256])
+    args = parser.parse_args()
+
+    if args.synthetic:
+        gallery = synthetic_gallery(args.synthetic, args.dim)
+    else:
+        gallery = load_gallery(args.store, args.meta)
+    if len(gallery) == 0:
+        print('Gallery rỗng, không có gì để đánh giá.')
+        return
+    queries = make_queries(gallery, args.queries)
+    topk = min(args.topk, len(gallery))
+    # IVF cần ít nhất nlist điểm để train
+    nlist = max(1, min(args.nlist, len(gallery) // 39 or 1))
+
+    print(f'Gallery: {len(gallery)} vectors, dim={gallery.shape[1]}, queries={len(queries)}, topk={topk}')
+    rows = []
+
+    flat, build_s = build_manager(gallery, 'flat', nlist)
+    I_ref, flat_ms = timed_search(flat, queries, topk)
+    rows.append(('flat', '-', build_s, 1.0, 1.0, flat_ms))
+
+    ivf, build_s = build_manager(gallery, 'ivf', nlist)
+    for nprobe in args.nprobe:
+        if nprobe > nlist:
+            continue
+        I, ms = timed_search(ivf, queries, topk, nprobe=nprobe)
+        rows.append((f'ivf{nlist}', f'nprobe={nprobe}', build_s, recall_at_k(I, I_ref), top1_agreement(I, I_ref), ms))
+
+    hnsw, build_s = build_manager(gallery, 'hnsw', nlist)
+    for ef in args.ef_search:
+        I, ms = timed_search(hnsw, queries, topk, ef_search=ef)
+        rows.append((f'hnsw{FAISS_HNSW_M}', f'efSearch={ef}', build_s, recall_at_k(I, I_ref), top1_agreement(I, I_ref), ms))
+
+    print(f"{'index':<12}{'params':<16}{'build(s)':>10}{'recall@' + str(topk):>12}{'top1':>8}{'ms/query':>10}{'speedup':>9}")
+    for name, params, build_s, recall, top1, ms in rows:
+        speedup = flat_ms / ms if ms > 0 else float('inf')
+        print(f'{name:<12}{params:<16}{build_s:>10.2f}{recall:>12.4f}{top1:>8.4f}{ms:>10.4f}{speedup:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Độ chính xác và tốc độ của các chế độ suy luận PyTorch cho ArcFace (TORCH_INFERENCE_MODE) trên tập
+verification .bin của arcface_torch (lfw.bin, cfp_fp.bin, agedb_30.bin...), dùng lại
+insightface/recognition/arcface_torch/eval/verification.py (cần mxnet, scikit-learn, scipy).
+
+Mỗi chế độ in: accuracy 10-fold, chênh lệch so với fp32, cosine giữa embedding của chế độ đó và fp32
+(trung bình / nhỏ nhất), thời gian forward mỗi ảnh. Trả về mã lỗi 1 nếu có chế độ giảm accuracy
+quá --max-drop so với fp32, để chạy trước khi đổi chế độ trên server.
+
+Ví dụ:
+    python scripts/inference_mode_report.py --bin data/lfw.bin
+    python scripts/inference_mode_report.py --bin data/lfw.bin data/agedb_30.bin --modes fp32 bf16 int8
+    python scripts/inference_mode_report.py --bin data/lfw.bin --modes int8 --calibration-dir data/faces
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import torch
+
+# Ensure project root is on sys.path so imports like `model.*` work when running
+# this script directly from the `scripts/` folder.
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from model.arcface_model import ArcFaceFeatureExtractor, ARCFACE_TORCH_DIR, TORCH_MODES
+from config import MODEL_PATH, INT8_CALIBRATION_DIR, INT8_CALIBRATION_IMAGES
+
+if ARCFACE_TORCH_DIR not in sys.path:
+    sys.path.append(ARCFACE_TORCH_DIR)
+from eval import verification
+
+
+def evaluate_mode(extractor, data_set, batch_size):
+    """(accuracy, std, embeddings của ảnh gốc, ms/ảnh) của extractor trên một tập .bin."""
+    timings = []
+
+    def backbone(img):
+        start = time.perf_counter()
+        out = extractor.forward_preprocessed(img.numpy())
+        timings.append((time.perf_counter() - start, len(img)))
+        return torch.from_numpy(out)
+
+    _, _, acc, std, _, embeddings_list = verification.test(data_set, backbone, batch_size)
+    seconds = sum(t for t, _ in timings)
+    images = sum(n for _, n in timings)
+    return acc, std, embeddings_list[0], seconds / images * 1000
+
+
+def cosine(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Độ chính xác / tốc độ các chế độ suy luận PyTorch của ArcFace')
+    parser.add_argument('--bin', nargs='+', required=True, help='Tập verification .bin của arcface_torch')
+    parser.add_argument('--model-path', default=MODEL_PATH)
+    parser.add_argument('--model-version', default='r18')
+    parser.add_argument('--modes', nargs='+', default=['fp32', 'bf16', 'int8', 'torchscript'],
+                        choices=[m for m in TORCH_MODES if m != 'auto'])
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--calibration-dir', default=INT8_CALIBRATION_DIR)
+    parser.add_argument('--calibration-images', type=int, default=INT8_CALIBRATION_IMAGES)
+    parser.add_argument('--max-drop', type=float, default=0.003,
+                        help='Mức giảm accuracy tối đa so với fp32 được coi là an toàn')
+    args = parser.parse_args()
+
+    modes = ['fp32'] + [m for m in args.modes if m != 'fp32']
+    data_sets = {os.path.basename(path): verification.load_bin(path, (112, 112)) for path in args.bin}
+    reference = {}
+    failed = False
+    print(f"{'set':<16}{'mode':<13}{'accuracy':>10}{'delta':>9}{'cos_mean':>10}{'cos_min':>9}{'ms/img':>9}")
+    for mode in modes:
+        extractor = ArcFaceFeatureExtractor(args.model_path, model_version=args.model_version, device=args.device,
+                                            max_batch_size=args.batch_size, backend='torch', torch_mode=mode,
+                                            calibration_dir=args.calibration_dir,
+                                            calibration_images=args.calibration_images)
+        for name, data_set in data_sets.items():
+            acc, std, embeddings, ms = evaluate_mode(extractor, data_set, args.batch_size)
+            if mode == 'fp32':
+                reference[name] = (acc, embeddings)
+            ref_acc, ref_embeddings = reference[name]
+            cos = cosine(embeddings, ref_embeddings)
+            delta = acc - ref_acc
+            failed |= delta < -args.max_drop
+            label = mode if extractor.torch_mode == mode else f'{mode}->{extractor.torch_mode}'
+            print(f'{name:<16}{label:<13}{acc:>10.4f}{delta:>+9.4f}{cos.mean():>10.4f}{cos.min():>9.4f}{ms:>9.2f}')
+    if failed:
+        print(f'Có chế độ giảm accuracy quá {args.max_drop} so với fp32')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
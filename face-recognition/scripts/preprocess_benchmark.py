@@ -0,0 +1,135 @@
+"""
+Micro-benchmark tiền xử lý ảnh cho ArcFace: chi phí mỗi ảnh của pipeline cũ
+(torchvision ToPILImage -> Resize -> ToTensor -> Normalize, rồi stack) so với preprocess_into
+(cv2.resize + các phép tính ghi thẳng vào buffer NCHW dùng lại), cho ảnh lẻ và theo batch.
+Cột max_diff là sai khác lớn nhất giữa input của hai pipeline (khác biệt do cách resize).
+
+Với --model: so embedding ArcFace của input hai pipeline (ảnh trong --images, mặc định ảnh ngẫu nhiên) và
+thoát với mã 1 nếu cosine nhỏ nhất dưới --min-cosine, khi đó cần build lại gallery đã embed bằng pipeline cũ
+(POST /rebuild_index hoặc scripts/rebuild_gallery.py) để query và gallery dùng cùng cách tiền xử lý.
+
+Ví dụ:
+    python scripts/preprocess_benchmark.py
+    python scripts/preprocess_benchmark.py --sizes 112x112 640x480 --batch 32 --repeat 200
+    python scripts/preprocess_benchmark.py --model model/ms1mv3_arcface_r18_fp16.pth --images data/faces
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+import numpy as np
+import cv2
+
+# Ensure project root is on sys.path so imports like `model.*` work when running
+# this script directly from the `scripts/` folder.
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from model.arcface_model import preprocess_into
+
+
+def legacy_pipeline(img_size):
+    """Pipeline cũ của ArcFaceFeatureExtractor.val_aug; None nếu không có torch/torchvision."""
+    try:
+        import torch
+        import torchvision.transforms as transforms
+    except ImportError:
+        return None
+    val_aug = transforms.Compose([
+        transforms.ToPILImage(),
+        transforms.Resize((img_size, img_size)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
+    ])
+
+    def run(images):
+        return torch.stack([val_aug(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)) for img in images])
+    return run
+
+
+def time_per_image(fn, images, repeat):
+    fn(images)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(images)
+    return (time.perf_counter() - start) / (repeat * len(images)) * 1e6
+
+
+def check_embeddings(args, legacy, new_pipeline):
+    """Cosine giữa embedding của input pipeline cũ và mới; True nếu cosine nhỏ nhất >= args.min_cosine."""
+    from model.arcface_model import ArcFaceFeatureExtractor
+    extractor = ArcFaceFeatureExtractor(args.model, img_size=args.img_size, max_batch_size=args.batch)
+    if args.images:
+        paths = sorted(p for ext in ('jpg', 'jpeg', 'png') for p in glob.glob(os.path.join(args.images, f'*.{ext}')))
+        images = [img for img in (cv2.imread(p) for p in paths) if img is not None]
+    else:
+        rng = np.random.default_rng(1)
+        images = [rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8) for _ in range(args.batch)]
+    if not images:
+        print(f'Không có ảnh trong {args.images}')
+        return False
+    cosines = []
+    for start in range(0, len(images), args.batch):
+        chunk = images[start:start + args.batch]
+        old = extractor.forward_preprocessed(legacy(chunk).numpy())
+        new = extractor.forward_preprocessed(new_pipeline(chunk))
+        old /= np.linalg.norm(old, axis=1, keepdims=True)
+        new /= np.linalg.norm(new, axis=1, keepdims=True)
+        cosines.append(np.sum(old * new, axis=1))
+    cosines = np.concatenate(cosines)
+    ok = float(cosines.min()) >= args.min_cosine
+    print(f'Embedding ({len(images)} ảnh): cosine min {cosines.min():.4f}, mean {cosines.mean():.4f} '
+          f'(ngưỡng {args.min_cosine}) -> {"OK" if ok else "LỆCH: cần build lại gallery"}')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chi phí tiền xử lý ảnh ArcFace: torchvision vs cv2/numpy')
+    parser.add_argument('--sizes', nargs='+', default=['112x112', '640x480', '1280x720'],
+                        help='Kích thước ảnh đầu vào WxH')
+    parser.add_argument('--img-size', type=int, default=112)
+    parser.add_argument('--batch', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--model', help='File weights ArcFace: so embedding của hai pipeline')
+    parser.add_argument('--images', help='Thư mục ảnh khuôn mặt dùng để so embedding (mặc định ảnh ngẫu nhiên)')
+    parser.add_argument('--min-cosine', type=float, default=0.99,
+                        help='Cosine nhỏ nhất chấp nhận được giữa embedding của hai pipeline')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    legacy = legacy_pipeline(args.img_size)
+    if legacy is None:
+        print('Không có torch/torchvision: chỉ đo pipeline mới')
+    buffer = np.empty((args.batch, 3, args.img_size, args.img_size), dtype=np.float32)
+
+    def new_pipeline(images):
+        out = buffer[:len(images)]
+        for i, img in enumerate(images):
+            preprocess_into(img, out[i])
+        return out
+
+    print(f"{'input':<12}{'mode':<8}{'legacy us/img':>15}{'new us/img':>12}{'speedup':>9}{'max_diff':>10}")
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split('x'))
+        images = [rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8) for _ in range(args.batch)]
+        for mode, batch in (('single', images[:1]), ('batch', images)):
+            new_us = time_per_image(new_pipeline, batch, args.repeat)
+            if legacy is None:
+                print(f'{size:<12}{mode:<8}{"-":>15}{new_us:>12.1f}{"-":>9}{"-":>10}')
+                continue
+            legacy_us = time_per_image(legacy, batch, args.repeat)
+            diff = float(np.abs(legacy(batch).numpy() - new_pipeline(batch)).max())
+            print(f'{size:<12}{mode:<8}{legacy_us:>15.1f}{new_us:>12.1f}{legacy_us / new_us:>8.1f}x{diff:>10.4f}')
+
+    if args.model:
+        if legacy is None:
+            print('Không có torch/torchvision: không so được embedding')
+            sys.exit(1)
+        sys.exit(0 if check_embeddings(args, legacy, new_pipeline) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Chi phí decode + resize mỗi request /query: cách cũ (mỗi stage tự decode bytes upload: PIL + ghi JPEG tạm
+cho DeepFace rồi DeepFace đọc lại, cv2.imdecode cho EmoNet, cv2.imdecode cho ArcFace) so với QueryImage
+(decode một lần, ảnh gốc chỉ resize một lần xuống 256, ảnh 224 resize từ bản 256; ảnh 112 cho ArcFace resize
+từ ảnh gốc như lúc thêm ảnh vào gallery).
+Chỉ đo phần xử lý ảnh, không chạy model.
+
+Ví dụ:
+    python scripts/query_pipeline_benchmark.py
+    python scripts/query_pipeline_benchmark.py --sizes 640x480 1920x1080 --repeat 100
+"""
+import io
+import os
+import sys
+import time
+import argparse
+from tempfile import NamedTemporaryFile
+
+import numpy as np
+import cv2
+from PIL import Image
+
+# Ensure project root is on sys.path so imports like `service.*` work when running
+# this script directly from the `scripts/` folder.
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from service.query_pipeline import QueryImage
+
+
+def legacy_request(data):
+    # anti-spoofing: PIL decode + resize 224, ghi JPEG tạm, DeepFace đọc lại bằng cv2
+    img = Image.open(io.BytesIO(data)).convert("RGB").resize((224, 224))
+    with NamedTemporaryFile(suffix=".jpg", delete=False) as tmp:
+        tmp_path = tmp.name
+        img.save(tmp_path)
+    try:
+        cv2.imread(tmp_path)
+    finally:
+        os.unlink(tmp_path)
+    # EmoNet: decode lại, BGR -> RGB, resize 256
+    bgr = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    cv2.resize(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB), (256, 256))
+    # ArcFace: decode lại, resize 112 (trong preprocess_into)
+    bgr = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    cv2.resize(bgr, (112, 112), interpolation=cv2.INTER_AREA)
+
+
+def pipeline_request(data):
+    query = QueryImage(data, 'query.jpg')
+    query.square(224)
+    query.square(256, rgb=True)
+    # ArcFace nhận ảnh gốc, resize 112 trong preprocess_into (như gallery)
+    cv2.resize(query.bgr, (112, 112), interpolation=cv2.INTER_AREA)
+
+
+def time_per_request(fn, data, repeat):
+    fn(data)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(data)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chi phí decode/resize mỗi request /query: cũ vs QueryImage')
+    parser.add_argument('--sizes', nargs='+', default=['640x480', '1280x720', '1920x1080'],
+                        help='Kích thước ảnh upload WxH (JPEG)')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'input':<12}{'legacy ms':>11}{'pipeline ms':>13}{'speedup':>9}")
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split('x'))
+        # ảnh mượt (gradient + nhiễu nhẹ) để kích thước JPEG giống ảnh chụp thật
+        base = cv2.resize(rng.integers(0, 256, size=(9, 16, 3), dtype=np.uint8), (width, height))
+        noise = rng.integers(0, 8, size=base.shape, dtype=np.uint8)
+        data = cv2.imencode('.jpg', cv2.add(base, noise))[1].tobytes()
+        legacy_ms = time_per_request(legacy_request, data, args.repeat)
+        pipeline_ms = time_per_request(pipeline_request, data, args.repeat)
+        print(f'{size:<12}{legacy_ms:>11.2f}{pipeline_ms:>13.2f}{legacy_ms / pipeline_ms:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
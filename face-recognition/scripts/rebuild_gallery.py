@@ -0,0 +1,39 @@
+"""
+Build lại FAISS gallery từ ảnh trong bảng khuonmat (cùng pipeline với POST /rebuild_index).
+
+Dùng sau khi đổi MODEL_PATH hoặc khi index bị hỏng; dữ liệu MySQL không bị thay đổi.
+Generation mới được ghi vào FAISS_STORE_DIR.
+
+Ví dụ:
+    python scripts/rebuild_gallery.py
+"""
+import os
+import sys
+import time
+
+# Ensure project root is on sys.path so imports like `service.*` work when running
+# this script directly from the `scripts/` folder.
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from service.rebuild_gallery_service import rebuild_job
+
+
+def main():
+    rebuild_job.start()
+    while rebuild_job.running:
+        rebuild_job.join(timeout=2.0)
+        p = rebuild_job.status()
+        print(f"[{p.get('phase')}] {p.get('processed', 0)}/{p.get('total', '?')} ảnh, lỗi {p.get('failed', 0)}, "
+              f"{p.get('images_per_second', 0)} ảnh/s, còn ~{p.get('eta_s')}s")
+    p = rebuild_job.status()
+    if p['status'] != 'done':
+        print(f"Rebuild thất bại: {p.get('error')}")
+        sys.exit(1)
+    print(f"Xong: {p['num_vectors']} vector, generation {p['generation']}, {p['elapsed_s']}s "
+          f"({p['images_per_second']} ảnh/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@ from fastapi.responses import JSONResponse
 import numpy as np
 import cv2
 import random
-from service.shared_instances import get_extractor, get_faiss_manager, get_faiss_lock
+from service.shared_instances import get_extractor, get_faiss_manager, get_faiss_lock, get_embedding_cache
 from db.nguoi_repository import NguoiRepository
 from db.models import Nguoi
 from Depend.depend import AddEmbeddingInput
@@ -14,6 +14,7 @@ add_router = APIRouter()
 extractor = get_extractor()
 faiss_manager = get_faiss_manager()
 faiss_lock = get_faiss_lock()
+embedding_cache = get_embedding_cache()
 nguoi_repo = NguoiRepository()
 
 async def add_embedding_service(
@@ -21,14 +22,13 @@ async def add_embedding_service(
     file: UploadFile = File(...)
 ):
     # ✅ Kiểm tra kết nối FAISS - không load lại
-    with faiss_lock:
-        try:
-            _ = faiss_manager.image_ids
-        except Exception as e:
-            return {"message": f"Không thể kết nối FAISS: {e}", "status_code": 500}
+    try:
+        _ = faiss_manager.size()
+    except Exception as e:
+        return {"message": f"Không thể kết nối FAISS: {e}", "status_code": 500}
     
     # Kiểm tra tồn tại image_id
-    if str(input.image_id) in [str(id) for id in faiss_manager.image_ids]:
+    if input.image_id is not None and faiss_manager.has_image(input.image_id):
         return {"message": f"image_id {input.image_id} đã tồn tại!", "status_code": 400}
     # Đọc ảnh từ file upload
     try:
@@ -39,7 +39,7 @@ async def add_embedding_service(
         return {"message": f"Lỗi đọc ảnh: {e}", "status_code": 400}
     # Tiền xử lý và trích xuất embedding
     try:
-        embedding = extractor.extract(img)
+        embedding = embedding_cache.get_or_compute(embedding_cache.key(image_bytes, img), lambda: extractor.extract(img))
     except Exception as e:
         return {"message": f"Lỗi trích xuất embedding: {e}", "status_code": 500}
     # Kiểm tra kết nối MySQL trước khi thêm vào FAISS
@@ -55,7 +55,6 @@ async def add_embedding_service(
         else:
             # Attempt to generate a unique 6-digit id
             class_id_to_use = None
-            existing_faiss_class_ids = set([str(cid) for cid in faiss_manager.class_ids])
             attempts = 0
             while attempts < 1000:
                 cand = random.randint(100000, 999999)
@@ -65,7 +64,7 @@ async def add_embedding_service(
                 except Exception:
                     # if DB check fails, conservatively treat as exists to avoid collisions
                     exists_in_db = True
-                if (not exists_in_db) and (str(cand) not in existing_faiss_class_ids):
+                if (not exists_in_db) and (not faiss_manager.has_class(cand)):
                     class_id_to_use = cand
                     break
                 attempts += 1
@@ -109,7 +108,6 @@ async def add_embedding_service(
         # Thread-safe FAISS operations: add embedding with image_id=image_id_to_use and class_id=class_id_to_use
         with faiss_lock:
             faiss_manager.add_embeddings([embedding], [image_id_to_use], [None], [class_id_to_use])
-            faiss_manager.save()
 
         # If user existed, update their avatar_url (latest image) and updated_at
         if nguoi_exist:
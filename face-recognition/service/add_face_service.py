@@ -1,12 +1,13 @@
 import numpy as np
 import cv2
 from db.nguoi_repository import NguoiRepository
-from service.shared_instances import get_extractor, get_faiss_manager, get_faiss_lock
+from service.shared_instances import get_extractor, get_faiss_manager, get_faiss_lock, get_embedding_cache
 
 nguoi_repo = NguoiRepository()
 extractor = get_extractor()
 faiss_manager = get_faiss_manager()
 faiss_lock = get_faiss_lock()
+embedding_cache = get_embedding_cache()
 
 
 def add_face_service(user_id: int, image_bytes: bytes):
@@ -36,7 +37,7 @@ def add_face_service(user_id: int, image_bytes: bytes):
 
         # extract embedding
         try:
-            embedding = extractor.extract(img)
+            embedding = embedding_cache.get_or_compute(embedding_cache.key(image_bytes, img), lambda: extractor.extract(img))
         except Exception as e:
             return {"success": False, "message": f"Lỗi trích xuất embedding: {e}", "status_code": 500}
 
@@ -53,7 +54,6 @@ def add_face_service(user_id: int, image_bytes: bytes):
         try:
             with faiss_lock:
                 faiss_manager.add_embeddings([embedding], [image_id_to_use], [None], [int(user_id)])
-                faiss_manager.save()
             faiss_added = True
         except Exception as e:
             # If FAISS add fails, rollback DB insert if we created one
@@ -68,3 +68,79 @@ def add_face_service(user_id: int, image_bytes: bytes):
 
     except Exception as e:
         return {"success": False, "message": f"Lỗi khi thêm khuôn mặt: {e}", "status_code": 500}
+
+
+def add_faces_service(user_id: int, images: list):
+    """Thêm nhiều ảnh khuôn mặt cho một user đã tồn tại trong một request (đăng ký hàng loạt):
+    - decode mọi ảnh, rồi trích xuất embedding của các ảnh chưa có trong cache bằng một lần forward theo batch
+      (extract_batch)
+    - insert một bản ghi `khuonmat` cho mỗi ảnh decode được; ảnh insert lỗi được báo lỗi và không đưa vào FAISS
+    - thêm toàn bộ embedding vào FAISS bằng một lần add_embeddings (lỗi thì xóa lại các bản ghi đã insert)
+    `images` là list (filename, image_bytes). Ảnh không decode được được báo lỗi theo từng file và bỏ qua.
+    Trả về dict kết quả, hoặc lỗi kèm status_code.
+    """
+    try:
+        user = nguoi_repo.get_by_id(int(user_id))
+    except Exception as e:
+        return {"success": False, "message": f"Không thể kết nối MySQL: {e}", "status_code": 500}
+    if not user:
+        return {"success": False, "message": f"Không tìm thấy user id={user_id}", "status_code": 404}
+
+    decoded = []
+    items = []
+    for filename, image_bytes in images:
+        try:
+            img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR) if image_bytes else None
+        except Exception:
+            img = None
+        if img is None:
+            items.append({"filename": filename, "success": False, "message": "Không thể đọc ảnh"})
+        else:
+            decoded.append((len(items), image_bytes, img))
+            items.append({"filename": filename})
+    if not decoded:
+        return {"success": False, "message": "Không có ảnh hợp lệ", "results": items, "status_code": 400}
+
+    try:
+        embeddings = embedding_cache.get_or_compute_batch([embedding_cache.key(b, img) for _, b, img in decoded],
+                                                          [img for _, _, img in decoded], extractor.extract_batch)
+    except Exception as e:
+        return {"success": False, "message": f"Lỗi trích xuất embedding: {e}", "status_code": 500}
+
+    # Ảnh không insert được khuonmat bị báo lỗi và không đưa vào FAISS (không để vector mồ côi với id tạm)
+    added = []
+    khuonmat_ids = []
+    added_embeddings = []
+    for (pos, image_bytes, _), embedding in zip(decoded, embeddings):
+        try:
+            khuonmat_id = nguoi_repo.add_khuonmat(user_id=int(user_id), image_bytes=image_bytes)
+        except Exception as e:
+            items[pos].update(success=False, message=f"Lỗi lưu khuonmat: {e}")
+            continue
+        if not khuonmat_id:
+            items[pos].update(success=False, message="Lỗi lưu khuonmat: không nhận được id")
+            continue
+        added.append(pos)
+        khuonmat_ids.append(khuonmat_id)
+        added_embeddings.append(embedding)
+    if not added:
+        return {"success": False, "message": "Không lưu được khuôn mặt nào vào MySQL", "class_id": int(user_id),
+                "results": items, "status_code": 500}
+
+    try:
+        with faiss_lock:
+            faiss_manager.add_embeddings(added_embeddings, khuonmat_ids, [None] * len(added),
+                                         [int(user_id)] * len(added))
+    except Exception as e:
+        for khuonmat_id in khuonmat_ids:
+            if khuonmat_id is not None:
+                try:
+                    nguoi_repo.delete_khuonmat_by_id(khuonmat_id)
+                except Exception:
+                    pass
+        return {"success": False, "message": f"Lỗi khi thêm vào FAISS: {e}", "class_id": int(user_id), "status_code": 500}
+
+    for pos, khuonmat_id in zip(added, khuonmat_ids):
+        items[pos].update(success=True, image_id=khuonmat_id)
+    return {"success": True, "message": f"Đã thêm {len(added)}/{len(items)} khuôn mặt và embedding vào FAISS",
+            "class_id": int(user_id), "results": items}
@@ -1,27 +1,40 @@
 """
 Anti-spoofing service using DeepFace extract_faces with graceful fallback
 """
-import io
-import os
 import cv2
 import numpy as np
-from tempfile import NamedTemporaryFile
-from PIL import Image
+from config import MODEL_WARMUP, MODEL_LOAD_WAIT_SECONDS
+from service.model_loader import LazyModel, ModelNotReadyError
+from service.query_pipeline import QueryImage
 
-# Try to import DeepFace, fallback if not available
-try:
+# Ảnh đưa vào DeepFace anti-spoofing
+INPUT_SIZE = 224
+
+
+def _load_deepface():
+    # Import DeepFace (kéo theo TensorFlow) ở thread nền thay vì lúc import app
     from deepface import DeepFace
-    DEEPFACE_AVAILABLE = True
     print("✅ DeepFace imported successfully for anti-spoofing")
-except ImportError as e:
-    DEEPFACE_AVAILABLE = False
-    print(f"⚠️ DeepFace not available: {e}")
-    print("🔄 Anti-spoofing will use fallback method")
+    return DeepFace
+
+
+def _warmup_deepface(DeepFace):
+    # Load model detector + anti-spoofing của DeepFace (chỉ load khi gọi lần đầu)
+    DeepFace.extract_faces(img_path=np.zeros((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8), enforce_detection=False,
+                           align=False, anti_spoofing=True)
+
+
+deepface_model = LazyModel(
+    'anti_spoofing',
+    _load_deepface,
+    warmup=_warmup_deepface if MODEL_WARMUP else None,
+    wait_timeout=MODEL_LOAD_WAIT_SECONDS
+)
 
 class AntiSpoofingService:
     def __init__(self):
         """Initialize anti-spoofing service"""
-        self.deepface_available = DEEPFACE_AVAILABLE
+        self.deepface_model = deepface_model
         
     async def check_spoof(self, image_file):
         """
@@ -34,70 +47,63 @@ class AntiSpoofingService:
         Returns:
             dict: Results containing anti-spoofing check results
         """
+        return await self.check_spoof_image(await QueryImage.from_upload(image_file))
+
+    async def check_spoof_image(self, query: QueryImage):
+        """
+        Như check_spoof cho ảnh đã đọc của request (QueryImage): dùng ảnh BGR 224x224 decode/resize
+        sẵn, dùng chung với các stage khác của /query (không decode lại, không ghi file JPEG tạm)
+        """
         # Validate file extension
-        if not image_file.filename.lower().endswith((".jpg", ".jpeg", ".png")):
+        if query.filename is not None and not query.filename.lower().endswith((".jpg", ".jpeg", ".png")):
             return {
                 "error": "Only JPG/PNG images are supported",
                 "status_code": 400,
                 "is_real": False
             }
-
-        try:
-            # Read and validate image
-            contents = await image_file.read()
-            img = Image.open(io.BytesIO(contents)).convert("RGB")
-            img = img.resize((224, 224))  # Resize như code mẫu
-            
-            if self.deepface_available:
-                return await self._check_with_deepface_extract_faces(img)
-            else:
-                return await self._check_with_fallback(img)
-            
-        except Exception as e:
+        img = query.square(INPUT_SIZE)  # Resize như code mẫu
+        if img is None:
             return {
-                "error": f"Invalid image file: {str(e)}",
+                "error": f"Invalid image file: {query.decode_error}",
                 "status_code": 400,
                 "is_real": False
             }
+
+        # DeepFace chưa load xong (quá MODEL_LOAD_WAIT_SECONDS) hoặc không cài được thì dùng fallback
+        try:
+            DeepFace = await self.deepface_model.get_async()
+        except ModelNotReadyError as e:
+            print(f"⚠️ DeepFace not available: {e}")
+            return await self._check_with_fallback(img)
+        return await self._check_with_deepface_extract_faces(DeepFace, img)
     
-    async def _check_with_deepface_extract_faces(self, img):
-        """Check using DeepFace extract_faces with anti_spoofing=True"""
+    async def _check_with_deepface_extract_faces(self, DeepFace, img):
+        """Check using DeepFace extract_faces with anti_spoofing=True (img: numpy BGR)"""
         try:
-            # Save temporary image for DeepFace
-            with NamedTemporaryFile(suffix=".jpg", delete=False) as tmp:
-                tmp_path = tmp.name
-                img.save(tmp_path)
+            # Use DeepFace extract_faces with anti_spoofing=True (như code mẫu)
+            faces = DeepFace.extract_faces(
+                img_path=img,
+                enforce_detection=False,
+                align=False, 
+                anti_spoofing=True
+            )
             
-            try:
-                # Use DeepFace extract_faces with anti_spoofing=True (như code mẫu)
-                faces = DeepFace.extract_faces(
-                    img_path=tmp_path,
-                    enforce_detection=False,
-                    align=False, 
-                    anti_spoofing=True
-                )
-                
-                if faces:
-                    is_real = faces[0].get("is_real", False)
-                    results = "REAL" if is_real else "SPOOF"
-                    confidence = 0.8 if is_real else 0.2
-                else:
-                    results = "NO_FACE"
-                    is_real = False
-                    confidence = 0.0
-                
-                return {
-                    "is_real": is_real,
-                    "status_code": 200,
-                    "message": results,
-                    "confidence": confidence,
-                    "method": "DeepFace extract_faces anti-spoofing"
-                }
-                
-            finally:
-                # Clean up temporary file
-                if os.path.exists(tmp_path):
-                    os.unlink(tmp_path)
+            if faces:
+                is_real = faces[0].get("is_real", False)
+                results = "REAL" if is_real else "SPOOF"
+                confidence = 0.8 if is_real else 0.2
+            else:
+                results = "NO_FACE"
+                is_real = False
+                confidence = 0.0
+            
+            return {
+                "is_real": is_real,
+                "status_code": 200,
+                "message": results,
+                "confidence": confidence,
+                "method": "DeepFace extract_faces anti-spoofing"
+            }
                     
         except Exception as e:
             print(f"DeepFace extract_faces error: {e}")
@@ -105,11 +111,9 @@ class AntiSpoofingService:
             return await self._check_with_fallback(img)
     
     async def _check_with_fallback(self, img):
-        """Fallback method using basic image analysis"""
+        """Fallback method using basic image analysis (img: numpy BGR)"""
         try:
-            # Convert PIL to numpy for basic analysis
-            img_array = np.array(img)
-            height, width = img_array.shape[:2]
+            height, width = img.shape[:2]
             
             # Basic checks for image quality and consistency  
             if height < 100 or width < 100:
@@ -122,7 +126,7 @@ class AntiSpoofingService:
                 }
             
             # Convert to grayscale for analysis
-            gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
             
             # Check image sharpness (blurry images might be photos of photos)
             laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
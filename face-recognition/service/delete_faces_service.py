@@ -18,8 +18,6 @@ def delete_faces_for_user(user_id: int):
         # Remove from FAISS
         with faiss_lock:
             removed = faiss_manager.delete_by_class_id(user_id)
-            # save after removal
-            faiss_manager.save()
 
         # Remove from DB
         deleted_rows = nguoi_repo.delete_khuonmats_by_user(int(user_id))
@@ -19,11 +19,10 @@ def delete_image_service(
     input: DeleteImageInput = Depends(DeleteImageInput.as_form)
     ):
     # ✅ Kiểm tra kết nối FAISS - không load lại
-    with faiss_lock:
-        try:
-            _ = faiss_manager.image_ids
-        except Exception as e:
-            return {"message": f"Không thể kết nối FAISS: {e}", "status_code": 500}
+    try:
+        _ = faiss_manager.size()
+    except Exception as e:
+        return {"message": f"Không thể kết nối FAISS: {e}", "status_code": 500}
     # Kiểm tra kết nối MySQL
     try:
         _ = nguoi_repo
@@ -32,17 +31,10 @@ def delete_image_service(
         return {"message": f"Không thể kết nối MySQL: {e}", "status_code": 500}
     
     try:
-        # Lấy class_id trước khi xóa
-        idxs = [i for i, img_id in enumerate(faiss_manager.image_ids) if str(img_id) == str(input.image_id)]
-        class_id = None
-        if idxs:
-            class_id = int(faiss_manager.class_ids[idxs[0]])
-        
-        # ✅ Thread-safe delete operation
+        # ✅ Thread-safe delete operation (lấy class_id trước khi xóa)
         with faiss_lock:
+            class_id = faiss_manager.class_id_of(input.image_id)
             result = faiss_manager.delete_by_image_id(input.image_id)
-            if result:
-                faiss_manager.save()
         
         if result:
             # Kiểm tra còn ảnh nào thuộc class_id không
@@ -1,7 +1,7 @@
 import numpy as np
 import cv2
 import faiss
-from service.shared_instances import get_extractor, get_faiss_manager, get_faiss_lock
+from service.shared_instances import get_extractor, get_faiss_manager, get_faiss_lock, get_embedding_cache
 from service.performance_monitor import track_operation
 from db.nguoi_repository import NguoiRepository
 from db.models import Nguoi
@@ -14,19 +14,14 @@ def edit_embedding_service(input, file):
     faiss_manager = get_faiss_manager()
     faiss_lock = get_faiss_lock()
     extractor = get_extractor()
+    embedding_cache = get_embedding_cache()
     nguoi_repo = NguoiRepository()
     
-    # ✅ Thread-safe check existence
-    with faiss_lock:
-        if str(input.image_id) not in [str(id) for id in faiss_manager.image_ids]:
-            return {"message": f"image_id {input.image_id} không tồn tại!", "status_code": 404}
+    # ✅ Kiểm tra tồn tại: đọc không lock (update_embedding kiểm tra lại khi ghi)
+    if not faiss_manager.has_image(input.image_id):
+        return {"message": f"image_id {input.image_id} không tồn tại!", "status_code": 404}
     
     try:
-        idxs = [i for i, img_id in enumerate(faiss_manager.image_ids) if str(img_id) == str(input.image_id)]
-        if not idxs:
-            return {"message": f"Không tìm thấy index cho image_id {input.image_id}", "status_code": 404}
-        
-        idx = idxs[0]
         updated_fields = []
         
         # Cập nhật embedding nếu file ảnh được gửi lên
@@ -40,19 +35,14 @@ def edit_embedding_service(input, file):
                     return {"message": "Không thể decode ảnh!", "status_code": 400}
                 
                 # ✅ Sử dụng shared extractor
-                new_embedding = extractor.extract(img)
-                
-                # L2 normalization (quan trọng!)
-                new_embedding_norm = new_embedding / np.linalg.norm(new_embedding)
+                new_embedding = embedding_cache.get_or_compute(embedding_cache.key(image_bytes, img),
+                                                               lambda: extractor.extract(img))
                 
-                # Cập nhật embedding trong memory
-                faiss_manager.embeddings[idx] = new_embedding_norm.tolist()
-                
-                # QUAN TRỌNG: Rebuild FAISS index với embeddings mới
-                faiss_manager.index = faiss_manager.index.__class__(faiss_manager.embedding_size)
-                if len(faiss_manager.embeddings) > 0:
-                    embeddings_array = np.array(faiss_manager.embeddings, dtype=np.float32)
-                    faiss_manager.index.add(embeddings_array)
+                # Thay đúng vector của image_id trong index (normalize trong FaissIndexManager),
+                # không rebuild toàn bộ gallery
+                with faiss_lock:
+                    if not faiss_manager.update_embedding(input.image_id, new_embedding):
+                        return {"message": f"Không tìm thấy index cho image_id {input.image_id}", "status_code": 404}
                 
                 updated_fields.append('embedding')
                 
@@ -60,12 +50,10 @@ def edit_embedding_service(input, file):
                 return {"message": f"Lỗi trích xuất embedding: {e}", "status_code": 500}
         
         # Cập nhật image_path nếu truyền lên và không rỗng
-        if hasattr(input, 'image_path') and input.image_path:
-            faiss_manager.image_paths[idx] = input.image_path
-            updated_fields.append('image_path')
-        
-        # Lưu thay đổi
-        faiss_manager.save()
+        with faiss_lock:
+            if hasattr(input, 'image_path') and input.image_path:
+                if faiss_manager.update_image_path(input.image_id, input.image_path):
+                    updated_fields.append('image_path')
         
         if updated_fields:
             return {"message": f"Đã cập nhật: {', '.join(updated_fields)} cho image_id={input.image_id}"}
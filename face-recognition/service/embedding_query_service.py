@@ -1,12 +1,11 @@
 from fastapi import APIRouter, Query
 from fastapi.responses import JSONResponse
 
-from service.shared_instances import get_faiss_manager, get_faiss_lock
+from service.shared_instances import get_faiss_manager
 from service.performance_monitor import track_operation
 
 # ✅ Sử dụng shared instances
 faiss_manager = get_faiss_manager()
-faiss_lock = get_faiss_lock()
 
 router = APIRouter()
 
@@ -18,7 +17,6 @@ def search_embeddings_api(
     page_size: int = Query(15, ge=1, le=15, description='Số kết quả mỗi trang'),
     sort_by: str = Query('image_id_asc', description='Sắp xếp theo')
 ):
-    # ✅ Thread-safe query operation - không load lại
-    with faiss_lock:
-        result = faiss_manager.query_embeddings_by_string(query, page, page_size, sort_by)
+    # ✅ Đọc không lock (phiên bản gallery đã publish) - không load lại
+    result = faiss_manager.query_embeddings_by_string(query, page, page_size, sort_by)
     return result
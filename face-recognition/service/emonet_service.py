@@ -2,6 +2,14 @@ import torch
 import numpy as np
 import cv2
 from pathlib import Path
+from config import INFERENCE_CACHE, INFERENCE_CACHE_MAX_ENTRIES, INFERENCE_CACHE_TTL_SECONDS, MODEL_WARMUP, \
+    MODEL_LOAD_WAIT_SECONDS
+from service.inference_cache import InferenceCache
+from service.model_loader import LazyModel
+from service.query_pipeline import QueryImage
+
+# EmoNet nhận ảnh RGB 256x256
+INPUT_SIZE = 256
 
 EMOTION_CLASSES = {0: "Neutral", 1: "Happy", 2: "Sad", 3: "Surprise", 4: "Fear", 5: "Disgust", 6: "Anger", 7: "Contempt"}
 
@@ -46,8 +54,16 @@ class EmoNetWrapper:
             if img_bgr.shape[2] > 3:
                 img_bgr = img_bgr[:, :, :3]
             img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-            img_resized = cv2.resize(img_rgb, (256, 256))
-            tensor = torch.from_numpy(img_resized.astype(np.float32) / 255.0).permute(2, 0, 1).unsqueeze(0).to(self.device)
+            return self.predict_from_rgb(cv2.resize(img_rgb, (INPUT_SIZE, INPUT_SIZE)))
+        except Exception:
+            return None, None
+
+    def predict_from_rgb(self, img_rgb: np.ndarray):
+        """Predict emotion from an RGB image already resized to INPUT_SIZE x INPUT_SIZE. Returns (label, prob) or (None, None)."""
+        if self.net is None:
+            return None, None
+        try:
+            tensor = torch.from_numpy(img_rgb.astype(np.float32) / 255.0).permute(2, 0, 1).unsqueeze(0).to(self.device)
             with torch.no_grad():
                 out = self.net(tensor)
                 expr = out.get('expression')
@@ -61,30 +77,53 @@ class EmoNetWrapper:
             return None, None
 
 
-# Singleton wrapper
-_EMO_WRAPPER = None
+def _warmup_emonet(wrapper):
+    wrapper.predict_from_rgb(np.zeros((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8))
+
+
+# Singleton wrapper: load ở thread nền khi server khởi động (service/model_loader.py)
+emonet_model = LazyModel(
+    'emonet',
+    EmoNetWrapper,
+    warmup=_warmup_emonet if MODEL_WARMUP else None,
+    wait_timeout=MODEL_LOAD_WAIT_SECONDS
+)
+
+# Cache kết quả cảm xúc theo hash bytes ảnh (chỉ cache dự đoán thành công)
+emotion_cache = InferenceCache('emonet', max_entries=INFERENCE_CACHE_MAX_ENTRIES,
+                               ttl_seconds=INFERENCE_CACHE_TTL_SECONDS, enabled=INFERENCE_CACHE)
 
 
 def get_emonet_wrapper():
-    global _EMO_WRAPPER
-    if _EMO_WRAPPER is None:
-        _EMO_WRAPPER = EmoNetWrapper()
-    return _EMO_WRAPPER
+    return emonet_model.get()
 
 
 def predict_emotion_from_bytes(image_bytes: bytes):
-    wrapper = get_emonet_wrapper()
+    return predict_emotion_from_image(QueryImage(image_bytes))
+
+
+def predict_emotion_from_image(query: QueryImage):
+    """Cảm xúc của ảnh request, dùng ảnh RGB 256x256 đã decode/resize sẵn của QueryImage."""
+    # Cảm xúc chỉ là thông tin thêm của /query: EmoNet chưa load xong thì bỏ qua, không bắt request chờ
+    if not emonet_model.is_ready():
+        emonet_model.start()
+        return {"emotion": None, "prob": None}
+    wrapper = emonet_model.get()
     if wrapper.net is None:
         # Return a consistent dict so callers can always include the field in JSON
         return {"emotion": None, "prob": None}
     try:
-        buf = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+        key = query.cache_key(emotion_cache)
+        cached = emotion_cache.get(key)
+        if cached is not None:
+            return {"emotion": cached[0], "prob": cached[1]}
+        img = query.square(INPUT_SIZE, rgb=True)
         if img is None:
             return {"emotion": None, "prob": None}
-        label, prob = wrapper.predict_from_image_bgr(img)
+        label, prob = wrapper.predict_from_rgb(img)
         if label is None:
             return {"emotion": None, "prob": None}
+        emotion_cache.put(key, (label, prob))
         return {"emotion": label, "prob": prob}
     except Exception:
         return {"emotion": None, "prob": None}
@@ -0,0 +1,111 @@
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import UploadFile
+import numpy as np
+import cv2
+import time
+import asyncio
+
+from config import QUERY_BATCH_MAX_IMAGES, QUERY_BATCH_DECODE_WORKERS, FACE_MATCH_THRESHOLD
+from service.shared_instances import get_extractor, get_faiss_manager, get_embedding_cache, get_embedding_scheduler
+from service.performance_monitor import track_operation
+from service.model_loader import ModelNotReadyError
+from db.nguoi_repository import NguoiRepository
+
+# ✅ Sử dụng shared instances
+extractor = get_extractor()
+faiss_manager = get_faiss_manager()
+embedding_cache = get_embedding_cache()
+embedding_scheduler = get_embedding_scheduler()
+nguoi_repo = NguoiRepository()
+
+# cv2.imdecode nhả GIL nên decode nhiều ảnh song song trên thread pool
+_decode_pool = ThreadPoolExecutor(max_workers=QUERY_BATCH_DECODE_WORKERS, thread_name_prefix='query-batch-decode')
+
+
+def _decode(image_bytes):
+    if not image_bytes:
+        return None, "file ảnh rỗng"
+    try:
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    except cv2.error as e:
+        return None, f"OpenCV decode error: {e}"
+    if image is None:
+        return None, "Không decode được ảnh"
+    return image, None
+
+
+@track_operation("face_query_batch")
+async def query_face_batch_service(files: List[UploadFile], topk: int = 1):
+    start_total = time.time()
+    if not files:
+        return {"error": "Lỗi: không có file ảnh nào.", "status_code": 400}
+    if len(files) > QUERY_BATCH_MAX_IMAGES:
+        return {"error": f"Lỗi: tối đa {QUERY_BATCH_MAX_IMAGES} ảnh mỗi request.", "status_code": 400}
+
+    contents = [await f.read() for f in files]
+    loop = asyncio.get_running_loop()
+    decoded = await asyncio.gather(*(loop.run_in_executor(_decode_pool, _decode, b) for b in contents))
+
+    # ArcFace đang load thì chờ ngoài event loop
+    try:
+        await extractor.get_async()
+    except ModelNotReadyError as e:
+        return {"error": str(e), "status_code": 503}
+
+    # Embedding cho các ảnh decode được (trừ ảnh đã có trong cache) qua embedding_scheduler: ảnh của request
+    # được gom batch cùng các request /query đồng thời, model chạy ở thread của scheduler (không chặn event
+    # loop). Sau đó search cả ma trận bằng một lần FAISS search ngoài event loop
+    ok = [i for i, (image, _) in enumerate(decoded) if image is not None]
+    try:
+        embs = await asyncio.gather(*(
+            embedding_cache.get_or_compute_async(embedding_cache.key(contents[i], decoded[i][0]),
+                                                 lambda image=decoded[i][0]: embedding_scheduler.infer_async(image))
+            for i in ok))
+    except ModelNotReadyError as e:
+        return {"error": str(e), "status_code": 503}
+    batch_results = await loop.run_in_executor(None, lambda: faiss_manager.query_batch(np.stack(embs), topk=topk)) \
+        if ok else []
+    results_by_file = dict(zip(ok, batch_results))
+
+    # Mỗi class_id chỉ truy vấn MySQL một lần cho cả batch
+    nguoi_cache = {}
+    mysql_error = False
+
+    def _nguoi(class_id):
+        nonlocal mysql_error
+        if class_id not in nguoi_cache and not mysql_error:
+            try:
+                nguoi = nguoi_repo.get_by_id(class_id)
+                nguoi_cache[class_id] = nguoi.to_dict(include_avatar_base64=True) if nguoi else None
+            except Exception as e:
+                print(f"Lỗi truy vấn MySQL: {e}")
+                mysql_error = True
+        return nguoi_cache.get(class_id)
+
+    items = []
+    for i, f in enumerate(files):
+        item = {"filename": f.filename}
+        error = decoded[i][1]
+        if error is not None:
+            item["error"] = error
+            items.append(item)
+            continue
+        matches = []
+        for r in results_by_file[i]:
+            # Cùng ngưỡng với /query
+            if r['score'] <= FACE_MATCH_THRESHOLD:
+                continue
+            match = {
+                'image_id': int(r['image_id']),
+                'image_path': str(r['image_path']),
+                'class_id': str(r['class_id']),
+                'score': float(r['score'])
+            }
+            nguoi = _nguoi(int(r['class_id']))
+            if nguoi:
+                match['nguoi'] = nguoi
+            matches.append(match)
+        item["results"] = matches
+        items.append(item)
+    return {"results": items, "total_time": round(time.time() - start_total, 3)}
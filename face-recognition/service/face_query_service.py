@@ -5,58 +5,64 @@ import cv2
 import time
 
 
-from service.shared_instances import get_extractor, get_faiss_manager, get_faiss_lock
+from config import FACE_MATCH_THRESHOLD
+from service.shared_instances import get_extractor, get_faiss_manager, get_embedding_scheduler, get_embedding_cache
 from db.nguoi_repository import NguoiRepository
-from service.emonet_service import predict_emotion_from_bytes
+from service.emonet_service import predict_emotion_from_image
+from service.query_pipeline import QueryImage
+from service.model_loader import ModelNotReadyError
 from service.add_emotion_service import add_emotion_service
 import io
 
 
 # ✅ Sử dụng shared instances thay vì tạo mới
 extractor = get_extractor()
+embedding_scheduler = get_embedding_scheduler()
+embedding_cache = get_embedding_cache()
 faiss_manager = get_faiss_manager()
-faiss_lock = get_faiss_lock()
 nguoi_repo = NguoiRepository()
 
 router = APIRouter()
 
 async def query_face_service(file: UploadFile = File(...)):
+    return await query_face_image_service(await QueryImage.from_upload(file))
+
+async def query_face_image_service(query: QueryImage):
+    """Như query_face_service cho ảnh đã đọc của request (QueryImage, decode một lần dùng chung với spoof/emotion)"""
     # ✅ Không load lại FAISS mỗi request - sử dụng thread-safe access
     start_total = time.time()
     
-    image_bytes = await file.read()
+    image_bytes = query.data
     if not image_bytes:
         return {"error": "Lỗi: file ảnh rỗng (không đọc được). Hãy đảm bảo file được upload đúng.", "status_code": 400}
 
-    try:
-        buf = np.frombuffer(image_bytes, np.uint8)
-        if buf.size == 0:
-            return {"error": "Lỗi: file ảnh rỗng (buffer 0).", "status_code": 400}
-        image = cv2.imdecode(buf, cv2.IMREAD_COLOR)
-        if image is None:
-            return {"error": "Lỗi: Không decode được ảnh (imdecode trả None). Hãy kiểm tra định dạng file." , "status_code": 400}
-    except cv2.error as e:
+    # ArcFace nhận ảnh gốc và tự resize một lần xuống 112x112 (preprocess_into), giống hệt lúc thêm ảnh vào
+    # gallery; không dùng bản đã thu nhỏ qua WORKING_SIZE của QueryImage
+    image = query.bgr
+    if image is None:
         # Return a clear error instead of letting OpenCV propagate a 500
-        print(f"OpenCV imdecode error: {e}")
-        return {"error": f"OpenCV decode error: {e}", "status_code": 400}
-    except Exception as e:
-        print(f"Unexpected error when decoding image: {e}")
-        return {"error": f"Unexpected decode error: {e}", "status_code": 500}
+        print(f"OpenCV imdecode error: {query.decode_error}")
+        return {"error": f"Lỗi: Không decode được ảnh ({query.decode_error}). Hãy kiểm tra định dạng file.", "status_code": 400}
     # Predict emotion from the uploaded/query image (if model available)
     try:
-        emo_query = predict_emotion_from_bytes(image_bytes)
+        emo_query = predict_emotion_from_image(query)
     except Exception:
         emo_query = None
     print(f"[debug] emo_query from emonet_service: {emo_query}")
     
-    emb = extractor.extract(image)
+    # Ảnh đã gửi trước đó lấy embedding từ cache; không thì gom với các request đồng thời khác
+    # thành một batch ArcFace (không chặn event loop khi chờ)
+    try:
+        emb = await embedding_cache.get_or_compute_async(query.cache_key(embedding_cache, image),
+                                                         lambda: embedding_scheduler.infer_async(image))
+    except ModelNotReadyError as e:
+        return {"error": str(e), "status_code": 503}
     
-    # ✅ Thread-safe FAISS query
-    with faiss_lock:
-        results = faiss_manager.query(emb, topk=1)
+    # ✅ FAISS range search không lock: FAISS chỉ trả về ảnh có score > FACE_MATCH_THRESHOLD (0.42,
+    # chọn qua validation của model), ảnh dưới ngưỡng bị loại ngay trong index
+    results = faiss_manager.range_query(emb, min_score=FACE_MATCH_THRESHOLD, max_results=1)['results']
     
-    # Threshold 0.42 chosen based on model validation: scores above 0.42 indicate a confident match.
-    if results and results[0]['score'] > 0.42:
+    if results:
         class_id = str(results[0]['class_id'])
         try:
                 nguoi = nguoi_repo.get_by_id(int(class_id))
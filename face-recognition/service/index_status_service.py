@@ -1,7 +1,7 @@
 from fastapi import APIRouter
 from fastapi.responses import JSONResponse
 
-from service.shared_instances import get_faiss_manager, get_faiss_lock
+from service.shared_instances import get_faiss_manager, get_faiss_reload_status
 from service.performance_monitor import track_operation
 from db.nguoi_repository import NguoiRepository
 
@@ -9,14 +9,15 @@ status_router = APIRouter()
 
 # ✅ Sử dụng shared instances
 faiss_manager = get_faiss_manager()
-faiss_lock = get_faiss_lock()
 nguoi_repo = NguoiRepository()
 
 @track_operation("index_status")
 def index_status_service():
-    # ✅ Thread-safe status check - không load lại
-    with faiss_lock:
-        result = faiss_manager.check_index_data()
+    # ✅ Đọc không lock (phiên bản gallery đã publish) - không load lại
+    result = faiss_manager.check_index_data()
+    # Generation snapshot đang phục vụ và trạng thái watcher hot reload
+    result['generation'] = faiss_manager.generation
+    result['reload'] = get_faiss_reload_status()
     # Thêm thông tin bảng nguoi
     # Lấy tổng số người và ví dụ 5 người
     try:
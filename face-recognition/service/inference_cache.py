@@ -0,0 +1,238 @@
+# ===== INFERENCE CACHE (CONTENT-HASH) =====
+# File: face_api/service/inference_cache.py
+# Mục đích: Cache kết quả model theo hash nội dung ảnh upload, ảnh gửi lại không phải chạy model lần nữa
+
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+def content_key(data: bytes, shape: Optional[tuple] = None) -> bytes:
+    """
+    Hash nhanh (BLAKE2b 128 bit) của bytes ảnh upload, kèm kích thước ảnh đưa vào model nếu có
+    (cùng ảnh upload nhưng tiền xử lý khác nhau thì không dùng chung kết quả).
+    """
+    h = hashlib.blake2b(data, digest_size=16)
+    if shape is not None:
+        h.update(repr(tuple(shape)).encode())
+    return h.digest()
+
+
+def pixel_key(img: np.ndarray) -> bytes:
+    """Hash của ảnh đã decode (shape + pixel): cùng ảnh nhưng khác container/metadata vẫn trùng key."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((img.shape, img.dtype.str)).encode())
+    h.update(np.ascontiguousarray(img).data)
+    return h.digest()
+
+
+class InferenceCache:
+    """
+    Cache LRU + TTL trước một model: key là hash nội dung ảnh (content_key, hoặc pixel_key khi
+    hash_pixels=True và caller có ảnh đã decode), value là kết quả model (embedding, nhãn...).
+    Giới hạn max_entries phần tử (embedding 512 float32 ~ 2 KB/phần tử); phần tử quá ttl_seconds
+    giây bị bỏ khi đọc tới. Mỗi model một cache:
+
+        cache = InferenceCache('arcface', max_entries=10000, ttl_seconds=600)
+        emb = cache.get_or_compute(cache.key(image_bytes, img), lambda: extractor.extract(img))
+        emb = await cache.get_or_compute_async(cache.key(image_bytes), lambda: scheduler.infer_async(img))
+
+    Các request đồng thời cùng key chỉ chạy model một lần: request đến sau chờ kết quả của request đầu.
+    Kết quả numpy được lưu dạng read-only vì dùng chung giữa các caller.
+    enabled=False: luôn chạy model, không lưu gì (get trả về None).
+    """
+
+    def __init__(self, name: str, max_entries: int = 10000, ttl_seconds: float = 600.0, hash_pixels: bool = False,
+                 enabled: bool = True):
+        self.name = name
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self.hash_pixels = hash_pixels
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._pending: Dict[bytes, Future] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._expired = 0
+        _register(self)
+
+    def key(self, data: Optional[bytes] = None, img: Optional[np.ndarray] = None) -> bytes:
+        """
+        Key cho một ảnh: theo pixel nếu hash_pixels và có img, không thì theo bytes upload kèm kích thước
+        của img (ảnh đưa vào model).
+        """
+        if img is not None and (self.hash_pixels or data is None):
+            return pixel_key(img)
+        return content_key(data, None if img is None else img.shape)
+
+    def get(self, key: bytes):
+        """Kết quả đã cache cho key (đánh dấu vừa dùng), None nếu chưa có hoặc đã hết hạn."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            return self._lookup(key)
+
+    def put(self, key: bytes, value):
+        if not self.enabled or value is None:
+            return
+        if isinstance(value, np.ndarray):
+            value = value.copy()
+            value.setflags(write=False)
+        with self._lock:
+            self._store(key, value)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, stored_at = entry
+        if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            self._expired += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key, value):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def _claim(self, key):
+        """(value, None, False) nếu có trong cache; (None, future, True) nếu caller này phải chạy model;
+        (None, future, False) nếu đang có caller khác chạy model cho cùng key."""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self._hits += 1
+                return value, None, False
+            future = self._pending.get(key)
+            if future is not None:
+                self._coalesced += 1
+                return None, future, False
+            self._misses += 1
+            future = self._pending[key] = Future()
+            return None, future, True
+
+    def _finish(self, key, future, value=None, error=None):
+        if isinstance(value, np.ndarray):
+            value = value.copy()
+            value.setflags(write=False)
+        with self._lock:
+            self._pending.pop(key, None)
+            if error is None and value is not None:
+                self._store(key, value)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+        return value
+
+    def get_or_compute(self, key: bytes, compute: Callable):
+        """Kết quả cho key: lấy từ cache, chờ request đang chạy cùng key, hoặc gọi compute() rồi lưu lại.
+        Lỗi của compute không được cache."""
+        if not self.enabled:
+            return compute()
+        value, future, owner = self._claim(key)
+        if future is None:
+            return value
+        if not owner:
+            return future.result()
+        try:
+            value = compute()
+        except Exception as e:
+            self._finish(key, future, error=e)
+            raise
+        return self._finish(key, future, value)
+
+    async def get_or_compute_async(self, key: bytes, compute: Callable):
+        """Như get_or_compute, compute() trả về awaitable (vd. scheduler.infer_async); không chặn event loop."""
+        if not self.enabled:
+            return await compute()
+        value, future, owner = self._claim(key)
+        if future is None:
+            return value
+        if not owner:
+            return await asyncio.wrap_future(future)
+        try:
+            value = await compute()
+        except BaseException as e:  # kể cả CancelledError (client ngắt kết nối): không để key treo ở pending
+            self._finish(key, future, error=e)
+            raise
+        return self._finish(key, future, value)
+
+    def get_or_compute_batch(self, keys: List[bytes], items: List, batch_fn: Callable[[List], List]) -> List:
+        """Kết quả cho nhiều item: các item chưa có trong cache (mỗi key một lần) được chạy bằng một lần
+        batch_fn(items) (vd. extractor.extract_batch); trả về list cùng thứ tự với items."""
+        if not self.enabled:
+            return list(batch_fn(items))
+        results = [None] * len(items)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                value = self._lookup(key)
+                if value is not None:
+                    self._hits += 1
+                    results[i] = value
+                elif key in missing:
+                    self._coalesced += 1
+                    missing[key].append(i)
+                else:
+                    self._misses += 1
+                    missing[key] = [i]
+        if missing:
+            computed = batch_fn([items[positions[0]] for positions in missing.values()])
+            for (key, positions), value in zip(missing.items(), computed):
+                self.put(key, value)
+                for i in positions:
+                    results[i] = value
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict:
+        """Số phần tử, hit/miss, số request dùng chung kết quả đang chạy, số phần tử bị loại (LRU/TTL)."""
+        with self._lock:
+            lookups = self._hits + self._misses + self._coalesced
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hash_pixels': self.hash_pixels,
+                'hits': self._hits,
+                'misses': self._misses,
+                'coalesced': self._coalesced,
+                'hit_rate': round((self._hits + self._coalesced) / lookups, 4) if lookups else 0,
+                'evictions': self._evictions,
+                'expired': self._expired,
+            }
+
+
+# Các cache đã tạo (theo tên), dùng cho /health/detailed
+_caches: Dict[str, InferenceCache] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(cache: InferenceCache):
+    with _registry_lock:
+        _caches[cache.name] = cache
+
+
+def get_cache_stats() -> Dict:
+    with _registry_lock:
+        caches = list(_caches.values())
+    return {c.name: c.get_stats() for c in caches}
@@ -0,0 +1,142 @@
+# ===== INFERENCE SCHEDULER (MICRO-BATCHING) =====
+# File: face_api/service/inference_scheduler.py
+# Mục đích: Gom các request suy luận đồng thời thành batch, chạy model một lần cho cả batch
+
+import time
+import queue
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+
+
+class InferenceScheduler:
+    """
+    Hàng đợi dùng chung trước một model: handler gửi từng item (ảnh, tensor...) và nhận Future;
+    một thread nền gom tối đa max_batch_size item, hoặc các item đến trong max_wait_ms kể từ item
+    đầu tiên, gọi batch_fn(items) một lần rồi trả kết quả về Future của từng caller.
+
+    batch_fn nhận list item và trả về list/array kết quả cùng thứ tự (vd. extractor.extract_batch).
+    Dùng được cho mọi model: ArcFace, EmoNet, age/gender... mỗi model một scheduler.
+
+        scheduler = InferenceScheduler('arcface', extractor.extract_batch, max_batch_size=32, max_wait_ms=5)
+        emb = scheduler.infer(img)               # thread (endpoint sync)
+        emb = await scheduler.infer_async(img)   # coroutine (endpoint async), không chặn event loop
+
+    enabled=False: infer chạy batch_fn([item]) ngay trong thread gọi (không gom batch).
+    """
+
+    def __init__(self, name: str, batch_fn: Callable[[List], List], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, enabled: bool = True):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.enabled = enabled
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._items = 0
+        self._errors = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._max_queue_depth = 0
+        _register(self)
+        if enabled:
+            threading.Thread(target=self._loop, name=f'infer-{name}', daemon=True).start()
+
+    def submit(self, item) -> Future:
+        """Đưa item vào hàng đợi, trả về Future nhận kết quả."""
+        future = Future()
+        if not self.enabled:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self.batch_fn([item])[0])
+                except Exception as e:
+                    future.set_exception(e)
+            return future
+        self._queue.put((item, future, time.monotonic()))
+        depth = self._queue.qsize()
+        if depth > self._max_queue_depth:
+            with self._lock:
+                self._max_queue_depth = max(self._max_queue_depth, depth)
+        return future
+
+    def infer(self, item, timeout=None):
+        """Kết quả cho một item (chặn thread gọi tới khi batch chứa item chạy xong)."""
+        return self.submit(item).result(timeout)
+
+    async def infer_async(self, item):
+        """Như infer nhưng await được: event loop tiếp tục nhận request khác trong lúc chờ batch."""
+        return await asyncio.wrap_future(self.submit(item))
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Hết thời gian chờ vẫn lấy nốt các item đã có sẵn trong hàng đợi
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = [entry for entry in self._next_batch() if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            start = time.monotonic()
+            try:
+                results = self.batch_fn([item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                with self._lock:
+                    self._errors += 1
+                continue
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+            end = time.monotonic()
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._items += len(batch)
+                self._total_wait += sum(start - enqueued for _, _, enqueued in batch)
+                self._total_run += end - start
+
+    def get_stats(self) -> Dict:
+        """Độ sâu hàng đợi, phân bố batch size, thời gian chờ trung bình trong hàng đợi và thời gian chạy model."""
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                'enabled': self.enabled,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'batches': batches,
+                'items': self._items,
+                'errors': self._errors,
+                'avg_batch_size': round(self._items / batches, 2) if batches else 0,
+                'batch_size_histogram': {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                'avg_queue_wait_ms': round(self._total_wait / self._items * 1000, 2) if self._items else 0,
+                'avg_batch_run_ms': round(self._total_run / batches * 1000, 2) if batches else 0,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': round(self.max_wait * 1000, 2),
+            }
+
+
+# Các scheduler đã tạo (theo tên), dùng cho /health/detailed
+_schedulers: Dict[str, InferenceScheduler] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(scheduler: InferenceScheduler):
+    with _registry_lock:
+        _schedulers[scheduler.name] = scheduler
+
+
+def get_scheduler_stats() -> Dict:
+    with _registry_lock:
+        schedulers = list(_schedulers.values())
+    return {s.name: s.get_stats() for s in schedulers}
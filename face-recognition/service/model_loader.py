@@ -0,0 +1,143 @@
+# ===== MODEL LOADER (LAZY + WARM-UP) =====
+# File: face_api/service/model_loader.py
+# Mục đích: Load các model ở thread nền song song khi server khởi động (không chặn việc bind port),
+#           mỗi request chỉ chờ đúng model nó cần
+
+import time
+import asyncio
+import threading
+from typing import Callable, Dict, Optional
+
+
+class ModelNotReadyError(RuntimeError):
+    """Model chưa load xong sau thời gian chờ, hoặc load lỗi."""
+
+
+class LazyModel:
+    """
+    Model load lười: loader() chạy đúng một lần, ở thread nền khi start() (start_loading() lúc server
+    khởi động) hoặc ngay trong thread gọi nếu model được dùng trước đó (vd. script). Sau khi load,
+    warmup(model) chạy một forward mẫu để cấp phát bộ nhớ / chọn kernel trước request đầu tiên.
+
+    Dùng như chính model: lazy.extract(img) chờ model load xong (tối đa wait_timeout giây) rồi gọi
+    model.extract(img). Load lỗi hoặc chờ quá thời gian thì raise ModelNotReadyError.
+    Trong coroutine dùng `model = await lazy.get_async()` để không chặn event loop khi chờ.
+    required=True: /health/readiness chỉ trả 200 khi model này đã sẵn sàng.
+    """
+
+    def __init__(self, name: str, loader: Callable, warmup: Optional[Callable] = None, required: bool = False,
+                 wait_timeout: Optional[float] = None):
+        self.name = name
+        self.required = required
+        self._loader = loader
+        self._warmup = warmup
+        self._wait_timeout = wait_timeout
+        self._model = None
+        self._state = 'pending'
+        self._error = None
+        self._load_seconds = None
+        self._warmup_seconds = None
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        _register(self)
+
+    def start(self):
+        """Load ở thread nền (không làm gì nếu đã bắt đầu load)."""
+        if self._state == 'pending':
+            threading.Thread(target=self.load, name=f'model-load-{self.name}', daemon=True).start()
+
+    def load(self):
+        """Load + warm-up trong thread hiện tại; thread khác đang load thì trả về ngay."""
+        with self._lock:
+            if self._state != 'pending':
+                return
+            self._state = 'loading'
+        start = time.monotonic()
+        try:
+            model = self._loader()
+        except Exception as e:
+            self._error = str(e)
+            self._state = 'failed'
+            print(f"❌ Load model {self.name} lỗi: {e}")
+            self._loaded.set()
+            return
+        self._load_seconds = round(time.monotonic() - start, 3)
+        if self._warmup is not None:
+            start = time.monotonic()
+            try:
+                self._warmup(model)
+            except Exception as e:
+                # Warm-up lỗi không làm model unusable: request đầu tiên chỉ chậm hơn
+                print(f"⚠️ Warm-up model {self.name} lỗi: {e}")
+            self._warmup_seconds = round(time.monotonic() - start, 3)
+        self._model = model
+        self._state = 'ready'
+        self._loaded.set()
+        print(f"✅ Model {self.name} sẵn sàng (load {self._load_seconds}s, warm-up {self._warmup_seconds}s)")
+
+    def is_ready(self) -> bool:
+        return self._state == 'ready'
+
+    def get(self, timeout: Optional[float] = None):
+        """Model đã load; chờ tối đa timeout (mặc định wait_timeout) giây nếu đang load."""
+        if self._state == 'ready':
+            return self._model
+        if self._state == 'pending':
+            self.load()
+        if not self._loaded.wait(self._wait_timeout if timeout is None else timeout):
+            raise ModelNotReadyError(f"Model {self.name} đang được load, vui lòng thử lại sau")
+        if self._state == 'failed':
+            raise ModelNotReadyError(f"Model {self.name} không load được: {self._error}")
+        return self._model
+
+    async def get_async(self, timeout: Optional[float] = None):
+        """Như get nhưng chờ trong thread pool, event loop tiếp tục phục vụ request khác."""
+        if self._state == 'ready':
+            return self._model
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, timeout)
+
+    def get_status(self) -> Dict:
+        return {
+            'state': self._state,
+            'required': self.required,
+            'load_seconds': self._load_seconds,
+            'warmup_seconds': self._warmup_seconds,
+            'error': self._error,
+        }
+
+    def __getattr__(self, attr):
+        # Chỉ gọi khi LazyModel không có thuộc tính attr: chuyển sang model (chờ load nếu cần)
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.get(), attr)
+
+
+# Các model đã đăng ký (theo tên), dùng cho start_loading và /health/readiness
+_models: Dict[str, LazyModel] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(model: LazyModel):
+    with _registry_lock:
+        _models[model.name] = model
+
+
+def start_loading():
+    """Bắt đầu load song song mọi model đã đăng ký, mỗi model một thread nền."""
+    with _registry_lock:
+        models = list(_models.values())
+    for model in models:
+        model.start()
+
+
+def get_model_states() -> Dict:
+    with _registry_lock:
+        models = list(_models.values())
+    return {m.name: m.get_status() for m in models}
+
+
+def models_ready() -> bool:
+    """True khi mọi model required đã load xong."""
+    with _registry_lock:
+        models = list(_models.values())
+    return all(m.is_ready() for m in models if m.required)
@@ -0,0 +1,50 @@
+from config import DUPLICATE_SCORE_THRESHOLD, CROSS_CLASS_SCORE_THRESHOLD, DUPLICATE_KNN_K, DUPLICATE_TILE_SIZE
+from service.shared_instances import get_faiss_manager, get_faiss_lock
+from service.performance_monitor import track_operation
+
+# ✅ Sử dụng shared instances
+faiss_manager = get_faiss_manager()
+faiss_lock = get_faiss_lock()
+
+
+def _report(duplicate_threshold, cross_class_threshold, max_pairs):
+    return faiss_manager.find_near_duplicates(
+        duplicate_threshold=duplicate_threshold,
+        cross_class_threshold=cross_class_threshold,
+        k=DUPLICATE_KNN_K,
+        tile_size=DUPLICATE_TILE_SIZE,
+        max_pairs=max_pairs,
+    )
+
+
+@track_operation("near_duplicates")
+def near_duplicates_service(duplicate_threshold: float = DUPLICATE_SCORE_THRESHOLD,
+                            cross_class_threshold: float = CROSS_CLASS_SCORE_THRESHOLD,
+                            max_pairs: int = 200):
+    """Báo cáo ảnh trùng trong cùng người, cặp nghi gán nhầm người và dung lượng tiết kiệm nếu xóa ảnh trùng."""
+    # ✅ Đọc không lock (phiên bản gallery đã publish)
+    try:
+        return _report(duplicate_threshold, cross_class_threshold, max_pairs)
+    except Exception as e:
+        return {"message": f"Lỗi khi tìm ảnh trùng: {e}", "status_code": 500}
+
+
+@track_operation("prune_near_duplicates")
+def prune_near_duplicates_service(duplicate_threshold: float = DUPLICATE_SCORE_THRESHOLD):
+    """
+    Xóa ảnh trùng trong cùng người (mỗi cụm giữ lại ảnh có image_id nhỏ nhất) bằng một thao tác bulk.
+    Chỉ xóa khỏi FAISS gallery (giống /delete_image), không xóa dòng khuonmat trong MySQL.
+    """
+    try:
+        # Tính lại trong lock ghi để danh sách xóa khớp với gallery hiện tại
+        with faiss_lock:
+            report = _report(duplicate_threshold, 1.0, 0)
+            deleted = faiss_manager.delete_by_image_ids(report['prune_image_ids'])
+    except Exception as e:
+        return {"message": f"Lỗi khi xóa ảnh trùng: {e}", "status_code": 500}
+    return {
+        "message": f"Đã xóa {len(deleted)} ảnh trùng khỏi FAISS",
+        "deleted_image_ids": deleted,
+        "savings": report['savings'],
+        "num_vectors": faiss_manager.size(),
+    }
@@ -4,7 +4,11 @@ import torch.nn as nn
 from torchvision import transforms, models
 from PIL import Image
 import io
+import numpy as np
 from config import *
+from service.inference_scheduler import InferenceScheduler
+from service.inference_cache import InferenceCache
+from service.model_loader import LazyModel, ModelNotReadyError
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
@@ -32,23 +36,62 @@ class FaceAge(nn.Module):
     def forward(self, x):
         return self.backbone(x)
 
-# Shared model instances
-try:
+def _load_age_gender():
     model_age = FaceAge().to(device)
     model_age.load_state_dict(torch.load(AGE_MODEL, map_location=device))
     model_age.eval()
     model_gender = FaceGender().to(device)
     model_gender.load_state_dict(torch.load(GENDER_MODEL, map_location=device))
     model_gender.eval()
-except Exception as e:
-    model_age = None
-    model_gender = None
-    print(f"Error loading models: {e}")
+    return model_age, model_gender
+
+
+@torch.no_grad()
+def _warmup_age_gender(models):
+    batch = torch.zeros(1, 3, 224, 224, device=device)
+    for model in models:
+        model(batch)
+
+
+# Shared model instances: load ở thread nền khi server khởi động (service/model_loader.py)
+age_gender_models = LazyModel(
+    'age_gender',
+    _load_age_gender,
+    warmup=_warmup_age_gender if MODEL_WARMUP else None,
+    wait_timeout=MODEL_LOAD_WAIT_SECONDS
+)
+
+
+@torch.no_grad()
+def _predict_age_gender_batch(tensors):
+    """Dự đoán tuổi/giới tính cho một batch ảnh đã transform, mỗi model forward một lần."""
+    model_age, model_gender = age_gender_models.get()
+    batch = torch.stack(tensors).to(device)
+    ages = model_age(batch).view(-1).tolist()
+    genders = torch.argmax(model_gender(batch), dim=1).tolist()
+    return [(max(0, int(age)), gender_labels[gender]) for age, gender in zip(ages, genders)]
+
+
+# Micro-batching: các request /predict đồng thời dùng chung một lần forward
+age_gender_scheduler = InferenceScheduler(
+    'age_gender',
+    _predict_age_gender_batch,
+    max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+    max_wait_ms=INFERENCE_MAX_WAIT_MS,
+    enabled=INFERENCE_BATCHING
+)
+
+# Cache (tuổi, giới tính) theo hash nội dung ảnh: ảnh gửi lại không chạy model lần nữa
+age_gender_cache = InferenceCache(
+    'age_gender',
+    max_entries=INFERENCE_CACHE_MAX_ENTRIES,
+    ttl_seconds=INFERENCE_CACHE_TTL_SECONDS,
+    hash_pixels=INFERENCE_CACHE_HASH_PIXELS,
+    enabled=INFERENCE_CACHE
+)
 
 # Service function giống face_query_service
 async def predict_service(file):
-    if model_age is None or model_gender is None:
-        return {"error": "Model not loaded", "status_code": 500}
     # Đọc file bytes
     try:
         contents = await file.read()
@@ -56,12 +99,13 @@ async def predict_service(file):
     except Exception:
         return {"error": "Invalid image file", "status_code": 400}
     # Dự đoán
-    img_tensor = transform(img).unsqueeze(0).to(device)
-    with torch.no_grad():
-        age_pred = max(0, int(model_age(img_tensor).item()))
-        gender_logits = model_gender(img_tensor)
-        gender_pred = torch.argmax(gender_logits, dim=1).item()
+    key = age_gender_cache.key(contents, np.asarray(img) if age_gender_cache.hash_pixels else None)
+    try:
+        age_pred, gender_pred = await age_gender_cache.get_or_compute_async(
+            key, lambda: age_gender_scheduler.infer_async(transform(img)))
+    except ModelNotReadyError as e:
+        return {"error": str(e), "status_code": 503}
     return {
         "pred_age": age_pred,
-        "pred_gender": gender_labels[gender_pred]
+        "pred_gender": gender_pred
     }
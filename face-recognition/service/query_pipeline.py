@@ -0,0 +1,112 @@
+# ===== QUERY PIPELINE (DECODE MỘT LẦN MỖI REQUEST) =====
+# File: face_api/service/query_pipeline.py
+# Mục đích: Ảnh upload của một request được decode/resize một lần rồi dùng chung cho mọi model
+#           (anti-spoofing, EmoNet, ArcFace), thay vì mỗi model tự decode lại từ bytes
+
+from typing import Optional
+
+import numpy as np
+import cv2
+
+from service.inference_cache import content_key, pixel_key
+
+
+class QueryImage:
+    """
+    Ảnh upload của một request (/query, /query/checkin, /query/checkout, /query_top5):
+    - bgr: ảnh BGR decode bằng cv2.imdecode đúng một lần (None nếu lỗi, lý do ở decode_error)
+    - square(size, rgb): ảnh size x size mà model cần (DeepFace 224, EmoNet 256), tính một lần;
+      ảnh lớn hơn WORKING_SIZE chỉ được resize từ ảnh gốc một lần xuống WORKING_SIZE, các kích thước nhỏ
+      hơn resize tiếp từ bản đó. ArcFace không dùng square mà nhận bgr (resize một bước trong preprocess_into
+      như ảnh trong gallery)
+    - cache_key(cache, img): hash bytes (hoặc pixel) cho InferenceCache, kèm kích thước ảnh đưa vào model;
+      tính một lần cho mỗi loại key
+    Các view dùng chung giữa các stage nên không được sửa tại chỗ. Chỉ dùng trong một request (không thread-safe).
+    """
+
+    # Kích thước lớn nhất mà các model của /query cần (EmoNet 256x256)
+    WORKING_SIZE = 256
+
+    def __init__(self, data: bytes, filename: Optional[str] = None):
+        self.data = data
+        self.filename = filename
+        self._decoded = False
+        self._bgr = None
+        self._decode_error = None
+        self._views = {}
+        self._keys = {}
+
+    @classmethod
+    async def from_upload(cls, file):
+        """Đọc toàn bộ UploadFile (từ đầu file) thành QueryImage."""
+        await file.seek(0)
+        return cls(await file.read(), file.filename)
+
+    def _decode(self):
+        if self._decoded:
+            return
+        self._decoded = True
+        if not self.data:
+            self._decode_error = "file ảnh rỗng"
+            return
+        try:
+            img = cv2.imdecode(np.frombuffer(self.data, np.uint8), cv2.IMREAD_COLOR)
+        except cv2.error as e:
+            self._decode_error = f"OpenCV decode error: {e}"
+            return
+        if img is None:
+            self._decode_error = "Không decode được ảnh"
+            return
+        self._bgr = img
+
+    @property
+    def bgr(self):
+        self._decode()
+        return self._bgr
+
+    @property
+    def decode_error(self):
+        self._decode()
+        return self._decode_error
+
+    def square(self, size: int, rgb: bool = False):
+        """Ảnh size x size (BGR, hoặc RGB nếu rgb=True); None nếu không decode được."""
+        key = (size, rgb)
+        if key not in self._views:
+            if rgb:
+                bgr = self.square(size)
+                self._views[key] = None if bgr is None else cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+            else:
+                self._views[key] = self._resize(size)
+        return self._views[key]
+
+    def _resize(self, size):
+        img = self.bgr
+        if img is None:
+            return None
+        height, width = img.shape[:2]
+        if (height, width) == (size, size):
+            return img
+        if size < self.WORKING_SIZE and min(height, width) > self.WORKING_SIZE:
+            img = self.square(self.WORKING_SIZE)
+            height = width = self.WORKING_SIZE
+        shrink = height > size or width > size
+        return cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA if shrink else cv2.INTER_LINEAR)
+
+    def cache_key(self, cache, img=None):
+        """
+        Key của ảnh cho một InferenceCache (theo pixel nếu cache.hash_pixels, không thì theo bytes).
+        img: ảnh đưa vào model (None: chỉ theo ảnh upload); cùng bytes nhưng đưa vào model ảnh khác
+        kích thước (khác cách tiền xử lý) thì khác key, như InferenceCache.key.
+        """
+        if cache.hash_pixels and self.bgr is not None:
+            img = self.bgr if img is None else img
+            key = ('pixels', img.shape)
+            if key not in self._keys:
+                self._keys[key] = pixel_key(img)
+        else:
+            shape = None if img is None else img.shape
+            key = ('bytes', shape)
+            if key not in self._keys:
+                self._keys[key] = content_key(self.data, shape)
+        return self._keys[key]
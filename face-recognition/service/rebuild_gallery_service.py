@@ -0,0 +1,172 @@
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+from config import REBUILD_CHUNK_SIZE, REBUILD_DECODE_WORKERS
+from service.shared_instances import get_extractor, get_faiss_manager, get_faiss_lock
+from db.nguoi_repository import NguoiRepository
+
+# ✅ Sử dụng shared instances
+extractor = get_extractor()
+faiss_manager = get_faiss_manager()
+faiss_lock = get_faiss_lock()
+nguoi_repo = NguoiRepository()
+
+
+def _decode(row):
+    """Decode blob ảnh của một dòng khuonmat, None nếu rỗng hoặc lỗi."""
+    blob = row.get('image_url')
+    if not blob:
+        return None
+    try:
+        return cv2.imdecode(np.frombuffer(blob, np.uint8), cv2.IMREAD_COLOR)
+    except cv2.error:
+        return None
+
+
+class GalleryRebuildJob:
+    """
+    Build lại toàn bộ gallery FAISS từ ảnh trong bảng khuonmat (image_id = khuonmat.id, class_id = user_id):
+    đọc MySQL theo khối, decode song song trên thread pool (decode khối sau trong lúc model chạy khối trước),
+    embed theo batch (extractor.extract_batch), rồi thay gallery bằng FaissIndexManager.replace_gallery
+    (ghi generation mới).
+    Mỗi thời điểm chỉ chạy một job; status() trả về tiến độ và throughput.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._progress = {'status': 'idle'}
+
+    def _update(self, **fields):
+        with self._lock:
+            self._progress.update(fields)
+
+    def status(self):
+        with self._lock:
+            progress = dict(self._progress)
+        started = progress.get('started_at')
+        if started is not None:
+            elapsed = (progress.get('finished_at') or time.time()) - started
+            processed = progress.get('processed', 0)
+            rate = processed / elapsed if elapsed > 0 else 0.0
+            remaining = max(0, progress.get('total', 0) - processed)
+            progress['elapsed_s'] = round(elapsed, 1)
+            progress['images_per_second'] = round(rate, 2)
+            progress['eta_s'] = round(remaining / rate, 1) if rate > 0 and progress['status'] == 'running' else None
+            progress['percent'] = round(100.0 * processed / progress['total'], 1) if progress.get('total') else None
+        return progress
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Chạy job ở thread nền; False nếu đang có job chạy."""
+        with self._lock:
+            if self.running:
+                return False
+            self._progress = {'status': 'running', 'phase': 'starting'}
+            self._thread = threading.Thread(target=self.run, name='gallery-rebuild', daemon=True)
+            self._thread.start()
+        return True
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as e:
+            traceback.print_exc()
+            self._update(status='failed', error=str(e), finished_at=time.time())
+
+    def _embed_chunk(self, rows, futures, result):
+        images = [f.result() for f in futures]
+        ok = [i for i, img in enumerate(images) if img is not None]
+        if ok:
+            result['embeddings'].append(extractor.extract_batch([images[i] for i in ok]))
+            result['image_ids'].extend(int(rows[i]['id']) for i in ok)
+        result['failed_ids'].update(int(rows[i]['id']) for i in range(len(rows)) if images[i] is None)
+        with self._lock:
+            self._progress['processed'] += len(rows)
+            self._progress['failed'] += len(rows) - len(ok)
+
+    # Số vòng bắt kịp ngoài faiss_lock trước khi thay gallery
+    CATCH_UP_ROUNDS = 3
+
+    def _catch_up(self, embeddings, image_ids, current, failed_ids):
+        """
+        Đồng bộ kết quả embed với current (id -> user_id của bảng khuonmat): bỏ ảnh không còn trong bảng,
+        đọc + embed ảnh chưa có (trừ ảnh decode lỗi). Trả về (embeddings, image_ids, số ảnh vừa thêm).
+        """
+        keep = [i for i, image_id in enumerate(image_ids) if image_id in current]
+        embeddings = embeddings[keep]
+        image_ids = [image_ids[i] for i in keep]
+        missing = set(current) - set(image_ids) - failed_ids
+        new_rows = nguoi_repo.get_khuonmats_by_ids(missing)
+        new_images = [_decode(row) for row in new_rows]
+        ok = [i for i, img in enumerate(new_images) if img is not None]
+        failed_ids.update(int(new_rows[i]['id']) for i in range(len(new_rows)) if new_images[i] is None)
+        if ok:
+            embeddings = np.concatenate([embeddings, extractor.extract_batch([new_images[i] for i in ok])])
+            image_ids = image_ids + [int(new_rows[i]['id']) for i in ok]
+        return embeddings, image_ids, len(ok)
+
+    def _run(self):
+        self._update(status='running', phase='embedding', total=nguoi_repo.count_khuonmat(), processed=0,
+                     failed=0, started_at=time.time(), finished_at=None, error=None)
+        result = {'embeddings': [], 'image_ids': [], 'failed_ids': set()}
+        with ThreadPoolExecutor(max_workers=REBUILD_DECODE_WORKERS, thread_name_prefix='rebuild-decode') as pool:
+            pending = None
+            for rows in nguoi_repo.iter_khuonmat_chunks(REBUILD_CHUNK_SIZE):
+                futures = [pool.submit(_decode, row) for row in rows]
+                if pending is not None:
+                    self._embed_chunk(*pending, result)
+                pending = (rows, futures)
+            if pending is not None:
+                self._embed_chunk(*pending, result)
+
+        image_ids = result['image_ids']
+        embeddings = np.concatenate(result['embeddings']) if result['embeddings'] else \
+            np.empty((0, faiss_manager.embedding_size), dtype=np.float32)
+        # Bắt kịp các thay đổi trong lúc rebuild ngoài faiss_lock: bỏ ảnh đã bị xóa, đọc + embed ảnh mới thêm
+        self._update(phase='catching_up')
+        for _ in range(self.CATCH_UP_ROUNDS):
+            embeddings, image_ids, added = self._catch_up(embeddings, image_ids, nguoi_repo.get_khuonmat_ids(),
+                                                          result['failed_ids'])
+            if not added:
+                break
+
+        self._update(phase='swapping')
+        with faiss_lock:
+            # Trong lock chỉ so lại danh sách id (không đọc blob); ảnh thêm trong khoảng rất ngắn sau vòng
+            # bắt kịp cuối (thường không có) mới phải embed ở đây
+            current = nguoi_repo.get_khuonmat_ids()
+            embeddings, image_ids, _ = self._catch_up(embeddings, image_ids, current, result['failed_ids'])
+            # class_id lấy theo bảng khuonmat hiện tại (ảnh được chuyển sang người khác trong lúc rebuild),
+            # image_path giữ nguyên từ gallery cũ
+            class_ids = [current[image_id] for image_id in image_ids]
+            image_paths = [faiss_manager.image_path_of(image_id) for image_id in image_ids]
+            faiss_manager.replace_gallery(embeddings, image_ids, image_paths, class_ids)
+        self._update(status='done', phase='done', finished_at=time.time(), num_vectors=len(image_ids),
+                     generation=faiss_manager.generation)
+
+
+rebuild_job = GalleryRebuildJob()
+
+
+def start_rebuild_service():
+    if not rebuild_job.start():
+        return {"message": "Đang có job rebuild chạy", "progress": rebuild_job.status(), "status_code": 409}
+    return {"message": "Đã bắt đầu rebuild gallery từ bảng khuonmat", "progress": rebuild_job.status(),
+            "status_code": 202}
+
+
+def rebuild_status_service():
+    return rebuild_job.status()
@@ -21,11 +21,10 @@ nguoi_repo = NguoiRepository()
 @track_operation("reset_index")
 def reset_index_api_service():
     # ✅ Thread-safe reset operation
-    with faiss_lock:
-        try:
-            _ = faiss_manager.image_ids
-        except Exception as e:
-            return {"message": f"Không thể kết nối FAISS: {e}", "status_code": 500}
+    try:
+        _ = faiss_manager.size()
+    except Exception as e:
+        return {"message": f"Không thể kết nối FAISS: {e}", "status_code": 500}
     # Kiểm tra kết nối MySQL
     try:
         nguoi_repo.get_total_and_examples(limit=1)
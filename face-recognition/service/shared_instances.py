@@ -3,10 +3,20 @@
 # Mục đích: Tạo các instance duy nhất để tránh duplicate và memory leak
 
 import threading
+import time
+import numpy as np
 from model.arcface_model import ArcFaceFeatureExtractor
 from index.faiss import FaissIndexManager
+from service.inference_scheduler import InferenceScheduler
+from service.inference_cache import InferenceCache
+from service.model_loader import LazyModel
 from config import *
 
+def _warmup_extractor(extractor):
+    """Forward một batch ảnh đen cỡ batch thường gặp của micro-batching"""
+    size = min(INFERENCE_MAX_BATCH_SIZE, extractor.max_batch_size)
+    extractor.extract_batch([np.zeros((extractor.img_size, extractor.img_size, 3), dtype=np.uint8)] * size)
+
 class SharedInstances:
     """Singleton pattern để quản lý các instance dùng chung"""
     _instance = None
@@ -24,48 +34,137 @@ class SharedInstances:
         if not self._initialized:
             print("🔄 Initializing shared instances...")
             
-            # Feature Extractor - chỉ tạo 1 lần
-            self.extractor = ArcFaceFeatureExtractor(
-                model_path=MODEL_PATH, 
-                device=None
+            # Feature Extractor - chỉ tạo 1 lần, load ở thread nền (app startup); dùng như extractor thật,
+            # request đến trước khi load xong thì chờ
+            self.extractor = LazyModel(
+                'arcface',
+                lambda: ArcFaceFeatureExtractor(
+                    model_path=MODEL_PATH, 
+                    device=None,
+                    max_batch_size=EXTRACT_MAX_BATCH_SIZE,
+                    backend=EXTRACTOR_BACKEND,
+                    onnx_path=ONNX_MODEL_PATH,
+                    intra_op_threads=ONNX_INTRA_OP_THREADS,
+                    torch_mode=TORCH_INFERENCE_MODE,
+                    calibration_dir=INT8_CALIBRATION_DIR,
+                    calibration_images=INT8_CALIBRATION_IMAGES
+                ),
+                warmup=_warmup_extractor if MODEL_WARMUP else None,
+                required=True,
+                wait_timeout=MODEL_LOAD_WAIT_SECONDS
+            )
+            
+            # Micro-batching: các request query đồng thời dùng chung một lần forward ArcFace
+            self.embedding_scheduler = InferenceScheduler(
+                'arcface',
+                lambda images: self.extractor.extract_batch(images),
+                max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+                max_wait_ms=INFERENCE_MAX_WAIT_MS,
+                enabled=INFERENCE_BATCHING
+            )
+            
+            # Cache embedding theo hash nội dung ảnh, đặt trước scheduler/extractor
+            self.embedding_cache = InferenceCache(
+                'arcface',
+                max_entries=INFERENCE_CACHE_MAX_ENTRIES,
+                ttl_seconds=INFERENCE_CACHE_TTL_SECONDS,
+                hash_pixels=INFERENCE_CACHE_HASH_PIXELS,
+                enabled=INFERENCE_CACHE
             )
             
             # FAISS Manager - chỉ tạo 1 lần
             self.faiss_manager = FaissIndexManager(
                 embedding_size=512,
                 index_path=FAISS_INDEX_PATH,
-                meta_path=FAISS_META_PATH
+                meta_path=FAISS_META_PATH,
+                index_type=FAISS_INDEX_TYPE,
+                nlist=FAISS_IVF_NLIST,
+                nprobe=FAISS_IVF_NPROBE,
+                train_min=FAISS_IVF_TRAIN_MIN,
+                hnsw_m=FAISS_HNSW_M,
+                ef_construction=FAISS_HNSW_EF_CONSTRUCTION,
+                ef_search=FAISS_HNSW_EF_SEARCH,
+                embedding_dtype=FAISS_EMBEDDING_DTYPE,
+                store_dir=FAISS_STORE_DIR,
+                wal_compact_bytes=FAISS_WAL_COMPACT_BYTES,
+                wal_compact_seconds=FAISS_WAL_COMPACT_SECONDS,
+                snapshot_keep=FAISS_SNAPSHOT_KEEP,
+                verify_checksums=FAISS_SNAPSHOT_VERIFY_CHECKSUMS,
+                centroid_search=FAISS_CENTROID_SEARCH,
+                centroid_shortlist=FAISS_CENTROID_SHORTLIST,
+                pq_m=FAISS_PQ_M,
+                pq_nbits=FAISS_PQ_NBITS,
+                quant_train_min=FAISS_QUANT_TRAIN_MIN,
+                rerank_factor=FAISS_RERANK_FACTOR,
+                multi_process=FAISS_MULTI_PROCESS,
+                poll_interval=FAISS_SYNC_POLL_SECONDS
             )
             
-            # Load initial data
+            # Load initial data (generation snapshot load bằng mmap nên nhanh, load ngay thay vì ở thread nền)
             self.faiss_manager.load()
             
-            # Thread lock cho FAISS operations
+            # Lock cho các thao tác ghi FAISS (add/edit/delete/reset/reload) trong process này; giữa các
+            # worker process, FaissIndexManager tự tuần tự hóa việc ghi (FAISS_MULTI_PROCESS).
+            # Đọc (query/search) không cần lock: FaissIndexManager publish phiên bản bất biến cho reader
             self.faiss_lock = threading.Lock()
             
+            # Watcher: load generation mới do replica ghi (dùng chung volume) ở thread nền cho replica chỉ đọc,
+            # query không bị chặn vì FaissIndexManager thay phiên bản gallery bằng một lần publish.
+            # Với FAISS_MULTI_PROCESS (worker/replica cùng ghi) FaissIndexManager tự bắt kịp, watcher không làm gì
+            self.faiss_reload_status = {'reload_count': 0, 'last_reload_at': None, 'last_error': None}
+            if FAISS_WATCH_INTERVAL_SECONDS > 0:
+                threading.Thread(target=self._watch_faiss, name='faiss-index-watcher', daemon=True).start()
+            
             self._initialized = True
             print("✅ Shared instances initialized successfully!")
     
     def get_extractor(self):
-        """Lấy feature extractor (thread-safe)"""
+        """Lấy feature extractor (thread-safe, LazyModel: chờ model load xong ở lần dùng đầu)"""
         return self.extractor
     
+    def get_embedding_scheduler(self):
+        """Lấy scheduler micro-batching trước ArcFace extractor (thread-safe)"""
+        return self.embedding_scheduler
+    
+    def get_embedding_cache(self):
+        """Lấy cache embedding ArcFace theo hash nội dung ảnh (thread-safe)"""
+        return self.embedding_cache
+    
     def get_faiss_manager(self):
         """Lấy FAISS manager (thread-safe)"""
         return self.faiss_manager
     
     def get_faiss_lock(self):
-        """Lấy lock cho FAISS operations"""
+        """Lấy lock cho các thao tác ghi FAISS (reader không cần lock)"""
         return self.faiss_lock
     
+    def get_faiss_reload_status(self):
+        """Trạng thái watcher reload FAISS (số lần reload, thời điểm, lỗi gần nhất)"""
+        return dict(self.faiss_reload_status)
+    
     def reload_faiss_if_needed(self):
-        """Reload FAISS chỉ khi cần thiết"""
+        """Reload FAISS chỉ khi trên đĩa có dữ liệu mới hơn (generation snapshot / file index); True nếu đã reload"""
+        # Kiểm tra ngoài lock: phần lớn các lần poll không có gì thay đổi
+        if not self.faiss_manager.has_newer_on_disk():
+            return False
         with self.faiss_lock:
-            # Chỉ reload nếu có thay đổi
-            if hasattr(self.faiss_manager, '_needs_reload') and self.faiss_manager._needs_reload:
-                print("🔄 Reloading FAISS index...")
-                self.faiss_manager.load()
-                self.faiss_manager._needs_reload = False
+            if not self.faiss_manager.has_newer_on_disk():
+                return False
+            print("🔄 Reloading FAISS index...")
+            self.faiss_manager.load()
+        self.faiss_reload_status.update(reload_count=self.faiss_reload_status['reload_count'] + 1,
+                                        last_reload_at=time.time(), last_error=None)
+        return True
+    
+    def _watch_faiss(self):
+        """Poll thư mục FAISS mỗi FAISS_WATCH_INTERVAL_SECONDS giây (chạy được cả trên volume mạng)"""
+        while True:
+            time.sleep(FAISS_WATCH_INTERVAL_SECONDS)
+            try:
+                self.reload_faiss_if_needed()
+            except Exception as e:
+                self.faiss_reload_status['last_error'] = str(e)
+                print(f"Lỗi reload FAISS: {e}")
 
 # Global instance
 shared = SharedInstances()
@@ -74,6 +173,12 @@ shared = SharedInstances()
 def get_extractor():
     return shared.get_extractor()
 
+def get_embedding_scheduler():
+    return shared.get_embedding_scheduler()
+
+def get_embedding_cache():
+    return shared.get_embedding_cache()
+
 def get_faiss_manager():
     return shared.get_faiss_manager()
 
@@ -82,3 +187,6 @@ def get_faiss_lock():
 
 def reload_faiss_if_needed():
     return shared.reload_faiss_if_needed()
+
+def get_faiss_reload_status():
+    return shared.get_faiss_reload_status()
@@ -0,0 +1,51 @@
+from config import SIMILAR_FACES_MIN_SCORE
+from service.shared_instances import get_faiss_manager
+from service.performance_monitor import track_operation
+from db.nguoi_repository import NguoiRepository
+
+# ✅ Sử dụng shared instances
+faiss_manager = get_faiss_manager()
+nguoi_repo = NguoiRepository()
+
+
+@track_operation("similar_faces")
+def similar_faces_service(image_id: int, min_score: float = SIMILAR_FACES_MIN_SCORE, max_results: int = 20):
+    """
+    "Ai khác trông giống ảnh này": range search bằng embedding đã lưu của image_id, trả về ảnh giống nhất
+    của từng người khác (class_id khác) có score > min_score. Dùng để phát hiện người dễ bị nhận nhầm.
+    """
+    # ✅ Đọc không lock (phiên bản gallery đã publish)
+    emb = faiss_manager.get_embedding(image_id)
+    if emb is None:
+        return {"message": f"image_id {image_id} không tồn tại!", "status_code": 404}
+    class_id = faiss_manager.class_id_of(image_id)
+
+    found = faiss_manager.range_query(emb, min_score=min_score, max_results=max_results,
+                                      include_classes=True)
+    others = [c for c in found['classes'] if c['class_id'] != class_id][:max_results]
+
+    mysql_error = False
+    items = []
+    for c in others:
+        item = {
+            'class_id': c['class_id'],
+            'image_id': c['image_id'],
+            'image_path': c['image_path'],
+            'score': c['score'],
+        }
+        if not mysql_error:
+            try:
+                nguoi = nguoi_repo.get_by_id(c['class_id'])
+                if nguoi:
+                    item['nguoi'] = nguoi.to_dict()
+            except Exception as e:
+                print(f"Lỗi truy vấn MySQL: {e}")
+                mysql_error = True
+        items.append(item)
+    return {
+        'image_id': int(image_id),
+        'class_id': class_id,
+        'min_score': min_score,
+        'similar': items,
+        'count': len(items),
+    }